@@ -0,0 +1,150 @@
+# Implementations the plugin replaced, kept as they were to measure and check the replacements against
+import json
+import re
+from threading import RLock
+
+import octoprint.filemanager.util
+
+
+class BaselineGcodeParser:
+    # Gcode_parser before the single-pass tokenizer: one regex per axis
+    MOVE_RE = re.compile(r"^G0\s+|^G1\s+")
+    X_COORD_RE = re.compile(r".*\s+X([-]*\d*\.*\d*)")
+    Y_COORD_RE = re.compile(r".*\s+Y([-]*\d*\.*\d*)")
+    E_COORD_RE = re.compile(r".*\s+E([-]*\d*\.*\d*)")
+    Z_COORD_RE = re.compile(r".*\s+Z([-]*\d*\.*\d*)")
+    SPEED_VAL_RE = re.compile(r".*\s+F(\d*\.*\d*)")
+
+    def __init__(self):
+        self.last_match = None
+
+    def is_extrusion_move(self, line):
+        self.last_match = None
+        m = self.parse_move_args(line)
+        if m and (m[0] is not None or m[1] is not None) and m[3] is not None and m[3] != 0:
+            self.last_match = m
+        return self.last_match
+
+    def parse_move_args(self, line):
+        self.last_match = None
+        m = self.MOVE_RE.match(line)
+        if m:
+            x = None
+            y = None
+            z = None
+            e = None
+            speed = None
+
+            m = self.X_COORD_RE.match(line)
+            if m:
+                x = float(m.groups()[0])
+
+            m = self.Y_COORD_RE.match(line)
+            if m:
+                y = float(m.groups()[0])
+
+            m = self.Z_COORD_RE.match(line)
+            if m:
+                z = float(m.groups()[0])
+
+            m = self.E_COORD_RE.match(line)
+            if m:
+                e = float(m.groups()[0])
+
+            m = self.SPEED_VAL_RE.match(line)
+            if m:
+                speed = float(m.groups()[0])
+
+            return x, y, z, e, speed
+
+
+_z_move_re = re.compile(r'^(G0|G1)\s*Z(-?\d*\.?\d+)', re.IGNORECASE)
+
+
+class BaselineSentHook():
+    # The plugin's sent hook before dispatching on the parsed gcode: two regexes on every line, under a lock
+
+    def __init__(self):
+        self._mutex = RLock()
+        self.have_seen_m109 = False
+        self.have_seen_gcode_after_m109 = False
+        self.current_flow_rate = 1.0
+        self.current_z_offset = 0
+        self.official_z = None
+
+    def sent_gcode(self, comm_instance, phase, cmd, cmd_type, gcode, subcode=None, tags=None, *args, **kwargs):
+
+        # https://discord.com/channels/704958479194128507/708230829050036236/1082807241691893791
+        if self.have_seen_m109:
+            self.have_seen_gcode_after_m109 = True
+
+        if gcode == 'M221':
+            match = re.search(r's(\d+)', cmd, re.IGNORECASE)
+
+            if match:
+                with self._mutex:
+                    self.current_flow_rate = float(match.group(1)) / 100.0
+        elif gcode == 'M109':
+            self.have_seen_m109 = True
+            self.have_seen_gcode_after_m109 = False
+
+        match = _z_move_re.match(cmd)
+        if match:
+            if not 'plugin:celestrius' in tags:
+                with self._mutex:
+                    self.official_z =  float(match.group(2))
+                    self.move_z_offset()
+
+    def move_z_offset(self):
+        # Only sent a move when z-offset testing was active
+        if self.current_z_offset == 0 or self.official_z is None:
+            return
+
+
+class BaselineModifyComments(octoprint.filemanager.util.LineProcessorStream):
+    # The upload preprocessor before the bytes fast path and slicer detection: every line decoded, every
+    # comment matched against every slicer's pattern
+
+    def __init__(self, fileBufferedReader, object_regex, reptag):
+        super(BaselineModifyComments, self).__init__(fileBufferedReader)
+        self.patterns = []
+        for each in object_regex:
+            if each["objreg"]:
+                regex = re.compile(each["objreg"])
+                self.patterns.append(regex)
+        self._reptag = "@{0}".format(reptag)
+        self.infomatch = re.compile("; object:.*")
+        self.stopmatch = re.compile("; stop printing object ([^\t\n\r\f\v]*)")
+
+    def process_line(self, line):
+        try:
+            # if line is of type bytes then convert to string
+            line = line.decode("utf-8", "strict")
+        except (UnicodeDecodeError, AttributeError):
+            pass
+
+        if line.startswith(";"):
+            line = self._matchComment(line)
+        if not len(line):
+            return None
+        return line.encode('ascii','xmlcharrefreplace')
+
+    def _matchComment(self, line):
+        for pattern in self.patterns:
+            matched = pattern.match(line)
+            if matched:
+                obj = matched.group(1).encode('ascii','xmlcharrefreplace')
+                line = "{0} {1}\n".format(self._reptag, obj.decode('utf-8'))
+        #Match SuperSlicer Object information
+        info = self.infomatch.match(line)
+        if info:
+            objinfo = json.loads(info.group(0)[9:])
+            objname = objinfo['id'].encode('ascii','xmlcharrefreplace')
+            line = "{0}info {1} X{2} Y{3}\n".format(self._reptag, objname.decode('utf-8'), objinfo['object_center'][0], objinfo['object_center'][1])
+
+        #Match PrusaSlicer/SuperSlicer stop printing comments
+        stop = self.stopmatch.match(line)
+        if stop:
+            stopobj = stop.group(1).encode('ascii','xmlcharrefreplace')
+            line = "{0}stop {1}\n".format(self._reptag, stopobj.decode('utf-8'))
+        return line
@@ -0,0 +1,102 @@
+# Measurement shared by the benchmarks. A benchmark hands over a callable and the argument tuples to call it
+# with, one call per G-code line, the way OctoPrint calls a hook.
+import gc
+import sys
+import tracemalloc
+from time import perf_counter_ns
+
+
+def _noop(*args):
+    pass
+
+
+def _run(fn, calls):
+    start = perf_counter_ns()
+    for args in calls:
+        fn(*args)
+    return perf_counter_ns() - start
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def timer_overhead_ns(calls=((),) * 1000):
+    # perf_counter_ns() itself takes a few tens of ns, which the median no-op call shows
+    return sorted(_call_latencies(_noop, calls))[len(calls) // 2]
+
+
+def measure(fn, calls, repeat=5):
+    """
+    :param fn: what to measure, called as fn(*args) for every args in calls
+    :param calls: list of argument tuples, e.g. one per line of a G-code file
+    :return: dict with ns_per_call and calls_per_sec (best of repeat runs, loop overhead subtracted),
+             p50_ns and p99_ns of single calls, alloc_bytes_per_call (peak memory allocated during a call)
+             and retained_blocks_per_call (memory blocks still allocated after all calls)
+    """
+    n = len(calls)
+    overhead = min(_run(_noop, calls) for _ in range(repeat))
+    best = min(_run(fn, calls) for _ in range(repeat))
+    ns_per_call = max(0.0, (best - overhead) / n)
+
+    gc.disable()
+    try:
+        timer = timer_overhead_ns(calls)
+        latencies = sorted(max(0, t - timer) for t in _call_latencies(fn, calls))
+    finally:
+        gc.enable()
+
+    alloc_bytes, retained_blocks = _allocations(fn, calls)
+    return dict(
+        calls=n,
+        ns_per_call=ns_per_call,
+        calls_per_sec=1e9 / ns_per_call if ns_per_call else float('inf'),
+        p50_ns=percentile(latencies, 0.5),
+        p99_ns=percentile(latencies, 0.99),
+        alloc_bytes_per_call=alloc_bytes / n,
+        retained_blocks_per_call=retained_blocks / n,
+    )
+
+
+def _call_latencies(fn, calls):
+    latencies = []
+    for args in calls:
+        start = perf_counter_ns()
+        fn(*args)
+        latencies.append(perf_counter_ns() - start)
+    return latencies
+
+
+def _allocations(fn, calls):
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        allocated = 0
+        for args in calls:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn(*args)
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    gc.collect()
+    return allocated, sys.getallocatedblocks() - blocks
+
+
+COLUMNS = (('ns_per_call', 'ns/line', '{:.0f}'), ('calls_per_sec', 'lines/s', '{:,.0f}'),
+           ('p99_ns', 'p99 ns', '{:.0f}'), ('alloc_bytes_per_call', 'alloc B/line', '{:.1f}'),
+           ('retained_blocks_per_call', 'kept blocks/line', '{:.3f}'))
+
+
+def print_table(rows, columns=COLUMNS):
+    """
+    :param rows: list of (name, measure() result)
+    """
+    header = ['benchmark'] + [title for _, title, _ in columns]
+    table = [header] + [[name] + [fmt.format(result[key]) for key, _, fmt in columns] for name, result in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+    for row in table:
+        print('  '.join(cell.ljust(widths[0]) if i == 0 else cell.rjust(widths[i]) for i, cell in enumerate(row)))
@@ -0,0 +1,47 @@
+# Time it takes to import the plugin, in fresh interpreters. The OctoPrint modules the plugin uses are imported
+# first and not counted: OctoPrint has them loaded before it loads any plugin.
+#
+#   python -m benchmarks.import_time [--runs N] [--tree PATH]
+#
+# --tree measures another checkout, e.g. one made with "git worktree add /tmp/old <commit>".
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+_SCRIPT = '''
+import sys, time
+import flask, requests, octoprint.plugin, octoprint.events, octoprint.filemanager, octoprint.filemanager.util
+start = time.perf_counter()
+import octoprint_celestrius
+elapsed = time.perf_counter() - start
+print(elapsed, int('google.cloud.storage' in sys.modules))
+'''
+
+
+def import_secs(tree):
+    """
+    :return: seconds to import the plugin from tree in a new interpreter, and whether that imported google-cloud-storage
+    """
+    out = subprocess.run([sys.executable, '-c', _SCRIPT], cwd=tree, check=True, capture_output=True, text=True,
+                         env=dict(os.environ, PYTHONPATH=tree)).stdout.split()
+    return float(out[0]), out[1] == '1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--tree', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    args = parser.parse_args()
+
+    import_secs(args.tree)  # Warm the bytecode cache and the OS file cache
+    runs = [import_secs(args.tree) for _ in range(args.runs)]
+    times = sorted(secs for secs, _ in runs)
+    print('{}: median {:.1f} ms, min {:.1f} ms, max {:.1f} ms over {} runs; google-cloud-storage imported: {}'.format(
+        args.tree, statistics.median(times) * 1e3, times[0] * 1e3, times[-1] * 1e3, len(times),
+        'yes' if runs[0][1] else 'no'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# The sent hook while other threads read or write the label state, to check that writers serializing on a lock
+# don't slow the serial communication thread down.
+#
+#   python -m benchmarks.label_state
+import sys
+import tempfile
+import threading
+
+from testsupport import commands, new_plugin, sample_lines
+
+from .harness import measure, print_table
+
+
+def _hammer(stop, fn):
+    while not stop.is_set():
+        fn()
+
+
+def main():
+    # Every Z move and M221 writes the label state, and the sample has plenty of both
+    lines = sample_lines('prusaslicer', num_objects=4, num_layers=20)
+    calls = [(None, 'sending', cmd, None, gcode, None, tags) for cmd, gcode, tags in commands(lines)]
+
+    rows = []
+    switch_interval = sys.getswitchinterval()
+    with tempfile.TemporaryDirectory() as data_folder:
+        plugin = new_plugin(data_folder)
+        contenders = (
+            ('uncontended', None),
+            ('reader thread', lambda: plugin.label_state.z_offset),
+            ('writer thread', lambda: plugin.update_label_state(z_offset=0)),
+        )
+        for name, fn in contenders:
+            stop = threading.Event()
+            thread = None
+            # Switch threads as often as possible, so the lock is taken when the hook wants it
+            sys.setswitchinterval(1e-6)
+            if fn:
+                thread = threading.Thread(target=_hammer, args=(stop, fn))
+                thread.daemon = True
+                thread.start()
+            try:
+                rows.append(('sent_gcode, ' + name, measure(plugin.sent_gcode, calls)))
+            finally:
+                stop.set()
+                if thread:
+                    thread.join()
+                sys.setswitchinterval(switch_interval)
+
+        def unlocked_write(flow_rate):
+            plugin.label_state = plugin.label_state._replace(flow_rate=flow_rate)
+
+        def locked_write(flow_rate):
+            plugin.update_label_state(flow_rate=flow_rate)
+
+        writes = [(1.0,)] * len(calls)
+        rows.append(('label write, no lock', measure(unlocked_write, writes)))
+        rows.append(('label write, update_label_state', measure(locked_write, writes)))
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
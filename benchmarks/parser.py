@@ -0,0 +1,23 @@
+# G0/G1 parsing, old regex parser against the single-pass one, over every supported slicer's output.
+#
+#   python -m benchmarks.parser
+from octoprint_celestrius.gcode_object import Gcode_parser
+
+from testsupport import SLICERS, sample_lines
+
+from .baseline import BaselineGcodeParser
+from .harness import measure, print_table
+
+
+def main():
+    rows = []
+    for slicer in SLICERS:
+        calls = [(line,) for line in sample_lines(slicer, num_objects=4, num_layers=20)]
+        for name, parser in (('baseline', BaselineGcodeParser()), ('single-pass', Gcode_parser())):
+            rows.append(('{} {} parse_move_args'.format(slicer, name), measure(parser.parse_move_args, calls)))
+            rows.append(('{} {} is_extrusion_move'.format(slicer, name), measure(parser.is_extrusion_move, calls)))
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
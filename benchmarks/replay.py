@@ -0,0 +1,179 @@
+# Replays whole prints through the plugin the way OctoPrint drives it: the upload preprocessor, PRINT_STARTED,
+# then every line of the stored file through the @ command and queuing hooks, and whatever the queuing hook
+# lets through into the sent hook. Reports throughput, p99 latency and allocations per call of each hook.
+#
+#   python -m benchmarks.replay [--layers N] [--objects N] [--plate NAME]
+import argparse
+import gc
+import tempfile
+import tracemalloc
+from time import perf_counter_ns
+
+from testsupport import PLATES, Replay
+
+from .harness import percentile, print_table, timer_overhead_ns
+
+HOOKS = ('check_atcommand', 'check_queue', 'sent_gcode')
+
+
+def _noop_queue(comm, phase, cmd, cmd_type, gcode, tags, *args, **kwargs):
+    return cmd
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def _timed(latencies):
+    def wrap(fn):
+        def timed(*args):
+            start = perf_counter_ns()
+            result = fn(*args)
+            latencies.append(perf_counter_ns() - start)
+            return result
+        return timed
+    return wrap
+
+
+def _traced(allocated):
+    def wrap(fn):
+        def traced(*args):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            result = fn(*args)
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+            return result
+        return traced
+    return wrap
+
+
+def _tracer_overhead_bytes(calls=1000):
+    # What the tracing wrapper itself allocates per call, measured around a hook that does nothing
+    allocated = []
+    traced = _traced(allocated)(_noop)
+    _with_tracemalloc(lambda: [traced(None, 'sent', 'G1 X1', None, 'G1', None, None) for _ in range(calls)])
+    return min(allocated)
+
+
+def _row(latencies, allocated, timer, total_ns=None, num_lines=None):
+    if total_ns is None:
+        total_ns = max(0, sum(latencies) - timer * len(latencies))
+    calls = len(latencies)
+    per_call = total_ns / calls if calls else 0.0
+    per_line = total_ns / num_lines if num_lines else per_call
+    return dict(
+        calls=calls,
+        ns_per_call=per_call,
+        calls_per_sec=1e9 / per_line if per_line else float('inf'),
+        p99_ns=percentile(sorted(max(0, t - timer) for t in latencies), 0.99),
+        alloc_bytes_per_call=sum(allocated) / calls if calls else 0.0,
+    )
+
+
+def measure_plate(plate, folder, repeat=3, **sample):
+    """
+    :return: list of (name, result) rows: the preprocessor, each hook, and all hooks together per line
+    """
+    timer = timer_overhead_ns()
+    tracer = _tracer_overhead_bytes()
+    rows = []
+
+    # modify_file: lines/s of the whole upload, per-line p99 and allocations of the preprocessor
+    best = None
+    for _ in range(repeat):
+        replay = Replay(plate, folder, **sample)
+        start = perf_counter_ns()
+        replay.upload()
+        elapsed = perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    latencies, allocated = [], []
+    Replay(plate, folder, **sample).upload(_timed(latencies))
+    _with_tracemalloc(lambda: Replay(plate, folder, **sample).upload(_traced(allocated)))
+    allocated = [max(0, a - tracer) for a in allocated]
+    rows.append((plate.name + ' modify_file', _row(latencies, allocated, timer, best, len(latencies))))
+
+    # The hooks: best of a few replays for throughput, less the cost of the replay loop itself
+    best = None
+    for _ in range(repeat):
+        replay = Replay(plate, folder, **sample)
+        replay.upload()
+        replay.start()
+        start = perf_counter_ns()
+        replay.run(_noop, _noop_queue, _noop)
+        overhead = perf_counter_ns() - start
+        replay.finish()
+
+        replay = Replay(plate, folder, **sample)
+        replay.upload()
+        replay.start()
+        gc.disable()
+        try:
+            start = perf_counter_ns()
+            replay.run()
+            elapsed = perf_counter_ns() - start
+        finally:
+            gc.enable()
+        replay.finish()
+        total = max(0, elapsed - overhead)
+        best = total if best is None else min(best, total)
+    num_lines = replay.num_lines
+
+    latencies = {hook: [] for hook in HOOKS}
+    replay = Replay(plate, folder, **sample)
+    replay.upload()
+    replay.start()
+    hooks = dict(check_atcommand=replay.plugin.gcode_object.check_atcommand,
+                 check_queue=replay.plugin.gcode_object.check_queue, sent_gcode=replay.plugin.sent_gcode)
+    replay.run(**{hook: _timed(latencies[hook])(fn) for hook, fn in hooks.items()})
+    replay.finish()
+
+    allocated = {hook: [] for hook in HOOKS}
+    replay = Replay(plate, folder, **sample)
+    replay.upload()
+    replay.start()
+    hooks = dict(check_atcommand=replay.plugin.gcode_object.check_atcommand,
+                 check_queue=replay.plugin.gcode_object.check_queue, sent_gcode=replay.plugin.sent_gcode)
+    _with_tracemalloc(lambda: replay.run(**{hook: _traced(allocated[hook])(fn) for hook, fn in hooks.items()}))
+    replay.finish()
+    allocated = {hook: [max(0, a - tracer) for a in values] for hook, values in allocated.items()}
+
+    for hook in HOOKS:
+        rows.append(('{} {}'.format(plate.name, hook), _row(latencies[hook], allocated[hook], timer)))
+    all_latencies = sorted(t for hook in HOOKS for t in latencies[hook])
+    all_allocated = [a for hook in HOOKS for a in allocated[hook]]
+    rows.append(('{} all hooks, per line'.format(plate.name),
+                 dict(_row(all_latencies, all_allocated, timer, best, num_lines), calls=num_lines,
+                      ns_per_call=best / num_lines, alloc_bytes_per_call=sum(all_allocated) / num_lines)))
+    return rows
+
+
+def _with_tracemalloc(fn):
+    tracemalloc.start()
+    try:
+        fn()
+    finally:
+        tracemalloc.stop()
+
+
+COLUMNS = (('calls', 'calls', '{:,}'), ('ns_per_call', 'ns/call', '{:.0f}'), ('calls_per_sec', 'lines/s', '{:,.0f}'),
+           ('p99_ns', 'p99 ns', '{:.0f}'), ('alloc_bytes_per_call', 'alloc B/call', '{:.1f}'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--layers', type=int, default=20)
+    parser.add_argument('--objects', type=int, default=4)
+    parser.add_argument('--plate', choices=[plate.name for plate in PLATES], action='append')
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        for plate in PLATES:
+            if args.plate and plate.name not in args.plate:
+                continue
+            rows += measure_plate(plate, folder, num_objects=args.objects, num_layers=args.layers)
+    print_table(rows, COLUMNS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+# Cost of the gcode sent hook per million lines sent, old hook against the current one, over every supported
+# slicer's output. OctoPrint calls the hook on the serial communication thread for every line.
+#
+#   python -m benchmarks.sent_hook
+import tempfile
+
+from testsupport import SLICERS, commands, new_plugin, sample_lines
+
+from .baseline import BaselineSentHook
+from .harness import COLUMNS, measure, print_table
+
+# ns per line and ms per million lines are the same number
+PER_MILLION_COLUMNS = (('ns_per_call', 'ms/1M lines', '{:.0f}'),) + COLUMNS[1:]
+
+
+def main():
+    rows = []
+    with tempfile.TemporaryDirectory() as data_folder:
+        for slicer in SLICERS:
+            lines = sample_lines(slicer, num_objects=4, num_layers=20)
+            calls = [(None, 'sending', cmd, None, gcode, None, tags) for cmd, gcode, tags in commands(lines)]
+            rows.append(('{} baseline'.format(slicer), measure(BaselineSentHook().sent_gcode, calls)))
+            rows.append(('{} sent_gcode'.format(slicer), measure(new_plugin(data_folder).sent_gcode, calls)))
+    print_table(rows, PER_MILLION_COLUMNS)
+
+
+if __name__ == '__main__':
+    main()
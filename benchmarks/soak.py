@@ -0,0 +1,238 @@
+# Soak test of the capture -> write -> archive -> upload path. Runs many back-to-back prints in accelerated time
+# on one plugin with all its threads running, against a webcam served from another process and a local directory
+# standing in for the object store. Fails if memory, open files, threads or files left behind grow across prints.
+#
+#   python -m benchmarks.soak [--prints N] [--speedup X] [--webcam snapshot|stream]
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from octoprint.events import Events
+
+from octoprint_celestrius.metrics import process_stats
+from testsupport import PLATES, Replay, StubPrinter, init_octoprint, new_plugin, webcam_server, webcam_url
+
+OPERATIONAL = 'OPERATIONAL'
+PRINTING = 'PRINTING'
+PAUSED = 'PAUSED'
+
+# Events OctoPrint fires on each printer state change
+TRANSITIONS = {
+    (OPERATIONAL, PRINTING): Events.PRINT_STARTED,
+    (PRINTING, PAUSED): Events.PRINT_PAUSED,
+    (PAUSED, PRINTING): Events.PRINT_RESUMED,
+    (PRINTING, OPERATIONAL): Events.PRINT_DONE,
+    (PAUSED, OPERATIONAL): Events.PRINT_CANCELLED,
+}
+
+STEPS_PER_PRINT = 100  # The print's lines are sent in this many bursts, spread over the print time
+SETTLE_SAMPLES = 10  # Resources are read this many times after each print, 10 ms apart, and the lowest kept
+DATABASES = ('upload_queue.db', 'upload_history.db')
+
+
+def _serve_webcam(server):
+    server.serve_forever()
+
+
+def start_webcam():
+    """
+    Serve the webcam from a child process, so its sockets and threads don't count against the plugin's.
+    :return: the process, and the server's base URL
+    """
+    server = webcam_server()
+    process = multiprocessing.get_context('fork').Process(target=_serve_webcam, args=(server,), daemon=True)
+    process.start()
+    server.server_close()
+    return process, webcam_url(server, '')
+
+
+class SimulatedPrinter(StubPrinter):
+    # Moves between OPERATIONAL, PRINTING and PAUSED, firing the event OctoPrint fires for each change
+
+    def __init__(self):
+        super(SimulatedPrinter, self).__init__()
+        self.plugin = None
+        self.path = None
+
+    def transition(self, state):
+        event = TRANSITIONS.get((self.state_id, state))
+        if event is None:
+            raise ValueError('{} -> {} is not a printer state change'.format(self.state_id, state))
+        self.state_id = state
+        self.plugin.on_event(event, dict(name=self.job_name, path=self.path, origin=self.origin))
+
+
+def leftover_files(data_folder, sink_folder):
+    """
+    :return: paths of files that should be gone once every print is uploaded: anything in the data folder but
+    the databases, and partial uploads in the sink
+    """
+    leftover = []
+    for name in os.listdir(data_folder):
+        if name.split('-', 1)[0] not in DATABASES:
+            leftover.append(os.path.join(data_folder, name))
+    for root, _, files in os.walk(sink_folder):
+        leftover += [os.path.join(root, name) for name in files if name.endswith('.part')]
+    return leftover
+
+
+def settled_process_stats():
+    # A file or socket being closed by a background thread as the print ends isn't a leak. Leaks stay.
+    samples = []
+    for _ in range(SETTLE_SAMPLES):
+        samples.append(process_stats())
+        time.sleep(0.01)
+    return {key: min((s[key] for s in samples if s[key] is not None), default=None) for key in samples[0]}
+
+
+class Soak():
+
+    def __init__(self, folder, snapshot_url=None, stream_url=None, speedup=60.0, print_secs=120.0, pause_secs=20.0,
+                 cancel_every=5, drain_timeout_secs=60.0, num_layers=3):
+        self.speedup = speedup
+        self.print_secs = print_secs
+        self.pause_secs = pause_secs
+        self.cancel_every = cancel_every
+        self.drain_timeout_secs = drain_timeout_secs
+        self.num_layers = num_layers
+        self.folder = folder
+        self.data_folder = os.path.join(folder, 'data')
+        self.sink_folder = os.path.join(folder, 'object-store')
+        os.makedirs(self.data_folder)
+
+        init_octoprint()
+        plugin = self.plugin = new_plugin(
+            self.data_folder, snapshot_url=snapshot_url, stream_url=stream_url, upload_backend='local',
+            local_upload_dir=self.sink_folder, upload_rate_limit_kbps='0', io_rate_limit_kbps='0',
+            storage_budget_mb='0', min_free_disk_mb='0')
+        self.printer = plugin._printer = SimulatedPrinter()
+        self.printer.plugin = plugin
+        # Accelerated time: the plugin samples as it would on a print running this many times faster
+        next_interval = plugin.sampling_policy.next_interval
+        plugin.sampling_policy.next_interval = lambda now: next_interval(now) / speedup
+        plugin.on_after_startup()
+        self.samples = []
+
+    def sleep(self, simulated_secs):
+        time.sleep(simulated_secs / self.speedup)
+
+    def run_print(self, number):
+        plate = PLATES[number % len(PLATES)]
+        replay = Replay(plate, self.folder, num_layers=self.num_layers, plugin=self.plugin)
+        replay.upload()
+        replay.load_events()
+        self.printer.job_name = plate.filename
+        self.printer.path = replay.path
+        cancel = self.cancel_every and number % self.cancel_every == self.cancel_every - 1
+
+        kept = self.plugin.sampling_policy.kept
+        started = time.monotonic()
+        self.printer.transition(PRINTING)
+        events = replay.events
+        step = max(1, len(events) // STEPS_PER_PRINT)
+        pause_at = len(events) // 2 // step * step
+        for i in range(0, len(events), step):
+            if i == pause_at:
+                self.printer.transition(PAUSED)
+                self.sleep(self.pause_secs)
+                if cancel:
+                    break
+                self.printer.transition(PRINTING)
+            replay.run(events=events[i:i + step])
+            self.sleep(self.print_secs / STEPS_PER_PRINT)
+        self.printer.transition(OPERATIONAL)
+        print_secs = time.monotonic() - started
+        frames = self.plugin.sampling_policy.kept - kept
+
+        drained = self.wait_for_uploads()
+        sample = dict(settled_process_stats(), frames=frames, print_secs=print_secs,
+                      drain_secs=time.monotonic() - started - print_secs, drained=drained,
+                      leftover=leftover_files(self.data_folder, self.sink_folder),
+                      archived_bytes=self.plugin.upload_queue.archived_bytes)
+        self.samples.append(sample)
+        return sample
+
+    def wait_for_uploads(self):
+        # The writer flushes the print's frames, queues the upload, and the queue uploads and deletes them
+        deadline = time.monotonic() + self.drain_timeout_secs
+        while time.monotonic() < deadline:
+            if self.plugin.frame_writer.depth() == 0 and not self.plugin.upload_queue.pending_jobs() \
+                    and not leftover_files(self.data_folder, self.sink_folder):
+                return True
+            time.sleep(0.02)
+        return False
+
+    def failures(self, warmup, max_rss_growth_bytes):
+        """
+        :return: what grew or went wrong, compared with the state after the warm-up prints
+        """
+        failures = []
+        for number, sample in enumerate(self.samples):
+            if not sample['drained']:
+                failures.append('print {}: uploads not finished after {}s'.format(number, self.drain_timeout_secs))
+            if sample['leftover']:
+                failures.append('print {}: files left behind: {}'.format(number, ', '.join(sample['leftover'])))
+        _, entries = self.plugin.upload_history.query(limit=len(self.samples) + 1)
+        not_done = [entry for entry in entries if entry['status'] != 'done']
+        if not_done:
+            failures.append('uploads not done: {}'.format(', '.join(e['name'] + ' ' + e['status'] for e in not_done)))
+
+        if len(self.samples) <= warmup:
+            return failures
+        base, last = self.samples[warmup - 1] if warmup else self.samples[0], self.samples[-1]
+        for key in ('open_fds', 'threads'):
+            if base[key] is not None and max(s[key] for s in self.samples[warmup:]) > base[key]:
+                failures.append('{} grew from {} to {}'.format(key, base[key], max(s[key] for s in self.samples[warmup:])))
+        if base['rss_bytes'] is not None and last['rss_bytes'] - base['rss_bytes'] > max_rss_growth_bytes:
+            failures.append('RSS grew by {:.1f} MiB'.format((last['rss_bytes'] - base['rss_bytes']) / 2 ** 20))
+        return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--prints', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5, help='prints before the resources are baselined')
+    parser.add_argument('--speedup', type=float, default=60.0, help='how many times faster than real time')
+    parser.add_argument('--print-secs', type=float, default=120.0, help='simulated length of a print')
+    parser.add_argument('--pause-secs', type=float, default=20.0, help='simulated pause halfway through each print')
+    parser.add_argument('--cancel-every', type=int, default=5, help='cancel every Nth print while paused')
+    parser.add_argument('--webcam', choices=('snapshot', 'stream'), default='snapshot')
+    parser.add_argument('--max-rss-growth-mb', type=float, default=8.0)
+    args = parser.parse_args()
+
+    webcam, url = start_webcam()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            soak = Soak(folder, snapshot_url=url + '/snapshot' if args.webcam == 'snapshot' else None,
+                        stream_url=url + '/stream' if args.webcam == 'stream' else None, speedup=args.speedup,
+                        print_secs=args.print_secs, pause_secs=args.pause_secs, cancel_every=args.cancel_every)
+            started = time.monotonic()
+            print('{:>5} {:>9} {:>5} {:>8} {:>7} {:>8} {:>9} {:>8}'.format(
+                'print', 'RSS MiB', 'fds', 'threads', 'frames', 'print s', 'upload s', 'leftover'))
+            for number in range(args.prints):
+                s = soak.run_print(number)
+                print('{:>5} {:>9.1f} {:>5} {:>8} {:>7} {:>8.2f} {:>9.2f} {:>8}'.format(
+                    number, (s['rss_bytes'] or 0) / 2 ** 20, s['open_fds'], s['threads'], s['frames'],
+                    s['print_secs'], s['drain_secs'], len(s['leftover'])))
+            elapsed = time.monotonic() - started
+
+            frames = sum(s['frames'] for s in soak.samples)
+            archived_bytes = soak.samples[-1]['archived_bytes'] if soak.samples else 0
+            print('\n{} prints in {:.1f}s: {:.1f} prints/min, {:.1f} frames/s, {:.1f} KiB/s uploaded'.format(
+                len(soak.samples), elapsed, len(soak.samples) / elapsed * 60, frames / elapsed,
+                archived_bytes / elapsed / 1024))
+            failures = soak.failures(args.warmup, args.max_rss_growth_mb * 2 ** 20)
+    finally:
+        webcam.terminate()
+
+    if failures:
+        print('\nFAILED:\n  ' + '\n  '.join(failures))
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,31 @@
 # coding=utf-8
 from __future__ import absolute_import
-from threading import Thread, RLock
+from threading import Thread, RLock, Lock
 from datetime import datetime
 import flask
 import os
-import subprocess
 import logging
-import requests
 import time
+from time import perf_counter_ns
 import re
-import psutil
 import shutil
 import json
-import csv
-
-from google.cloud import storage
-from .gcode_object import GCodeObject
+from collections import namedtuple
+
+from octoprint.events import Events
+from .gcode_object import GCodeObject, parse_flow_rate, OFFICIAL_Z_TAG_PREFIX, Z_OFFSET_TAG_PREFIX
+from .capture_scheduler import CaptureScheduler
+from .frame_writer import FrameWriter, Frame, DROP_OLDEST
+from .webcam import new_capture_backend
+from .frame_container import container_exists, legacy_layout_exists, frame_count
+from .packager import archive_filename
+from .upload import new_upload_sink
+from .upload_queue import UploadQueue, DONE, EVICTED
+from .upload_history import UploadHistory, DEFAULT_PAGE_SIZE
+from .governor import ResourceGovernor
+from .storage_manager import StorageManager, DEGRADED, PAUSED
+from .sampling_policy import SamplingPolicy, DENSE_INTERVAL_SECS
+from .metrics import LatencyHistogram, Summary, PrometheusText, process_stats, HOOK_TIMING_SAMPLE_MASK
 
 ### (Don't forget to remove me)
 # This is a basic skeleton for your plugin's __init__.py. You probably want to adjust the class name of your plugin
@@ -30,6 +40,22 @@ import octoprint.plugin
 _logger = logging.getLogger('octoprint.plugins.celestrius')
 
 _z_move_re = re.compile('^(G0|G1)\s*Z(-?\d*\.?\d+)',  re.IGNORECASE)
+_Z_VALUE_START = frozenset('-.0123456789')
+Z_MOVE_CACHE_SIZE = 256
+
+MAX_SNAPSHOT_NUM_IN_PRINT = int(60.0 / DENSE_INTERVAL_SECS * 30)  # limit sampling to 30 minutes' worth of frames
+PRINTING_STATES = ('PRINTING', 'PAUSING', 'RESUMING', )
+FRAME_QUEUE_SIZE = 16  # ~6 seconds of frames at the densest interval
+DEGRADED_INTERVAL_FACTOR = 2.5  # Sample rate is divided by this when storage is running low
+
+# What the printer was told, as of the last command sent. Never modified in place: a change publishes a new tuple
+# by replacing self.label_state, so the capture thread reads a consistent state without taking a lock. Writers
+# go through update_label_state(), which serializes them so one thread's change can't undo another's.
+LabelState = namedtuple('LabelState', ['flow_rate', 'z_offset', 'official_z', 'num_gcode_objects_seen'])
+INITIAL_LABEL_STATE = LabelState(flow_rate=1.0, z_offset=0, official_z=None, num_gcode_objects_seen=0)
+# Builds a LabelState from a tuple of all fields without the keyword handling of LabelState(), for the sent hook
+_new_label_state = tuple.__new__
+
 class CelestriusPlugin(octoprint.plugin.SettingsPlugin,
     octoprint.plugin.AssetPlugin,
     octoprint.plugin.StartupPlugin,
@@ -40,28 +66,83 @@ class CelestriusPlugin(octoprint.plugin.SettingsPlugin,
 ):
 
     def __init__(self):
-        self._mutex = RLock()
-        self.current_flow_rate = 1.0
+        # Mostly updated by the serial communication thread while printing, reset by the others between prints
+        self.label_state = INITIAL_LABEL_STATE
+        self._label_write_lock = Lock()
+        # Heights of the "G0/G1 Z..." moves sent so far, by line. Z-hops send the same few lines over and over.
+        self._z_of_move = {}
         self.have_seen_m109 = False
         self.have_seen_gcode_after_m109 = False
 
         self.gcode_object = GCodeObject(self)
-        self.current_z_offset = 0
         self.z_offset_stepping_activated = False
-        self.official_z = None
-        self.num_gcode_objects_seen = 0
+        # sent_gcode handlers by the gcode OctoPrint already parsed out of the line, other than moves.
+        # Each returns True if the capture schedule may have changed.
+        self._sent_gcode_handlers = {
+            'M109': self._sent_m109,
+            'M221': self._sent_m221,
+        }
+
+        self.capture_scheduler = CaptureScheduler(DENSE_INTERVAL_SECS)
+        self.sampling_policy = SamplingPolicy()
+        self.frame_writer = FrameWriter(maxsize=FRAME_QUEUE_SIZE, policy=DROP_OLDEST, on_write=self.on_frame_written)
+        self.storage = None
+        self._session_lock = RLock()
+        self.capture_backend = None
+        self.upload_sink = None
+        self.upload_queue = None
+        self.upload_history = None
+        self.governor = ResourceGovernor(should_pause=self.is_printer_busy)
+        self.data_dirname = None
+        self.snapshot_num_in_current_print = 0
+        self.capture_histogram = LatencyHistogram()
+        self.sent_hook_histogram = LatencyHistogram()
+        self.sent_hook_calls = 0
+        self.frames_per_print = Summary()
+        # Settings part of should_collect(). OctoPrint's settings lookups take tens of microseconds, too slow for
+        # the sent hook, so they are read once here and again on every save.
+        self.collect_enabled = False
+        self.metrics_enabled = True
 
     ##~~ SettingsPlugin mixin
 
     def get_settings_defaults(self):
         return {
             'snapshot_url': None,
+            'stream_url': None,
             'enabled': False,
             'pilot_email': None,
             'terms_accepted': False,
             'z_offset_increment': "0.1",
+            'compress_uploads': True,
+            'upload_rate_limit_kbps': "512",
+            'io_rate_limit_kbps': "4096",
+            'storage_budget_mb': "2048",
+            'min_free_disk_mb': "1024",
+            'upload_backend': 'gcs',  # gcs, local or s3
+            'local_upload_dir': None,  # Defaults to "celestrius_uploads" next to the plugin data folder
+            's3_bucket': None,
+            's3_endpoint_url': None,
+            's3_region': None,
+            's3_access_key': None,
+            's3_secret_key': None,
+            'metrics_enabled': True,  # Time the hooks, captures and preprocessing
         }
 
+    def get_settings_restricted_paths(self):
+        return dict(admin=[['s3_access_key'], ['s3_secret_key']])
+
+    def on_settings_save(self, data):
+        octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+        self.update_collect_enabled()
+        self.update_metrics_enabled()
+        with self._session_lock:
+            self.close_capture_backend()
+        self.update_governor_limits()
+        self.update_storage_limits()
+        self.update_upload_sink()
+        self.update_capture_schedule()
+
     ##~~ AssetPlugin mixin
 
     def get_assets(self):
@@ -96,17 +177,120 @@ class CelestriusPlugin(octoprint.plugin.SettingsPlugin,
     def get_api_commands(self):
         return dict(
             upload_history=[],
+            collector_status=[],
+            reset_metrics=[],
         )
 
     def on_api_command(self, command, data):
         _logger.debug('API called: {}'.format(command))
         if command == "upload_history":
-            uploaded_list_file = os.path.join(self._data_folder, 'uploaded_print_list.csv')
-            with open(uploaded_list_file, 'r') as csvfile:
-                reader = csv.reader(csvfile)
-                rows = list(reader)
+            if not self.upload_history:
+                return flask.jsonify(dict(total=0, entries=[]))
+
+            try:
+                offset = int(data.get('offset', 0))
+                limit = int(data.get('limit', DEFAULT_PAGE_SIZE))
+                since = float(data['since']) if data.get('since') is not None else None
+            except (TypeError, ValueError):
+                return flask.make_response('offset, limit and since must be numbers', 400)
+
+            etag = '"{}:{}:{}:{}"'.format(self.upload_history.version(), offset, limit, since)
+            if flask.request.headers.get('If-None-Match') == etag:
+                return flask.make_response('', 304)
+
+            total, entries = self.upload_history.query(offset, limit, since)
+            response = flask.jsonify(dict(total=total, entries=entries))
+            response.headers['ETag'] = etag
+            return response
+
+        if command == "collector_status":
+            return flask.jsonify(self.collector_status())
+
+        if command == "reset_metrics":
+            # Start a measurement from zero, e.g. before replaying a print
+            self.reset_metrics()
+            return flask.jsonify(self.collector_status())
+
+    def on_api_get(self, request):
+        if request.values.get('format') == 'prometheus':
+            return flask.Response(self.prometheus_metrics(), mimetype=PrometheusText.CONTENT_TYPE)
+        return flask.jsonify(self.collector_status())
+
+    def reset_metrics(self):
+        for histogram in (self.capture_histogram, self.sent_hook_histogram, self.gcode_object.queue_hook_histogram,
+                          self.gcode_object.atcommand_hook_histogram, self.gcode_object.preprocess_histogram):
+            histogram.reset()
+        self.gcode_object.preprocessed_bytes = 0
+        self.sent_hook_calls = self.gcode_object.queue_hook_calls = 0
+        self.frames_per_print.reset()
+        self.capture_scheduler.reset_stats()
+        if self.upload_queue:
+            self.upload_queue.upload_histogram.reset()
+
+    def collector_status(self):
+        return dict(
+            metrics_enabled=self.metrics_enabled,
+            scheduler=self.capture_scheduler.stats(),
+            frames=self.frame_writer.stats(),
+            uploads=self.upload_queue.stats() if self.upload_queue else {},
+            upload_duration=self.upload_queue.upload_histogram.stats() if self.upload_queue else {},
+            archived_bytes=self.upload_queue.archived_bytes if self.upload_queue else 0,
+            governor=self.governor.stats(),
+            storage=self.storage.stats() if self.storage else {},
+            snapshot_num_in_current_print=self.snapshot_num_in_current_print,
+            frames_per_print=self.frames_per_print.stats(),
+            sampling=self.sampling_policy.stats(),
+            capture=self.capture_histogram.stats(),
+            queue_hook=self.gcode_object.queue_hook_histogram.stats(),
+            queue_hook_calls=self.gcode_object.queue_hook_calls,
+            atcommand_hook=self.gcode_object.atcommand_hook_histogram.stats(),
+            sent_hook=self.sent_hook_histogram.stats(),
+            sent_hook_calls=self.sent_hook_calls,
+            preprocess=self.gcode_object.preprocess_histogram.stats(),
+            preprocessed_bytes=self.gcode_object.preprocessed_bytes,
+            process=process_stats(),
+        )
 
-            return flask.jsonify(rows)
+    def prometheus_metrics(self):
+        frames = self.frame_writer.stats()
+        governor = self.governor.stats()
+        text = PrometheusText('celestrius_')
+        text.gauge('metrics_enabled', self.metrics_enabled, 'Whether hooks, captures and preprocessing are timed')
+        if self.metrics_enabled:
+            text.latency_histogram('capture_seconds', self.capture_histogram, 'Time to get a frame from the webcam')
+            text.latency_histogram('sent_hook_seconds', self.sent_hook_histogram,
+                                   'Time spent in the gcode sent hook, one call in 64')
+            text.counter('sent_hook_calls_total', self.sent_hook_calls, 'Calls of the gcode sent hook')
+            text.latency_histogram('queue_hook_seconds', self.gcode_object.queue_hook_histogram,
+                                   'Time spent in the gcode queuing hook, one call in 64')
+            text.counter('queue_hook_calls_total', self.gcode_object.queue_hook_calls,
+                         'Calls of the gcode queuing hook')
+            text.latency_histogram('atcommand_hook_seconds', self.gcode_object.atcommand_hook_histogram,
+                                   'Time spent in the @ command hook')
+            text.latency_histogram('preprocess_seconds', self.gcode_object.preprocess_histogram,
+                                   'Time to preprocess an uploaded G-code file')
+            text.counter('preprocessed_bytes_total', self.gcode_object.preprocessed_bytes,
+                         'Bytes of preprocessed G-code')
+        text.summary('frames_per_print', self.frames_per_print, 'Frames kept per collected print')
+        text.gauge('frames_in_current_print', self.snapshot_num_in_current_print, 'Frames kept in the current print')
+        text.counter('frames_captured_total', frames['captured'], 'Frames handed to the writer')
+        text.counter('frames_written_total', frames['written'], 'Frames written to disk')
+        text.counter('frames_dropped_total', frames['dropped'], 'Frames dropped because the writer fell behind')
+        text.counter('frame_bytes_written_total', frames['bytes_written'], 'Bytes of frame data written to disk')
+        text.gauge('frame_queue_depth', frames['queue_depth'], 'Frames waiting to be written')
+        text.counter('read_bytes_total', governor['read_bytes'], 'Bytes read back from disk for uploads')
+        text.counter('uploaded_bytes_total', governor['uploaded_bytes'], 'Bytes sent to the upload sink')
+        if self.upload_queue:
+            text.gauge('upload_queue_depth', self.upload_queue.stats().get('pending', 0), 'Uploads waiting to be sent')
+            text.counter('archived_bytes_total', self.upload_queue.archived_bytes, 'Archive bytes of completed uploads')
+            text.latency_histogram('upload_seconds', self.upload_queue.upload_histogram, 'Duration of completed uploads')
+        if self.storage:
+            text.gauge('storage_usage_bytes', self.storage.usage(), 'Bytes of collected data on disk')
+        process = process_stats()
+        text.gauge('process_resident_bytes', process['rss_bytes'], 'Resident memory of the OctoPrint process')
+        text.gauge('process_open_fds', process['open_fds'], 'Open file descriptors of the OctoPrint process')
+        text.gauge('process_threads', process['threads'], 'Live Python threads in the OctoPrint process')
+        return text.render()
 
 
     ##~~ Softwareupdate hook
@@ -134,6 +318,20 @@ class CelestriusPlugin(octoprint.plugin.SettingsPlugin,
 
     def on_after_startup(self):
         self.gcode_object.initialize()
+        self.update_collect_enabled()
+        self.update_metrics_enabled()
+        self.storage = StorageManager(self._data_folder, 0, 0, list_evictable=self.list_evictable_data, evict=self.evict_data)
+        self.update_storage_limits()
+        self.storage.scan()
+        self.frame_writer.start()
+        self.update_governor_limits()
+        self.upload_history = UploadHistory(os.path.join(self._data_folder, 'upload_history.db'))
+        self.upload_history.start()
+        self.upload_sink = self.new_upload_sink()
+        self.upload_queue = UploadQueue(os.path.join(self._data_folder, 'upload_queue.db'), self.upload_sink,
+                                        self.governor, on_done=self.on_upload_done)
+        self.upload_queue.start()
+        self.enqueue_leftover_data()
         main_thread = Thread(target=self.main_loop)
         main_thread.daemon = True
         main_thread.start()
@@ -142,99 +340,269 @@ class CelestriusPlugin(octoprint.plugin.SettingsPlugin,
         if self.gcode_object:
             self.gcode_object.on_event(event, payload)
 
+        if event == Events.PRINT_STARTED:
+            # Nothing of the previous print, or of the moves sent before this one started, carries over
+            self.sampling_policy.reset()
+        if event in (Events.PRINT_STARTED, Events.PRINT_RESUMED):
+            self.update_capture_schedule()
+        elif event == Events.PRINT_PAUSED:
+            self.capture_scheduler.disarm()
+            self.governor.wake()
+        elif event in (Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED, Events.DISCONNECTED, Events.ERROR):
+            self.finish_print_session()
+
     # Private methods
 
-    def main_loop(self):
-        SNAPSHOTS_INTERVAL_SECS = 0.4
-        MAX_SNAPSHOT_NUM_IN_PRINT = int(60.0 / SNAPSHOTS_INTERVAL_SECS * 30)  # limit sampling to 30 minutes
-        last_collect = 0.0
-        data_dirname = None
-        snapshot_num_in_current_print = 0
+    def update_capture_schedule(self):
+        # Arm the capture scheduler only when every collection condition holds. Called on state transitions, not polled.
+        armed = self._printer.get_state_id() in PRINTING_STATES and self.should_collect() \
+            and self.snapshot_num_in_current_print <= MAX_SNAPSHOT_NUM_IN_PRINT
+        # z-hops across the top of the collect range come here from the sent hook, mostly changing nothing
+        if armed != self.capture_scheduler.is_armed():
+            self.capture_scheduler.set_armed(armed)
+            self.gcode_object.update_queue_mode()
+
+    def is_printer_busy(self):
+        return self._printer.get_state_id() in PRINTING_STATES
+
+    def update_governor_limits(self):
+        self.governor.set_limits(
+            max(0, self._settings.get_int(["upload_rate_limit_kbps"]) or 0) * 1024,
+            max(0, self._settings.get_int(["io_rate_limit_kbps"]) or 0) * 1024)
+
+    def update_storage_limits(self):
+        if self.storage:
+            self.storage.set_limits(
+                max(0, self._settings.get_int(["storage_budget_mb"]) or 0) * 1024 * 1024,
+                max(0, self._settings.get_int(["min_free_disk_mb"]) or 0) * 1024 * 1024)
+
+    def new_upload_sink(self):
+        return new_upload_sink(
+            self._settings.get(["upload_backend"]),
+            # Not inside the data folder, where uploaded archives would count against the storage budget
+            local_directory=self._settings.get(["local_upload_dir"]) or
+                            os.path.join(os.path.dirname(self._data_folder), 'celestrius_uploads'),
+            s3_bucket=self._settings.get(["s3_bucket"]),
+            s3_endpoint_url=self._settings.get(["s3_endpoint_url"]),
+            s3_access_key=self._settings.get(["s3_access_key"]),
+            s3_secret_key=self._settings.get(["s3_secret_key"]),
+            s3_region=self._settings.get(["s3_region"]),
+        )
+
+    def update_upload_sink(self):
+        # Uploads in progress with another backend can't be resumed and start over
+        if self.upload_queue:
+            self.upload_sink = self.upload_queue.sink = self.new_upload_sink()
+            self.upload_queue.wake()
+
+    def on_frame_written(self, data_dirname, num_bytes):
+        self.storage.record_write(data_dirname, num_bytes)
+
+    def list_evictable_data(self):
+        # Oldest first: tarballs left behind by versions that compressed to disk before uploading, folders in the
+        # legacy layout that have no upload job, and the folders of queued and failed uploads
+        paths = [os.path.join(self._data_folder, name) for name in os.listdir(self._data_folder)]
+        evictable = [path for path in paths if path.endswith('.tgz')]
+        if self.upload_queue:
+            evictable += [path for path in paths if legacy_layout_exists(path) and not self.upload_queue.has_job(path)]
+            evictable += self.upload_queue.evictable_dirnames()
+        dated = []
+        for path in evictable:
+            try:
+                dated.append((os.path.getmtime(path), path))
+            except OSError:
+                pass  # e.g. the folder of a job that failed because it was gone
+        return [path for _, path in sorted(dated)]
+
+    def evict_data(self, path):
+        if os.path.isdir(path):
+            self.upload_queue.evict(path)
+            num_frames = frame_count(path)
+            shutil.rmtree(path, ignore_errors=True)
+            self.upload_history.record(os.path.basename(path), EVICTED, time.time(), num_frames=num_frames)
+        else:
+            os.remove(path)
+
+    def finish_print_session(self):
+        self.capture_scheduler.disarm()
+        with self._session_lock:
+            if self.data_dirname is not None:
+                # Queue the upload only after the writer has flushed every queued frame of this print
+                self.frame_writer.close_session(self.data_dirname, self.enqueue_upload)
+                self.frames_per_print.record(self.snapshot_num_in_current_print)
+                _logger.debug('Process resources after print: %s', process_stats())
+
+            self.snapshot_num_in_current_print = 0
+            self.data_dirname = None
+            self.sampling_policy.reset()
+            # Don't keep an MJPEG stream open between prints
+            self.close_capture_backend()
+
+        self.governor.wake()
+        if self.upload_queue:
+            self.upload_queue.wake()
+
+        self.have_seen_m109 = False
+        self.have_seen_gcode_after_m109 = False
+        self.z_offset_stepping_activated = False
+        self.update_label_state(z_offset=0, num_gcode_objects_seen=0)
+
+        self.gcode_object.update_queue_mode()
 
+    def main_loop(self):
         while True:
             try:
-                if self._printer.get_state_id() in ['PRINTING', 'PAUSING', 'RESUMING', ]:
-                    if not self.should_collect() or snapshot_num_in_current_print > MAX_SNAPSHOT_NUM_IN_PRINT:
-                        continue
-
-                    if data_dirname == None:
-                        filename = self._printer.get_current_job().get('file', {}).get('name')
-                        if not filename:
-                            continue
-
-                        print_id = str(int(datetime.now().timestamp()))
-                        data_dirname = os.path.join(self._data_folder, f'{filename}.{print_id}')
-                        os.makedirs(data_dirname, exist_ok=True)
-
-                        self.current_z_offset = 0
-
-                    ts = datetime.now().timestamp()
-                    if ts - last_collect >= SNAPSHOTS_INTERVAL_SECS:
-                        last_collect = ts
-                        snapshot_num_in_current_print += 1
-
-                        jpg = self.capture_jpeg()
-                        with open(f'{data_dirname}/{ts}.jpg', 'wb') as f:
-                            f.write(jpg)
-                        with open(f'{data_dirname}/{ts}.labels', 'w') as f:
-                            with self._mutex:
-                                f.write(f'flow_rate:{self.current_flow_rate}\n')
-                                f.write(f'z_offset:{self.current_z_offset}\n')
-
-                elif self._printer.get_state_id() in ['PAUSED']:
-                    pass
-                else:
-                    if data_dirname is not None:
-                        data_dirname_to_compress = data_dirname
-                        compress_thread = Thread(target=self.compress_and_upload, args=(data_dirname_to_compress,))
-                        compress_thread.daemon = True
-                        compress_thread.start()
-
-                    snapshot_num_in_current_print = 0
-                    data_dirname = None
-
-                    with self._mutex:
-                        self.have_seen_m109 = False
-                        self.have_seen_gcode_after_m109 = False
-                        self.current_z_offset = 0
-                        self.z_offset_stepping_activated = False
-                        self.num_gcode_objects_seen = 0
+                if self.capture_scheduler.wait() is None:
+                    return
+
+                with self._session_lock:
+                    self.collect_snapshot()
 
             except Exception as e:
                 _logger.exception('Exception occurred: %s', e)
 
-            time.sleep(0.02)
+    def collect_snapshot(self):
+        # The print may have ended between the scheduler tick and acquiring the session lock
+        if not self.capture_scheduler.is_armed():
+            return
+
+        storage_level = self.storage.check(active_path=self.data_dirname)
+        if storage_level == PAUSED:
+            return
+        interval_factor = DEGRADED_INTERVAL_FACTOR if storage_level == DEGRADED else 1
+        now = time.monotonic()
+        self.capture_scheduler.set_interval(self.sampling_policy.next_interval(now) * interval_factor)
+
+        if self.snapshot_num_in_current_print > MAX_SNAPSHOT_NUM_IN_PRINT:
+            self.capture_scheduler.disarm()
+            return
+
+        if self.data_dirname == None:
+            filename = self._printer.get_current_job().get('file', {}).get('name')
+            if not filename:
+                return
+
+            print_id = str(int(datetime.now().timestamp()))
+            self.data_dirname = os.path.join(self._data_folder, f'{filename}.{print_id}')
+
+        # Timestamp and labels are taken when the frame is requested, not after a slow webcam response
+        ts = datetime.now().timestamp()
+        state = self.label_state
+        labels = dict(flow_rate=state.flow_rate, z_offset=state.z_offset)
+        labels.update(self.timeline_labels())
+
+        start = perf_counter_ns()
+        jpg = self.capture_jpeg()
+        if self.metrics_enabled:
+            self.capture_histogram.record(perf_counter_ns() - start)
+        if jpg and self.sampling_policy.should_keep(jpg, now):
+            self.snapshot_num_in_current_print += 1
+            self.frame_writer.put(Frame(self.data_dirname, ts, jpg, labels))
+
+    def timeline_labels(self):
+        # Where the printer is in the file, from the timeline of the file being printed
+        timeline = self.gcode_object.timeline
+        if timeline is None:
+            return {}
+        current = self._printer.get_current_data()
+        if current.get('job', {}).get('file', {}).get('origin') != 'local':
+            return {}
+        filepos = current.get('progress', {}).get('filepos')
+        if filepos is None:
+            return {}
+        state = timeline.lookup(filepos)
+        if state is None:
+            return {}
+        return dict(layer=state.layer, object_name=state.object, z=state.z, file_flow_rate=state.flow_rate,
+                    extrusion=state.extrusion)
 
     def capture_jpeg(self):
-        snapshot_url = self._settings.get(["snapshot_url"])
-        if snapshot_url:
-            r = requests.get(snapshot_url, stream=True, timeout=5, verify=False )
-            r.raise_for_status()
-            jpg = r.content
-            return jpg
+        if self.capture_backend is None:
+            self.capture_backend = new_capture_backend(self._settings.get(["snapshot_url"]), self._settings.get(["stream_url"]))
+        if self.capture_backend:
+            return self.capture_backend.capture()
+
+    def close_capture_backend(self):
+        if self.capture_backend is not None:
+            self.capture_backend.close()
+            self.capture_backend = None
 
     def sent_gcode(self, comm_instance, phase, cmd, cmd_type, gcode, subcode=None, tags=None, *args, **kwargs):
+        timed = False
+        if self.metrics_enabled:
+            calls = self.sent_hook_calls = self.sent_hook_calls + 1
+            timed = not calls & HOOK_TIMING_SAMPLE_MASK
+            if timed:
+                start = perf_counter_ns()
+        schedule_changed = False
 
         # https://discord.com/channels/704958479194128507/708230829050036236/1082807241691893791
-        if self.have_seen_m109:
+        if self.have_seen_m109 and not self.have_seen_gcode_after_m109:
             self.have_seen_gcode_after_m109 = True
+            schedule_changed = True
+
+        if gcode == 'G1' or gcode == 'G0':
+            # Nearly every line sent is a move. Only the few that mention Z are worth parsing.
+            if ('Z' in cmd or 'z' in cmd) and self._sent_z_move(cmd, tags):
+                schedule_changed = True
+        else:
+            handler = self._sent_gcode_handlers.get(gcode)
+            if handler and handler(cmd, tags):
+                schedule_changed = True
+
+        if schedule_changed:
+            self.update_capture_schedule()
+        if timed:
+            self.sent_hook_histogram.record(perf_counter_ns() - start)
+
+    def _sent_m109(self, cmd, tags):
+        self.have_seen_m109 = True
+        self.have_seen_gcode_after_m109 = False
+        return True
 
-        if gcode == 'M221':
-            match = re.search(r's(\d+)', cmd, re.IGNORECASE)
-
-            if match:
-                with self._mutex:
-                    self.current_flow_rate = float(match.group(1)) / 100.0
-        elif gcode == 'M109':
-            self.have_seen_m109 = True
-            self.have_seen_gcode_after_m109 = False
-
-        match = _z_move_re.match(cmd)
-        if match:
-            if not 'plugin:celestrius' in tags:
-                with self._mutex:
-                    self.official_z =  float(match.group(2))
-                    self.move_z_offset()
+    def _sent_m221(self, cmd, tags):
+        flow_rate = parse_flow_rate(cmd)
+        if flow_rate is not None:
+            self.update_label_state(flow_rate=flow_rate)
+        return False
+
+    def _sent_z_move(self, cmd, tags):
+        # The labels take the Z offset the moment the printer is sent the move that carries it. This runs on every
+        # z-hop, so LabelState fields are read by index: (flow_rate, z_offset, official_z, num_gcode_objects_seen).
+        state = self.label_state
+        official_z = None
+        z_offset = 0
+        if state[1] or self.gcode_object.z_offset_active:
+            for tag in tags or ():
+                if tag.startswith(OFFICIAL_Z_TAG_PREFIX):
+                    # Z was rewritten with the offset in the queuing hook
+                    official_z = float(tag[len(OFFICIAL_Z_TAG_PREFIX):])
+                elif tag.startswith(Z_OFFSET_TAG_PREFIX):
+                    z_offset = float(tag[len(Z_OFFSET_TAG_PREFIX):])
+        if official_z is None:
+            official_z = self._z_of_move.get(cmd)
+            if official_z is None:
+                official_z = _parse_z_move(cmd)
+                if official_z is None:
+                    return False
+                if len(self._z_of_move) >= Z_MOVE_CACHE_SIZE:
+                    self._z_of_move.clear()
+                self._z_of_move[cmd] = official_z
+            if 'plugin:celestrius' in tags:
+                return False
+        previous_z = state[2]
+        if official_z == previous_z and z_offset == state[1]:
+            return False
+
+        lock = self._label_write_lock
+        lock.acquire()
+        state = self.label_state
+        self.label_state = _new_label_state(LabelState, (state[0], z_offset, official_z, state[3]))
+        lock.release()
+        # SamplingPolicy.on_z() without the call
+        self.sampling_policy.current_z = official_z
+        # Inline _z_in_collect_range() for both heights
+        return bool(previous_z and previous_z < 0.5) != (official_z != 0 and official_z < 0.5)
 
     def update_object_list(self, object_list, filename):
         if filename and len(object_list) > 1:
@@ -243,63 +611,75 @@ class CelestriusPlugin(octoprint.plugin.SettingsPlugin,
                 _logger.warn(f'Found {len(object_list)} objects. Activating z-offset testing')
                 self.z_offset_stepping_activated = True
 
+    def update_label_state(self, **changes):
+        with self._label_write_lock:
+            self.label_state = self.label_state._replace(**changes)
+
     def next_object(self):
-        with self._mutex:
-            self.num_gcode_objects_seen += 1
+        with self._label_write_lock:
+            state = self.label_state
+            state = self.label_state = state._replace(num_gcode_objects_seen=state.num_gcode_objects_seen + 1)
 
-            if self.z_offset_stepping_activated and self.should_collect() and self.official_z is not None:
-                self.current_z_offset = round(float(self._settings.get(["z_offset_increment"])) * self.num_gcode_objects_seen, 3)
-                _logger.warn(f'New Z-offset: {self.current_z_offset}...')
-                self.move_z_offset()
+        if self.z_offset_stepping_activated and self.should_collect() and state.official_z is not None:
+            z_offset = round(float(self._settings.get(["z_offset_increment"])) * state.num_gcode_objects_seen, 3)
+            _logger.warn(f'New Z-offset: {z_offset}...')
+            self.gcode_object.request_z_offset(z_offset)
 
-    def move_z_offset(self):
-        if self.current_z_offset == 0 or self.official_z is None:
+    def enqueue_upload(self, data_dirname):
+        if not os.path.isdir(data_dirname):  # No frame made it to disk in this print
             return
-        new_z = self.official_z + self.current_z_offset
-        _logger.warn(f'Moving z from {self.official_z} to {new_z}...')
-        self._printer.commands([f'G1 Z{round(new_z,3)}'])
+        compress = self._settings.get_boolean(["compress_uploads"])
+        object_name = f'{self._settings.get(["pilot_email"])}/{archive_filename(data_dirname, compress)}'
+        self.upload_queue.enqueue(data_dirname, object_name, compress)
+
+    def enqueue_leftover_data(self):
+        # Prints that were still being collected when OctoPrint stopped, including those from versions that wrote
+        # one file per sample
+        for name in sorted(os.listdir(self._data_folder)):
+            data_dirname = os.path.join(self._data_folder, name)
+            if (container_exists(data_dirname) or legacy_layout_exists(data_dirname)) \
+                    and not self.upload_queue.has_job(data_dirname):
+                _logger.info('Queuing leftover data ' + name)
+                self.enqueue_upload(data_dirname)
+
+    def on_upload_done(self, job, result):
+        num_frames = None
+        if result.status == DONE:
+            num_frames = frame_count(job.data_dirname)
+            _logger.info('Deleting ' + os.path.basename(job.data_dirname))
+            shutil.rmtree(job.data_dirname, ignore_errors=True)
+            self.storage.record_removed(job.data_dirname)
+        self.upload_history.record(os.path.basename(job.data_dirname), result.status, time.time(),
+                                   size_bytes=result.size_bytes, num_frames=num_frames,
+                                   duration_secs=result.duration_secs)
+
+    def update_collect_enabled(self):
+        self.collect_enabled = bool(self._settings.get(["terms_accepted"]) and self._settings.get(["enabled"]) and
+                                    self._settings.get(["pilot_email"]) is not None)
+
+    def update_metrics_enabled(self):
+        # Read once per save for the same reason as collect_enabled, and handed to the queuing hook
+        self.metrics_enabled = self.gcode_object.metrics_enabled = self._settings.get_boolean(["metrics_enabled"])
 
-    def compress_and_upload(self, data_dirname):
+    def should_collect(self):
+        return self.collect_enabled and self.have_seen_gcode_after_m109 \
+            and _z_in_collect_range(self.label_state.official_z)
+
+
+def _parse_z_move(cmd):
+    # "G1 Z0.3 F600" without the regex, which costs half again as much; anything unusual goes to the regex
+    if cmd[2:4] == ' Z' and cmd[4:5] in _Z_VALUE_START:
+        end = cmd.find(' ', 4)
         try:
-            parent_dir_name = os.path.dirname((data_dirname))
-            basename = os.path.basename((data_dirname))
-            tarball_filename = data_dirname + '.tgz'
-            _logger.info('Compressing ' + basename)
-            proc = psutil.Popen(['tar', '-C', parent_dir_name, '-zcf', tarball_filename, basename], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            proc.nice(10)
-            returncode = proc.wait()
-            (stdoutdata, stderrdata) = proc.communicate()
-            msg = 'RETURN:\n{}\nSTDOUT:\n{}\nSTDERR:\n{}\n'.format(returncode, stdoutdata, stderrdata)
-            _logger.debug(msg)
-            _logger.info('Deleting ' + basename)
-            shutil.rmtree(data_dirname, ignore_errors=True)
-            _logger.info('Uploading ' + tarball_filename)
-            self.upload_to_data_bucket(tarball_filename)
-            _logger.info('Deleting ' + tarball_filename)
-            os.remove(tarball_filename)
-            uploaded_list_file = os.path.join(self._data_folder, 'uploaded_print_list.csv')
-            with open(uploaded_list_file, 'a') as file:
-                now = datetime.now().strftime('%A, %B %d, %Y')
-                line = f'"{os.path.basename(data_dirname)}","{now}"\n'
-                file.write(line)
-
-        except Exception as e:
-            _logger.exception('Exception occurred: %s', e)
-
-    def upload_to_data_bucket(self, filename):
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'celestrius-data-collector.json')
-
-        client = storage.Client()
-        bucket = client.bucket('celestrius-data-collection')
-        basename = os.path.basename((filename))
-        with open(filename, 'rb') as f:
-            blob = bucket.blob(f'{self._settings.get(["pilot_email"])}/{basename}')
-            blob.upload_from_file(f, timeout=None)
+            return float(cmd[4:end] if end > 0 else cmd[4:])
+        except ValueError:
+            pass
+    match = _z_move_re.match(cmd)
+    return float(match.group(2)) if match else None
 
-    def should_collect(self):
-        return self._settings.get(["terms_accepted"]) and self._settings.get(["enabled"]) and \
-            self._settings.get(["pilot_email"]) is not None and self.have_seen_gcode_after_m109 \
-            and self.official_z and self.official_z < 0.5
+
+def _z_in_collect_range(z):
+    return bool(z and z < 0.5)
 
 
 # If you want your plugin to be registered within OctoPrint under a different name than what you defined in setup.py
@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+import time
+from threading import Condition
+
+
+class CaptureScheduler():
+    # Fires capture ticks on a monotonic-clock deadline while armed. When disarmed, wait()
+    # blocks on a condition variable, so an idle collector costs no CPU at all.
+
+    def __init__(self, interval):
+        self._cond = Condition()
+        self._interval = interval
+        self._armed = False
+        self._stopped = False
+        self._deadline = None
+        # Due time of the tick after the last one served, kept across disarm so re-arming right after a
+        # tick (e.g. a z-hop out of and back into range) doesn't fire again before the interval is up
+        self._next_due = 0.0
+
+        self.fired = 0
+        self.last_drift = 0.0
+        self.max_drift = 0.0
+        self.total_drift = 0.0
+
+    def arm(self):
+        with self._cond:
+            if not self._armed:
+                self._armed = True
+                self._deadline = max(time.monotonic(), self._next_due)
+                self._cond.notify_all()
+
+    def disarm(self):
+        with self._cond:
+            if self._armed:
+                self._armed = False
+                self._deadline = None
+                self._cond.notify_all()
+
+    def set_armed(self, armed):
+        if armed:
+            self.arm()
+        else:
+            self.disarm()
+
+    def is_armed(self):
+        return self._armed
+
+    def set_interval(self, interval):
+        with self._cond:
+            if interval == self._interval:
+                return
+            if self._deadline is not None:
+                # Re-anchor the pending deadline so a shorter interval takes effect immediately
+                self._deadline = min(self._deadline, time.monotonic() + interval)
+            self._interval = interval
+            self._cond.notify_all()
+
+    def get_interval(self):
+        return self._interval
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def wait(self):
+        """
+        Block until the next capture is due.
+        :return: the monotonic deadline that was served, or None once the scheduler is stopped
+        """
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                if not self._armed:
+                    self._cond.wait()
+                    continue
+
+                now = time.monotonic()
+                remaining = self._deadline - now
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+
+                deadline = self._deadline
+                self._record_drift(now - deadline)
+                self._deadline = deadline + self._interval
+                if self._deadline <= now:
+                    # Fell more than a whole interval behind. Skip the missed ticks instead of bursting.
+                    self._deadline = now + self._interval
+                self._next_due = self._deadline
+                return deadline
+
+    def _record_drift(self, drift):
+        self.fired += 1
+        self.last_drift = drift
+        self.total_drift += drift
+        if drift > self.max_drift:
+            self.max_drift = drift
+
+    def reset_stats(self):
+        with self._cond:
+            self.fired = 0
+            self.last_drift = 0.0
+            self.max_drift = 0.0
+            self.total_drift = 0.0
+
+    def stats(self):
+        return dict(
+            armed=self._armed,
+            interval=self._interval,
+            fired=self.fired,
+            last_drift=self.last_drift,
+            max_drift=self.max_drift,
+            mean_drift=self.total_drift / self.fired if self.fired else 0.0,
+        )
@@ -0,0 +1,240 @@
+from __future__ import absolute_import
+import os
+import math
+import mmap
+import struct
+from collections import namedtuple
+
+# Per-print frame container: one append-only data file of length-prefixed JPEGs, and a fixed-size index
+# record per frame that points into it. Replaces the {ts}.jpg + {ts}.labels pair written for every sample.
+
+DATA_FILENAME = 'frames.dat'
+INDEX_FILENAME = 'frames.idx'
+OBJECTS_FILENAME = 'frames.obj'  # Object names, one per line. Index records refer to them by line number.
+
+INDEX_MAGIC = b'CLFI'
+INDEX_VERSION = 3
+_index_header = struct.Struct('<4sH')
+_frame_length = struct.Struct('<I')
+# timestamp, offset of the JPEG payload in the data file, payload length, flow_rate, z_offset
+_index_record_v1 = struct.Struct('<dQIdd')
+# version 2 adds the print timeline labels: layer, object number, z and the flow rate set in the G-code file.
+# -1 and NaN stand for unknown.
+_index_record_v2 = struct.Struct('<dQIddiidd')
+# version 3 adds the commanded extrusion, mm of filament per mm of travel. Each version only appends fields.
+_index_record = struct.Struct('<dQIddiiddd')
+_index_records = {1: _index_record_v1, 2: _index_record_v2, 3: _index_record}
+
+WRITE_BUFFER_SIZE = 256 * 1024
+
+FrameRecord = namedtuple('FrameRecord', ['ts', 'offset', 'length', 'flow_rate', 'z_offset',
+                                         'layer', 'object', 'z', 'file_flow_rate', 'extrusion'])
+# Fields of versions before the last one, read as unknown
+_missing_fields = (-1, None, math.nan, math.nan, math.nan)
+
+
+def container_exists(data_dirname):
+    return os.path.exists(os.path.join(data_dirname, INDEX_FILENAME))
+
+
+def legacy_layout_exists(data_dirname):
+    # Collected before frame containers, or expanded by convert_to_directory(): a {ts}.jpg per frame
+    try:
+        with os.scandir(data_dirname) as entries:
+            return any(entry.name.endswith('.jpg') for entry in entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+
+def format_labels(record):
+    labels = f'flow_rate:{record.flow_rate}\nz_offset:{record.z_offset}\n'
+    if record.layer >= 0:
+        labels += f'layer:{record.layer}\nz:{record.z}\n'
+    if record.object is not None:
+        labels += f'object:{record.object}\n'
+    if not math.isnan(record.file_flow_rate):
+        labels += f'file_flow_rate:{record.file_flow_rate}\n'
+    if not math.isnan(record.extrusion):
+        labels += f'extrusion:{record.extrusion}\n'
+    return labels
+
+
+class FrameContainerWriter():
+
+    def __init__(self, data_dirname):
+        os.makedirs(data_dirname, exist_ok=True)
+        self.data_dirname = data_dirname
+        self.num_frames = 0
+        self.bytes_written = 0
+
+        data_path = os.path.join(data_dirname, DATA_FILENAME)
+        index_path = os.path.join(data_dirname, INDEX_FILENAME)
+        new_index = not os.path.exists(index_path) or os.path.getsize(index_path) == 0
+        self._record_struct = _index_record
+        if not new_index:
+            # Collected by an older version before a restart: keep appending records of the index's own version
+            self._record_struct = _index_records.get(_read_index_version(index_path))
+            if self._record_struct is None:
+                raise ValueError('Not a frame container index: {}'.format(data_dirname))
+        # One format character per field, after the byte order
+        self._num_fields = len(self._record_struct.format) - 1
+        self._data = open(data_path, 'ab', buffering=WRITE_BUFFER_SIZE)
+        self._index = open(index_path, 'ab', buffering=WRITE_BUFFER_SIZE)
+        self._offset = self._data.tell()
+        if new_index:
+            self._index.write(_index_header.pack(INDEX_MAGIC, INDEX_VERSION))
+
+        objects_path = os.path.join(data_dirname, OBJECTS_FILENAME)
+        self._object_ids = {name: i for i, name in enumerate(_read_object_names(objects_path))}
+        self._objects = open(objects_path, 'a', encoding='utf-8')
+
+    def append(self, ts, jpg, flow_rate, z_offset, layer=-1, object_name=None, z=math.nan, file_flow_rate=math.nan,
+               extrusion=math.nan):
+        num_bytes = 0
+        obj = -1
+        if object_name is not None:
+            obj = self._object_ids.get(object_name)
+            if obj is None:
+                obj = self._object_ids[object_name] = len(self._object_ids)
+                num_bytes += self._objects.write(object_name + '\n')
+                self._objects.flush()
+
+        length = len(jpg)
+        self._data.write(_frame_length.pack(length))
+        self._data.write(jpg)
+        payload_offset = self._offset + _frame_length.size
+        values = (ts, payload_offset, length, flow_rate, z_offset, layer, obj, z, file_flow_rate, extrusion)
+        self._index.write(self._record_struct.pack(*values[:self._num_fields]))
+        self._offset = payload_offset + length
+
+        num_bytes += _frame_length.size + length + self._record_struct.size
+        self.num_frames += 1
+        self.bytes_written += num_bytes
+        return num_bytes
+
+    def flush(self):
+        self._data.flush()
+        self._index.flush()
+
+    def close(self):
+        # Data first, so a crash never leaves index records pointing past the end of the data file
+        self._data.close()
+        self._index.close()
+        self._objects.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FrameContainerReader():
+
+    def __init__(self, data_dirname):
+        self.data_dirname = data_dirname
+        self._index_file = open(os.path.join(data_dirname, INDEX_FILENAME), 'rb')
+        self._data_file = open(os.path.join(data_dirname, DATA_FILENAME), 'rb')
+
+        size = os.fstat(self._index_file.fileno()).st_size
+        self._index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._record_struct = _index_record
+        if size:
+            magic, version = _index_header.unpack_from(self._index) if size >= _index_header.size else (None, None)
+            if magic != INDEX_MAGIC or version not in _index_records:
+                self.close()
+                raise ValueError('Not a frame container index: {}'.format(data_dirname))
+            self._record_struct = _index_records[version]
+        self._object_names = _read_object_names(os.path.join(data_dirname, OBJECTS_FILENAME))
+        # Ignore a partially written trailing record
+        self._num_frames = max(0, size - _index_header.size) // self._record_struct.size
+
+    def __len__(self):
+        return self._num_frames
+
+    def record(self, i):
+        values = self._record_struct.unpack_from(self._index, _index_header.size + i * self._record_struct.size)
+        if self._record_struct is _index_record_v1:
+            return FrameRecord(*values, *_missing_fields)
+        obj = values[6]
+        name = self._object_names[obj] if 0 <= obj < len(self._object_names) else None
+        return FrameRecord(*values[:6], name, *values[7:], *_missing_fields[len(values) - 5:])
+
+    def records(self):
+        for i in range(self._num_frames):
+            yield self.record(i)
+
+    def read(self, record):
+        self._data_file.seek(record.offset)
+        jpg = self._data_file.read(record.length)
+        if len(jpg) != record.length:
+            raise EOFError('Truncated frame at offset {} in {}'.format(record.offset, self.data_dirname))
+        return jpg
+
+    def __iter__(self):
+        # Frames are read lazily, one at a time, in capture order
+        for record in self.records():
+            yield record, self.read(record)
+
+    def close(self):
+        if isinstance(self._index, mmap.mmap):
+            self._index.close()
+        self._index_file.close()
+        self._data_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def frame_count(data_dirname):
+    """
+    :return: number of frames collected in a data folder, in either layout
+    """
+    if container_exists(data_dirname):
+        with FrameContainerReader(data_dirname) as reader:
+            return len(reader)
+    return len([name for name in os.listdir(data_dirname) if name.endswith('.jpg')])
+
+
+def _read_index_version(path):
+    with open(path, 'rb') as f:
+        header = f.read(_index_header.size)
+    if len(header) < _index_header.size:
+        return None
+    magic, version = _index_header.unpack(header)
+    return version if magic == INDEX_MAGIC else None
+
+
+def _read_object_names(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+def convert_to_directory(data_dirname, out_dirname=None, remove_container=False):
+    """
+    Expand a frame container into the legacy layout of one {ts}.jpg and one {ts}.labels file per frame.
+    :return: number of frames written
+    """
+    out_dirname = out_dirname or data_dirname
+    os.makedirs(out_dirname, exist_ok=True)
+    num = 0
+    with FrameContainerReader(data_dirname) as reader:
+        for record, jpg in reader:
+            with open(os.path.join(out_dirname, f'{record.ts}.jpg'), 'wb') as f:
+                f.write(jpg)
+            with open(os.path.join(out_dirname, f'{record.ts}.labels'), 'w') as f:
+                f.write(format_labels(record))
+            num += 1
+
+    if remove_container:
+        os.remove(os.path.join(data_dirname, DATA_FILENAME))
+        os.remove(os.path.join(data_dirname, INDEX_FILENAME))
+        if os.path.exists(os.path.join(data_dirname, OBJECTS_FILENAME)):
+            os.remove(os.path.join(data_dirname, OBJECTS_FILENAME))
+    return num
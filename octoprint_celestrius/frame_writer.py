@@ -0,0 +1,129 @@
+from __future__ import absolute_import
+import logging
+from collections import deque
+from threading import Thread, Condition
+
+from .frame_container import FrameContainerWriter
+
+_logger = logging.getLogger('octoprint.plugins.celestrius')
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+
+class Frame():
+    __slots__ = ('data_dirname', 'ts', 'jpg', 'labels')
+
+    def __init__(self, data_dirname, ts, jpg, labels):
+        self.data_dirname = data_dirname
+        self.ts = ts
+        self.jpg = jpg
+        self.labels = labels
+
+
+class _CloseSession():
+    __slots__ = ('data_dirname', 'on_closed')
+
+    def __init__(self, data_dirname, on_closed):
+        self.data_dirname = data_dirname
+        self.on_closed = on_closed
+
+
+class FrameWriter():
+    # Consumer side of the capture pipeline. The capture thread hands over frames with put() and never
+    # touches the disk. When the disk falls behind, frames are dropped according to the policy;
+    # session close markers are never dropped, so every frame of a print is flushed before on_closed runs.
+
+    def __init__(self, maxsize=16, policy=DROP_OLDEST, on_write=None):
+        self._cond = Condition()
+        self._queue = deque()
+        self._num_frames = 0
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_write = on_write
+
+        self.captured = 0
+        self.written = 0
+        self.dropped = 0
+        self.bytes_written = 0
+
+        self._thread = None
+        self._containers = {}
+
+    def start(self):
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, frame):
+        with self._cond:
+            self.captured += 1
+            if self._num_frames >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                self._drop_oldest()
+            self._queue.append(frame)
+            self._num_frames += 1
+            self._cond.notify()
+            return True
+
+    def close_session(self, data_dirname, on_closed):
+        with self._cond:
+            self._queue.append(_CloseSession(data_dirname, on_closed))
+            self._cond.notify()
+
+    def depth(self):
+        return self._num_frames
+
+    def stats(self):
+        return dict(
+            captured=self.captured,
+            written=self.written,
+            bytes_written=self.bytes_written,
+            dropped=self.dropped,
+            queue_depth=self._num_frames,
+            queue_size=self.maxsize,
+            policy=self.policy,
+        )
+
+    def _drop_oldest(self):
+        for i, item in enumerate(self._queue):
+            if isinstance(item, Frame):
+                del self._queue[i]
+                self._num_frames -= 1
+                self.dropped += 1
+                return
+
+    def _get(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            item = self._queue.popleft()
+            if isinstance(item, Frame):
+                self._num_frames -= 1
+            return item
+
+    def _run(self):
+        while True:
+            item = self._get()
+            try:
+                if isinstance(item, _CloseSession):
+                    container = self._containers.pop(item.data_dirname, None)
+                    if container:
+                        container.close()
+                    item.on_closed(item.data_dirname)
+                else:
+                    self.write_frame(item)
+                    self.written += 1
+            except Exception as e:
+                _logger.exception('Exception occurred: %s', e)
+
+    def write_frame(self, frame):
+        container = self._containers.get(frame.data_dirname)
+        if container is None:
+            container = self._containers[frame.data_dirname] = FrameContainerWriter(frame.data_dirname)
+        num_bytes = container.append(frame.ts, frame.jpg, **frame.labels)
+        self.bytes_written += num_bytes
+        if self.on_write:
+            self.on_write(frame.data_dirname, num_bytes)
@@ -8,21 +8,51 @@ import octoprint.printer
 import octoprint.util
 import re, os, sys, json
 import flask
+import math
 import time
+from time import perf_counter_ns
 from flask_login import current_user
 from octoprint.events import Events
 from octoprint.filemanager import FileDestinations
 from threading import Thread, RLock
+from collections import OrderedDict
 import logging
 
+from .metrics import LatencyHistogram, HOOK_TIMING_SAMPLE_MASK
+from .print_timeline import TimelineBuilder
+
 _logger = logging.getLogger('octoprint.plugins.celestrius')
 
+OBJECT_SCAN_CACHE_SIZE = 16
+
+# Tags a move whose Z was rewritten with the Z offset: the Z the file asked for, and the offset added to it
+OFFICIAL_Z_TAG_PREFIX = "celestrius:official_z:"
+Z_OFFSET_TAG_PREFIX = "celestrius:z_offset:"
+
+# Every supported slicer stamps itself in the header comments
+SLICER_DETECT_BYTES = 16 * 1024
+SLICER_SIGNATURES = ((b"Simplify3D", "simplify3d"),
+                     (b"Cura_SteamEngine", "cura"),
+                     (b"PrusaSlicer", "prusaslicer"),
+                     (b"SuperSlicer", "prusaslicer"),
+                     (b"Slic3r", "prusaslicer"),
+                     (b"ideaMaker", "ideamaker"))
+
+
+def detect_slicer(line):
+    if line[:1] != b";":
+        return None
+    for signature, slicer in SLICER_SIGNATURES:
+        if signature in line:
+            return slicer
+    return None
+
 class GCodeObject():
 
     def __init__(self, plugin):
         self.plugin = plugin
 
-        self.object_list = []
+        self.object_list = ObjectRegistry()
         self.skipping = False
         self.startskip = False
         self.endskip = False
@@ -39,12 +69,33 @@ class GCodeObject():
         self.prevE = 0
         self.skipstarttime = 0.0
         self.parser = Gcode_parser()
+        self.has_cancelled = False
+        self.timeline = None
+        # Z offset of the queued moves, and one requested for the next object that no move has taken yet.
+        # The labels follow in the sent hook, from the tags of the rewritten moves.
+        self._official_z = None
+        self._z_offset = 0
+        self._pending_z_offset = None
+        self._relative_moves = False
+        # Moves are being rewritten with a Z offset, or about to be. The sent hook only looks for tags while set.
+        self.z_offset_active = False
+        self._fast_path = True
+        self.metrics_enabled = True  # Set by the plugin from its settings
+        self.queue_hook_histogram = LatencyHistogram()
+        self.queue_hook_calls = 0
+        self.atcommand_hook_histogram = LatencyHistogram()
+        self.preprocess_histogram = LatencyHistogram()
+        self.preprocessed_bytes = 0
+
+        self._scan_lock = RLock()
+        self._scan_cache = OrderedDict()  # path -> ObjectScan
+        self._scan_generation = 0
+        self._scanning = None
 
 
     def on_event(self, event, payload):
 
         if event in (Events.FILE_SELECTED, Events.PRINT_STARTED):
-            self.object_list = []
             self.lastE = 0
             selectedFile = payload.get("file", "")
             if not selectedFile:
@@ -53,40 +104,121 @@ class GCodeObject():
                     # Get full path to local file
                     path = self.plugin._file_manager.path_on_disk(FileDestinations.LOCAL, path)
                 selectedFile = path
-            with open(selectedFile, "r") as f:
-                i = 0
-                for line in f:
-                    try:
-                        obj = self.process_line(line)
-                        if obj:
-                            obj["id"] = i
-                            self.object_list.append(obj)
-                            i = i + 1
-                    except (ValueError, RuntimeError):
-                        print("Error")
-            # Send objects to server
-            self._updateobjects(payload.get('name', None))
+            self._load_objects(selectedFile, payload.get('name', None))
 
         elif event in (Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED, Events.FILE_DESELECTED):
             if self.skipping:
                 self.skipping = False
                 self.plugin._printer.set_temperature('bed', 0)
                 self.plugin._printer.set_temperature('tool0', 0)
-            self.object_list = []
+            self.object_list = ObjectRegistry()
             self.objects_known = False
+            self.timeline = None
+            self.has_cancelled = False
             self.trackE = False
             self.lastE = 0
             self.active_object = 'None'
+            self._official_z = None
+            self._z_offset = 0
+            self._pending_z_offset = None
+            self._relative_moves = False
+            self.update_queue_mode()
 
 
+    def _load_objects(self, path, filename):
+        # Use the cached scan if the file hasn't changed, otherwise scan it off the event thread
+        self.timeline = None
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            _logger.warning("Cannot read objects from {0}: {1}".format(path, e))
+            return
+        key = (path, stat.st_size, stat.st_mtime)
+
+        with self._scan_lock:
+            scan = self._cached_scan(path, stat)
+            if scan is None and self._scanning == key:
+                return  # Already being scanned, e.g. FILE_SELECTED right before PRINT_STARTED
+            self._scan_generation += 1
+            generation = self._scan_generation
+            self.object_list = ObjectRegistry()
+            self.objects_known = False
+            if scan is None:
+                self._scanning = key
+
+        if scan is not None:
+            self._apply_scan(scan, filename)
+            return
+
+        scan_thread = Thread(target=self._scan_file, args=(key, filename, generation))
+        scan_thread.daemon = True
+        scan_thread.start()
+
+    def _cached_scan(self, path, stat):
+        scan = self._scan_cache.get(path)
+        if scan is None:
+            return None
+        if scan.size is None and scan.created_at <= stat.st_mtime:
+            # Filled by the upload preprocessor before the file was written. Adopt it.
+            scan.size, scan.mtime = stat.st_size, stat.st_mtime
+        if (scan.size, scan.mtime) != (stat.st_size, stat.st_mtime):
+            del self._scan_cache[path]
+            return None
+        self._scan_cache.move_to_end(path)
+        return scan
+
+    def _cache_scan(self, path, scan):
+        with self._scan_lock:
+            self._scan_cache[path] = scan
+            self._scan_cache.move_to_end(path)
+            while len(self._scan_cache) > OBJECT_SCAN_CACHE_SIZE:
+                self._scan_cache.popitem(last=False)
+
+    def _scan_file(self, key, filename, generation):
+        path, size, mtime = key
+        try:
+            scan = self.new_object_scan(size, mtime)
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        scan.feed_bytes(line)
+                    except (ValueError, RuntimeError):
+                        _logger.warning("Cannot parse line {0}".format(line))
+            scan.finish()
+            self._cache_scan(path, scan)
+        except Exception as e:
+            _logger.exception('Exception occurred: %s', e)
+            return
+        finally:
+            with self._scan_lock:
+                if self._scanning == key:
+                    self._scanning = None
+
+        with self._scan_lock:
+            # Another file may have been selected in the meantime
+            if generation != self._scan_generation:
+                return
+        self._apply_scan(scan, filename)
+
+    def _apply_scan(self, scan, filename):
+        self.object_list = scan.copy_objects()
+        self.objects_known = scan.objects_known
+        self.timeline = scan.timeline
+        self.update_queue_mode()
+        # Send objects to server
+        self._updateobjects(filename)
+
+    def new_object_scan(self, size=None, mtime=None):
+        return ObjectScan(self.reptag, self.reptagregex, self.objectinforegex, size, mtime)
+
     def _updateobjects(self, filename):
         if len(self.object_list) > 0:
             if filename:
-                self.plugin.update_object_list(self.object_list, filename)
+                self.plugin.update_object_list(self.object_list.to_list(), filename)
 
             for each in self.object_list:
-                if each["object"] in self.ignored:
-                    each["ignore"] = True
+                if each.object in self.ignored:
+                    each.ignore = True
 
     def initialize(self):
         self._settings = self.get_settings_defaults()
@@ -130,10 +262,10 @@ class GCodeObject():
     def get_settings_defaults(self):
         return dict(
             #S3D, Cura, Slic3r/Prusa/SuperSlicer, ideaMaker
-            object_regex=[{"objreg": '; process (.*)'},\
-                          {"objreg": ';MESH:(.*)'},\
-                          {"objreg": '; printing object (.*)'},\
-                          {"objreg": ';PRINTING: (.*)'}],
+            object_regex=[{"objreg": '; process (.*)', "slicer": "simplify3d"},\
+                          {"objreg": ';MESH:(.*)', "slicer": "cura"},\
+                          {"objreg": '; printing object (.*)', "slicer": "prusaslicer"},\
+                          {"objreg": ';PRINTING: (.*)', "slicer": "ideamaker"}],
             reptag="Object",
             ignored="ENDGCODE,STARTGCODE",
             beforegcode=None,
@@ -149,76 +281,44 @@ class GCodeObject():
             return file_object
         import os
         name, _ = os.path.splitext(file_object.filename)
+
+        # The preprocessor already streams every line, so collect the object scan for on_event on the way
+        scan = self.new_object_scan()
+        disk_path = None
+        try:
+            disk_path = self.plugin._file_manager.path_on_disk(FileDestinations.LOCAL, path)
+        except Exception as e:
+            _logger.warning("Not caching objects for {0}: {1}".format(path, e))
+
+        started = perf_counter_ns()
+        def on_complete():
+            if self.metrics_enabled:
+                self.preprocess_histogram.record(perf_counter_ns() - started)
+                self.preprocessed_bytes += scan.num_bytes
+            scan.finish()
+            if disk_path:
+                self._cache_scan(disk_path, scan)
+
         modfile = octoprint.filemanager.util.StreamWrapper(file_object.filename,
                                                            ModifyComments(file_object.stream(), self.object_regex,
-                                                                          self.reptag))
+                                                                          self.reptag, scan, on_complete))
 
         return modfile
 
-    def process_line(self, line):
-        if line.startswith("@{0}info".format(self.reptag)):
-            info = self.objectinforegex.match(line)
-            if info:
-                entry = self._get_entry(info.group(1))
-                if entry:
-                    return None
-                else:
-                    # Making the perhaps poor assumption that all objects are known
-                    self.objects_known = True
-                    return dict({"object": info.group(1),
-                                 "id": None,
-                                 "active": False,
-                                 "cancelled": False,
-                                 "ignore": False,
-                                 "max_x": float(info.group(2)),
-                                 "min_x": float(info.group(2)),
-                                 "max_y": float(info.group(3)),
-                                 "min_y": float(info.group(3))
-                    })
-
-        if line.startswith("@{0}".format(self.reptag)):
-            obj = self._check_object(line)
-            if obj:
-                entry = self._get_entry(obj)
-                if entry:
-                    return None
-                else:
-                    return dict({"object": obj,
-                                 "id": None,
-                                 "active": False,
-                                 "cancelled": False,
-                                 "ignore": False,
-                                 "max_x": 0,
-                                 "min_x": 10000,
-                                 "max_y": 0,
-                                 "min_y": 10000})
-        return None
-
-    def _check_object(self, line):
-        matched = self.reptagregex.match(line)
-        if matched:
-            obj = matched.group(1)
-            return obj
-        return None
-
     def _get_entry(self, name):
-        for o in self.object_list:
-            if o["object"] == name:
-                return o
-        return None
+        return self.object_list.get(name)
 
     def _get_entry_byid(self, objid):
-        for o in self.object_list:
-            if o["id"] == int(objid):
-                return o
-        return None
+        return self.object_list.get_by_id(objid)
 
     def _cancel_object(self, cancelled):
         obj = self._get_entry_byid(cancelled)
-        obj["cancelled"] = True
-        _logger.info("Object {0} cancelled".format(obj["object"]))
-        if obj["object"] == self.active_object:
+        obj.cancelled = True
+        self.has_cancelled = True
+        _logger.info("Object {0} cancelled".format(obj.object))
+        if obj.object == self.active_object:
             self.skipping = True
+        self.update_queue_mode()
 
     def _skip_allow(self, cmd):
         for allow in self.allowedregex:
@@ -234,8 +334,18 @@ class GCodeObject():
         return None,
 
     def check_atcommand(self, comm, phase, command, parameters, tags=None, *args, **kwargs):
+        if not self.metrics_enabled:
+            self._check_atcommand(command, parameters)
+            return
+        start = perf_counter_ns()
+        try:
+            self._check_atcommand(command, parameters)
+        finally:
+            self.atcommand_hook_histogram.record(perf_counter_ns() - start)
 
-        if command != self.reptag:
+    def _check_atcommand(self, command, parameters):
+
+        if command == self.reptag:
             self.plugin.next_object()
 
         if command == "{0}stop".format(self.reptag) and self._settings.get('stoptags') and self.skipping:
@@ -249,18 +359,99 @@ class GCodeObject():
         if not entry:
             _logger.info("Could not get entry {0}".format(parameters))
             return
-        if entry["cancelled"]:
+        if entry.cancelled:
             _logger.info("Hit a cancelled object, {0}".format(parameters))
             self.skipstarttime = time.time()
             self.skipping = True
             self.startskip = True
+            self.update_queue_mode()
         else:
             if self.skipping:
                 self.skipping = False
                 self.endskip = True
-            self.active_object = entry["object"]
+            self.active_object = entry.object
+
+    def update_queue_mode(self):
+        # The full queuing hook is only needed to skip cancelled objects, to learn object bounds the file scan
+        # couldn't provide, or to feed extrusion activity to the sampling policy while collecting.
+        # Everything else takes the fast path.
+        self.z_offset_active = self._pending_z_offset is not None or self._z_offset != 0
+        self._fast_path = not (self.has_cancelled or self.skipping or self.startskip or self.endskip
+                               or (len(self.object_list) > 0 and not self.objects_known)
+                               or self.plugin.capture_scheduler.is_armed()
+                               or self.z_offset_active)
+
+    def request_z_offset(self, z_offset):
+        # Called at queue time as the next object starts. Moves queued from here on take the new offset.
+        self._pending_z_offset = z_offset
+        self.update_queue_mode()
 
     def check_queue(self, comm_instance, phase, cmd, cmd_type, gcode, tags, *args, **kwargs):
+        timed = False
+        if self.metrics_enabled:
+            calls = self.queue_hook_calls = self.queue_hook_calls + 1
+            timed = not calls & HOOK_TIMING_SAMPLE_MASK
+            if timed:
+                start = perf_counter_ns()
+        # Only absolute moves can take the Z offset
+        if gcode == "G90":
+            self._relative_moves = False
+        elif gcode == "G91":
+            self._relative_moves = True
+        if self._fast_path:
+            # Keep the extrusion mode current so the full path starts from the right state
+            if gcode == "M82":
+                self.trackE = True
+            elif gcode == "M83":
+                self.trackE = False
+        else:
+            cmd = self._check_queue_full(cmd)
+            if (gcode == "G1" or gcode == "G0") and isinstance(cmd, str) \
+                    and (self._pending_z_offset is not None or self._z_offset != 0):
+                cmd = self._offset_z_move(cmd, cmd_type, tags)
+        if timed:
+            self.queue_hook_histogram.record(perf_counter_ns() - start)
+        return cmd
+
+    def _offset_z_move(self, cmd, cmd_type, tags):
+        # Rewrite the Z of the move in place rather than sending an extra move, so the nozzle is never
+        # at the wrong height. A new offset waits for the slicer's next Z move or for a move that doesn't
+        # extrude, so a line being printed never changes height halfway.
+        args = self.parser.parse_move_args(cmd)
+        if args is None or self._relative_moves:
+            return cmd
+        official_z = args[2]
+        if official_z is None:
+            if self._pending_z_offset is None or args[3] is not None:
+                return cmd
+            official_z = self._official_z if self._official_z is not None else self.plugin.label_state.official_z
+            if official_z is None:
+                return cmd
+            z_index = None
+        else:
+            self._official_z = official_z
+            tokens = cmd.split()
+            z_index = next(i for i, token in enumerate(tokens) if token[:1] in ("Z", "z"))
+
+        if self._pending_z_offset is not None:
+            self._z_offset = self._pending_z_offset
+            self._pending_z_offset = None
+            self.update_queue_mode()
+        z_offset = self._z_offset
+        if z_offset == 0 and z_index is not None:
+            return cmd  # Sent as the file has it, and labelled with no offset
+
+        z = "Z{0}".format(round(official_z + z_offset, 3))
+        if z_index is None:
+            tokens = cmd.split()
+            tokens.append(z)
+        else:
+            tokens[z_index] = z
+        _logger.info("Z-offset {0}: {1} -> {2}".format(z_offset, official_z, z[1:]))
+        return " ".join(tokens), cmd_type, set(tags or ()) | {OFFICIAL_Z_TAG_PREFIX + repr(official_z),
+                                                             Z_OFFSET_TAG_PREFIX + repr(z_offset)}
+
+    def _check_queue_full(self, cmd):
         # Need this or @ commands get caught in skipping block
         #if self._check_object(cmd):
         #    return cmd
@@ -321,6 +512,8 @@ class GCodeObject():
             self.update_objects_position(e_move)
 
         if e_move:
+            if e_move[3] > (self.prevE if self.trackE else 0.0):
+                self.plugin.sampling_policy.on_extrusion()
             self.prevE = e_move[3]
 
         return cmd
@@ -333,14 +526,14 @@ class GCodeObject():
                 obj = self._get_entry(self.active_object)
                 if obj:
                     # min max X, Y position
-                    if e_move[0] > obj["max_x"]:
-                        obj["max_x"] = e_move[0]
-                    if e_move[1] > obj["max_y"]:
-                        obj["max_y"] = e_move[1]
-                    if e_move[0] < obj["min_x"]:
-                        obj["min_x"] = e_move[0]
-                    if e_move[1] < obj["min_y"]:
-                        obj["min_y"] = e_move[1]
+                    if e_move[0] > obj.max_x:
+                        obj.max_x = e_move[0]
+                    if e_move[1] > obj.max_y:
+                        obj.max_y = e_move[1]
+                    if e_move[0] < obj.min_x:
+                        obj.min_x = e_move[0]
+                    if e_move[1] < obj.min_y:
+                        obj.min_y = e_move[1]
 
             # Relative extrusiom
             elif e_move[3] > 0.0 and not self.trackE:
@@ -348,29 +541,294 @@ class GCodeObject():
                 obj = self._get_entry(self.active_object)
                 if obj:
                     # min max X, Y position
-                    if e_move[0] is not None and e_move[0] > obj["max_x"]:
-                        obj["max_x"] = e_move[0]
-                    if e_move[1] is not None and e_move[1] > obj["max_y"]:
-                        obj["max_y"] = e_move[1]
-                    if e_move[0] is not None and e_move[0] < obj["min_x"]:
-                        obj["min_x"] = e_move[0]
-                    if e_move[1] is not None and e_move[1] < obj["min_y"]:
-                        obj["min_y"] = e_move[1]
+                    if e_move[0] is not None and e_move[0] > obj.max_x:
+                        obj.max_x = e_move[0]
+                    if e_move[1] is not None and e_move[1] > obj.max_y:
+                        obj.max_y = e_move[1]
+                    if e_move[0] is not None and e_move[0] < obj.min_x:
+                        obj.min_x = e_move[0]
+                    if e_move[1] is not None and e_move[1] < obj.min_y:
+                        obj.min_y = e_move[1]
         except Exception as err:
             _logger.error("Error updating object position: " + str(err))
 
 
-# stolen directly from filaswitch, https://github.com/spegelius/filaswitch
+class ObjectEntry():
+    __slots__ = ("object", "id", "active", "cancelled", "ignore", "max_x", "min_x", "max_y", "min_y",
+                 "min_z", "max_z", "layer_count", "extruded")
+    # Shape sent to update_object_list
+    JSON_KEYS = ("object", "id", "active", "cancelled", "ignore", "max_x", "min_x", "max_y", "min_y")
+
+    def __init__(self, name, objid, max_x=0, min_x=10000, max_y=0, min_y=10000):
+        self.object = name
+        self.id = objid
+        self.active = False
+        self.cancelled = False
+        self.ignore = False
+        self.max_x = max_x
+        self.min_x = min_x
+        self.max_y = max_y
+        self.min_y = min_y
+        self.min_z = None
+        self.max_z = None
+        self.layer_count = 0
+        self.extruded = 0.0
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.JSON_KEYS}
+
+    def copy(self):
+        entry = ObjectEntry.__new__(ObjectEntry)
+        for k in self.__slots__:
+            setattr(entry, k, getattr(self, k))
+        return entry
+
+
+class ObjectRegistry():
+    # Objects in file order, with O(1) lookup by name and by id
+
+    def __init__(self):
+        self._entries = []
+        self._by_name = {}
+        self._by_id = {}
+
+    def add(self, name, **bounds):
+        entry = ObjectEntry(name, len(self._entries), **bounds)
+        self._entries.append(entry)
+        self._by_name[name] = entry
+        self._by_id[entry.id] = entry
+        return entry
+
+    def get(self, name):
+        return self._by_name.get(name)
+
+    def get_by_id(self, objid):
+        return self._by_id.get(int(objid))
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def to_list(self):
+        return [entry.to_dict() for entry in self._entries]
+
+    def copy(self):
+        registry = ObjectRegistry()
+        for entry in self._entries:
+            entry = entry.copy()
+            registry._entries.append(entry)
+            registry._by_name[entry.object] = entry
+            registry._by_id[entry.id] = entry
+        return registry
+
+
+class _ObjectGeometry():
+    __slots__ = ("min_x", "max_x", "min_y", "max_y", "min_z", "max_z", "layers", "extruded")
+
+    def __init__(self):
+        self.min_x = self.min_y = self.min_z = float("inf")
+        self.max_x = self.max_y = self.max_z = float("-inf")
+        self.layers = set()
+        self.extruded = 0.0
+
+
+class ObjectScan():
+    # Object declarations (@Object / @Objectinfo lines) collected from one G-code file, plus each object's
+    # bounding box, layers and extrusion total computed from its moves. Once the scan has the geometry,
+    # the live queuing hook doesn't need to track positions at all.
+
+    def __init__(self, reptag, reptagregex, objectinforegex, size=None, mtime=None):
+        self.objects = ObjectRegistry()
+        self.objects_known = False
+        self.timeline = None
+        self.size = size
+        self.mtime = mtime
+        self.created_at = time.time()
+        self._reptagregex = reptagregex
+        self._objectinforegex = objectinforegex
+        self._tag_prefix = "@{0}".format(reptag)
+        self._info_prefix = "@{0}info".format(reptag)
+
+        self._parser = Gcode_parser()
+        self._active = None
+        self._geometry = {}
+        self._relative_e = False
+        self._x = self._y = self._z = None
+        self._e = 0.0
+        self._timeline = TimelineBuilder()
+        # Lines must be fed as they are stored, so this is the byte offset OctoPrint reports while printing
+        self._position = 0
+        self._line_position = 0
+
+    @property
+    def num_bytes(self):
+        return self._position
+
+    def feed_bytes(self, line):
+        self._line_position = self._position
+        self._position += len(line)
+        first = line[:1]
+        if first == b"@":
+            self.feed(line.decode("utf-8", "replace"))
+        elif first == b"G" or first == b"M":
+            self.feed_command(line.split(b";", 1)[0].decode("ascii", "replace").strip())
+
+    def feed_command(self, cmd):
+        args = self._parser.parse_move_args(cmd)
+        if args is None:
+            if cmd == "M82":
+                self._relative_e = False
+            elif cmd == "M83":
+                self._relative_e = True
+            elif cmd.startswith("G92"):
+                for token in cmd.split()[1:]:
+                    if token[:1] == "E":
+                        try:
+                            self._e = float(token[1:] or 0)
+                        except ValueError:
+                            # e.g. "G92 Ex1", read it the way Gcode_parser reads a bad move parameter
+                            number = _number_prefix_re.match(token, 1).group(0)
+                            try:
+                                self._e = float(number or 0)
+                            except ValueError:
+                                pass
+            elif cmd.startswith("M221"):
+                flow_rate = parse_flow_rate(cmd)
+                if flow_rate is not None:
+                    self._timeline.on_flow_rate(self._line_position, flow_rate)
+            return
+
+        x, y, z, e, _ = args
+        from_x, from_y = self._x, self._y
+        if x is not None:
+            self._x = x
+        if y is not None:
+            self._y = y
+        if z is not None:
+            self._z = z
+        if e is None:
+            return
+
+        if self._relative_e:
+            amount = e
+        else:
+            amount = e - self._e
+            self._e = e
+        if amount <= 0 or (x is None and y is None):
+            return
+        if self._z is not None:
+            # Commanded extrusion: filament per mm of travel, if the move starts from a known position
+            extrusion = math.nan
+            if from_x is not None and from_y is not None:
+                distance = math.hypot(self._x - from_x, self._y - from_y)
+                if distance > 0:
+                    extrusion = amount / distance
+            self._timeline.on_extrusion(self._line_position, self._z, extrusion)
+        if self._active is None or self._x is None or self._y is None:
+            return
+
+        g = self._geometry.get(self._active)
+        if g is None:
+            g = self._geometry[self._active] = _ObjectGeometry()
+        if self._x < g.min_x:
+            g.min_x = self._x
+        if self._x > g.max_x:
+            g.max_x = self._x
+        if self._y < g.min_y:
+            g.min_y = self._y
+        if self._y > g.max_y:
+            g.max_y = self._y
+        if self._z is not None:
+            if self._z < g.min_z:
+                g.min_z = self._z
+            if self._z > g.max_z:
+                g.max_z = self._z
+            g.layers.add(self._z)
+        g.extruded += amount
+
+    def finish(self):
+        measured = 0
+        for entry in self.objects:
+            g = self._geometry.get(entry.object)
+            if g is None:
+                continue
+            measured += 1
+            entry.min_x, entry.max_x, entry.min_y, entry.max_y = g.min_x, g.max_x, g.min_y, g.max_y
+            if g.layers:
+                entry.min_z, entry.max_z = g.min_z, g.max_z
+            entry.layer_count = len(g.layers)
+            entry.extruded = g.extruded
+        if measured and measured == len(self.objects):
+            self.objects_known = True
+        self._geometry = {}
+        self.timeline = self._timeline.build()
+
+    def feed(self, line):
+        if not line.startswith(self._tag_prefix):
+            return
+
+        if line.startswith(self._info_prefix):
+            info = self._objectinforegex.match(line)
+            if info:
+                if not self.objects.get(info.group(1)):
+                    # Making the perhaps poor assumption that all objects are known
+                    self.objects_known = True
+                    x, y = float(info.group(2)), float(info.group(3))
+                    self.objects.add(info.group(1), max_x=x, min_x=x, max_y=y, min_y=y)
+                return
+
+        matched = self._reptagregex.match(line)
+        if matched:
+            obj = matched.group(1)
+            self._active = obj
+            self._timeline.on_object(self._line_position, obj)
+            if not self.objects.get(obj):
+                self.objects.add(obj)
+
+    def copy_objects(self):
+        # The live object list is mutated while printing, the cached scan must not be
+        return self.objects.copy()
+
+
+_flow_rate_re = re.compile(r"S(\d+\.?\d*)", re.IGNORECASE)
+
+
+def parse_flow_rate(cmd):
+    """
+    :param cmd: M221 command
+    :return: flow rate as a fraction, None if the command doesn't set one
+    """
+    flow = _flow_rate_re.search(cmd)
+    return float(flow.group(1)) / 100.0 if flow else None
+
+
+_regex_metachars = frozenset(".^$*+?{}[]\\|()")
+
+
+def _literal_prefix(pattern):
+    # Longest literal text every match of the regex must start with, "" if there isn't any
+    if "|" in pattern:
+        return ""
+    for i, c in enumerate(pattern):
+        if c in _regex_metachars:
+            # A quantifier makes the character before it optional
+            return pattern[:i - 1] if c in "*?{" and i > 0 else pattern[:i]
+    return pattern
+
+
+# Originally from filaswitch, https://github.com/spegelius/filaswitch. Reworked into a single-pass tokenizer.
+_number_prefix_re = re.compile(r"-*\d*\.*\d*")
+_move_axes = {"X": 0, "Y": 1, "Z": 2, "E": 3, "F": 4}
+
+
 class Gcode_parser:
-    MOVE_RE = re.compile("^G0\s+|^G1\s+")
-    X_COORD_RE = re.compile(".*\s+X([-]*\d*\.*\d*)")
-    Y_COORD_RE = re.compile(".*\s+Y([-]*\d*\.*\d*)")
-    E_COORD_RE = re.compile(".*\s+E([-]*\d*\.*\d*)")
-    Z_COORD_RE = re.compile(".*\s+Z([-]*\d*\.*\d*)")
-    SPEED_VAL_RE = re.compile(".*\s+F(\d*\.*\d*)")
 
     def __init__(self):
         self.last_match = None
+        self._last_line = None
+        self._last_args = None
 
     def is_extrusion_move(self, line):
         """
@@ -385,52 +843,93 @@ class Gcode_parser:
         return self.last_match
 
     def parse_move_args(self, line):
+        """
+        Parse a G0/G1 line in one scan.
+        :param line: g-code line
+        :return: None for any other command, else tuple with X, Y, Z, E and F values (None when absent)
+        """
+        # The queuing hook asks for the same command more than once
+        if line is self._last_line:
+            return self._last_args
+
+        args = None
+        # Fast reject: only "G0 ..." and "G1 ..." are moves
+        if line[:1] == "G" and line[1:2] in ("0", "1") and line[2:3].isspace():
+            values = [None, None, None, None, None]
+            for token in line[3:].split():
+                i = _move_axes.get(token[0])
+                if i is None:
+                    continue
+                try:
+                    values[i] = float(token[1:])
+                except ValueError:
+                    # e.g. "X10Y20" or "X" with no value
+                    number = _number_prefix_re.match(token, 1).group(0)
+                    try:
+                        values[i] = float(number)
+                    except ValueError:
+                        pass
+            args = tuple(values)
 
-        self.last_match = None
-        m = self.MOVE_RE.match(line)
-        if m:
-            x = None
-            y = None
-            z = None
-            e = None
-            speed = None
-
-            m = self.X_COORD_RE.match(line)
-            if m:
-                x = float(m.groups()[0])
-
-            m = self.Y_COORD_RE.match(line)
-            if m:
-                y = float(m.groups()[0])
-
-            m = self.Z_COORD_RE.match(line)
-            if m:
-                z = float(m.groups()[0])
-
-            m = self.E_COORD_RE.match(line)
-            if m:
-                e = float(m.groups()[0])
-
-            m = self.SPEED_VAL_RE.match(line)
-            if m:
-                speed = float(m.groups()[0])
-
-            return x, y, z, e, speed
+        self._last_line = line
+        self._last_args = args
+        return args
 
 class ModifyComments(octoprint.filemanager.util.LineProcessorStream):
 
-    def __init__(self, fileBufferedReader, object_regex, reptag):
+    def __init__(self, fileBufferedReader, object_regex, reptag, scan=None, on_complete=None):
         super(ModifyComments, self).__init__(fileBufferedReader)
-        self.patterns = []
+        self._scan = scan
+        self._on_complete = on_complete
+        self._slicer_patterns = []
         for each in object_regex:
             if each["objreg"]:
                 regex = re.compile(each["objreg"])
-                self.patterns.append(regex)
+                self._slicer_patterns.append((regex, each.get("slicer")))
         self._reptag = "@{0}".format(reptag)
         self.infomatch = re.compile("; object:.*")
         self.stopmatch = re.compile("; stop printing object ([^\t\n\r\f\v]*)")
 
+        # Until the slicer is known, try every pattern
+        self.slicer = None
+        self._detect_bytes_left = SLICER_DETECT_BYTES
+        self._bind_patterns([regex for regex, _ in self._slicer_patterns], True)
+
+    def _bind_patterns(self, patterns, prusa_matchers):
+        self.patterns = patterns
+        self._prusa_matchers = prusa_matchers
+        # Comment lines that can't start a match of any pattern are passed through untouched
+        matchers = self.patterns + ([self.infomatch, self.stopmatch] if prusa_matchers else [])
+        prefixes = [_literal_prefix(p.pattern) for p in matchers]
+        self._candidate_prefixes = None if "" in prefixes else tuple(p.encode('utf-8') for p in prefixes)
+
+    def _detect_slicer(self, line):
+        self._detect_bytes_left -= len(line)
+        slicer = detect_slicer(line if line.__class__ is bytes else line.encode('utf-8', 'replace'))
+        if not slicer:
+            return
+        self._detect_bytes_left = 0
+        patterns = [regex for regex, s in self._slicer_patterns if s == slicer]
+        if not patterns:
+            # Patterns saved before they were tagged with a slicer
+            return
+        self.slicer = slicer
+        self._bind_patterns(patterns, slicer == "prusaslicer")
+
     def process_line(self, line):
+        if self._detect_bytes_left > 0:
+            self._detect_slicer(line)
+
+        # Fast path on bytes: plain ASCII lines that aren't candidate comments come out exactly as they went in,
+        # so skip the decode/encode round trip.
+        if line.__class__ is bytes and line.isascii():
+            if not line:
+                return None
+            if line[:1] != b";" or (self._candidate_prefixes is not None and not line.startswith(self._candidate_prefixes)):
+                if self._scan is not None:
+                    self._scan.feed_bytes(line)
+                return line
+
         try:
             # if line is of type bytes then convert to string
             line = line.decode("utf-8", "strict")
@@ -441,7 +940,19 @@ class ModifyComments(octoprint.filemanager.util.LineProcessorStream):
             line = self._matchComment(line)
         if not len(line):
             return None
-        return line.encode('ascii','xmlcharrefreplace')
+        line = line.encode('ascii','xmlcharrefreplace')
+        if self._scan is not None:
+            self._scan.feed_bytes(line)
+        return line
+
+    def read(self, n=-1):
+        # OctoPrint saves the upload with shutil.copyfileobj(), which calls read(); readinto() ends up here too
+        data = super(ModifyComments, self).read(n)
+        if not data and n != 0 and self._on_complete:
+            # End of the upload stream, the scan is complete
+            on_complete, self._on_complete = self._on_complete, None
+            on_complete()
+        return data
 
     def _matchComment(self, line):
         for pattern in self.patterns:
@@ -449,6 +960,9 @@ class ModifyComments(octoprint.filemanager.util.LineProcessorStream):
             if matched:
                 obj = matched.group(1).encode('ascii','xmlcharrefreplace')
                 line = "{0} {1}\n".format(self._reptag, obj.decode('utf-8'))
+        if not self._prusa_matchers:
+            return line
+
         #Match SuperSlicer Object information
         info = self.infomatch.match(line)
         if info:
@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+import time
+from collections import deque
+from threading import Lock, Condition
+
+PAUSED_RECHECK_SECS = 30
+THROUGHPUT_WINDOW_SECS = 10
+
+
+class TokenBucket():
+    # rate is in bytes per second, 0 means unlimited. A request larger than the burst is allowed to go into
+    # debt; the caller then sleeps until the debt is paid off, so the long-run rate still holds.
+
+    def __init__(self, rate, burst=None):
+        self._lock = Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self.rate = rate
+            self.burst = burst or rate
+            self._tokens = self.burst
+            self._last = time.monotonic()
+
+    def consume(self, n):
+        with self._lock:
+            if self.rate <= 0:
+                return
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ThroughputMeter():
+
+    def __init__(self, window=THROUGHPUT_WINDOW_SECS):
+        self.window = window
+        self.total = 0
+        self._samples = deque()
+        self._lock = Lock()
+
+    def record(self, n):
+        now = time.monotonic()
+        with self._lock:
+            self.total += n
+            self._samples.append((now, n))
+            self._prune(now)
+
+    def rate(self):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            return sum(n for _, n in self._samples) / self.window
+
+    def _prune(self, now):
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+
+class ResourceGovernor():
+    # Throttles the background compress-and-upload path: token-bucket caps for upload bandwidth and disk reads,
+    # and a full stop while should_pause() says the printer needs the CPU and network for itself.
+
+    def __init__(self, upload_rate=0, io_rate=0, should_pause=None):
+        self.upload_bucket = TokenBucket(upload_rate)
+        self.io_bucket = TokenBucket(io_rate)
+        self.should_pause = should_pause or (lambda: False)
+        self.upload_meter = ThroughputMeter()
+        self.io_meter = ThroughputMeter()
+        self._cond = Condition()
+        self.paused = False
+
+    def set_limits(self, upload_rate, io_rate):
+        self.upload_bucket.set_rate(upload_rate)
+        self.io_bucket.set_rate(io_rate)
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait_until_allowed(self):
+        with self._cond:
+            while self.should_pause():
+                self.paused = True
+                self._cond.wait(PAUSED_RECHECK_SECS)
+            self.paused = False
+
+    def throttle_upload(self, n):
+        self.wait_until_allowed()
+        self.upload_bucket.consume(n)
+        self.upload_meter.record(n)
+
+    def throttle_io(self, n):
+        self.wait_until_allowed()
+        self.io_bucket.consume(n)
+        self.io_meter.record(n)
+
+    def stats(self):
+        return dict(
+            paused=self.paused,
+            upload_rate_limit=self.upload_bucket.rate,
+            io_rate_limit=self.io_bucket.rate,
+            upload_bytes_per_sec=self.upload_meter.rate(),
+            io_bytes_per_sec=self.io_meter.rate(),
+            uploaded_bytes=self.upload_meter.total,
+            read_bytes=self.io_meter.total,
+        )
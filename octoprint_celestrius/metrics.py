@@ -0,0 +1,156 @@
+from __future__ import absolute_import
+import os
+import threading
+
+NUM_BUCKETS = 40  # 2^39 ns is ~9 minutes, plenty for anything measured here
+# Hooks called for every G-code line only time the calls whose count has none of these bits set, i.e. one in 64.
+# Two clock reads and a record() cost more than the sent hook itself.
+HOOK_TIMING_SAMPLE_MASK = 63
+
+
+class LatencyHistogram():
+    # Log2 buckets of nanoseconds. record() is a bit_length() and a list increment, cheap enough for hot hooks.
+    # Bucket i holds samples in [2^(i-1), 2^i) ns. Counts are updated without a lock: a rare lost
+    # increment from concurrent writers is an acceptable price for staying off the hot path's critical section.
+
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+
+    def record(self, ns):
+        i = ns.bit_length()
+        if i >= NUM_BUCKETS:
+            i = NUM_BUCKETS - 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ns += ns
+
+    def percentile(self, p):
+        # Upper bound of the bucket the percentile falls in
+        if not self.count:
+            return 0
+        target = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return 1 << i
+        return 1 << (NUM_BUCKETS - 1)
+
+    def reset(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+
+    def stats(self):
+        return dict(
+            count=self.count,
+            mean_ns=self.total_ns / self.count if self.count else 0,
+            p50_ns=self.percentile(50),
+            p99_ns=self.percentile(99),
+            buckets={1 << i: n for i, n in enumerate(self.counts) if n},
+        )
+
+
+class Summary():
+    # Count, total and extremes of a value recorded now and then, e.g. frames per print
+
+    def __init__(self):
+        self.reset()
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        self.last = value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.last = None
+        self.min = None
+        self.max = None
+
+    def stats(self):
+        return dict(
+            count=self.count,
+            mean=self.total / self.count if self.count else 0,
+            min=self.min,
+            max=self.max,
+            last=self.last,
+        )
+
+
+def process_stats():
+    """
+    Resources held by the whole OctoPrint process, to spot leaks across prints.
+    :return: dict of rss_bytes, open_fds and threads. Values that can't be read on this OS are None.
+    """
+    rss_bytes = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss_bytes = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        open_fds = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        open_fds = None
+    return dict(rss_bytes=rss_bytes, open_fds=open_fds, threads=threading.active_count())
+
+
+class PrometheusText():
+    # Prometheus text exposition format, version 0.0.4
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lines = []
+
+    def _header(self, name, kind, help_text):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+
+    def gauge(self, name, value, help_text):
+        name = self.prefix + name
+        self._header(name, 'gauge', help_text)
+        self.lines.append(f'{name} {_number(value)}')
+
+    def counter(self, name, value, help_text):
+        name = self.prefix + name
+        self._header(name, 'counter', help_text)
+        self.lines.append(f'{name} {_number(value)}')
+
+    def summary(self, name, summary, help_text):
+        name = self.prefix + name
+        self._header(name, 'summary', help_text)
+        self.lines.append(f'{name}_sum {_number(summary.total)}')
+        self.lines.append(f'{name}_count {summary.count}')
+
+    def latency_histogram(self, name, histogram, help_text):
+        # Reported in seconds, as Prometheus expects
+        name = self.prefix + name
+        self._header(name, 'histogram', help_text)
+        cumulative = 0
+        for i, n in enumerate(histogram.counts):
+            cumulative += n
+            self.lines.append(f'{name}_bucket{{le="{(1 << i) / 1e9:g}"}} {cumulative}')
+        self.lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+        self.lines.append(f'{name}_sum {histogram.total_ns / 1e9!r}')
+        self.lines.append(f'{name}_count {histogram.count}')
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _number(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+import io
+import os
+import gzip
+import tarfile
+
+from .frame_container import FrameContainerReader, container_exists, format_labels
+
+# GCS resumable uploads require every chunk but the last to be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 4 * 256 * 1024
+
+
+class _ChunkBuffer():
+    # Write target for tarfile/gzip that hands out fixed-size chunks as soon as they are complete
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self._buf = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self._buf += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def full_chunks(self):
+        while len(self._buf) >= self.chunk_size:
+            chunk = bytes(self._buf[:self.chunk_size])
+            del self._buf[:self.chunk_size]
+            yield chunk
+
+    def remainder(self):
+        chunk = bytes(self._buf)
+        self._buf.clear()
+        return chunk
+
+
+def archive_filename(data_dirname, compress=True):
+    return os.path.basename(data_dirname) + ('.tgz' if compress else '.tar')
+
+
+def _iter_members(data_dirname):
+    if container_exists(data_dirname):
+        with FrameContainerReader(data_dirname) as reader:
+            for record, jpg in reader:
+                yield f'{record.ts}.jpg', record.ts, jpg
+                yield f'{record.ts}.labels', record.ts, format_labels(record).encode('utf-8')
+    else:
+        # Data folder left in the legacy one-file-per-sample layout
+        for filename in sorted(os.listdir(data_dirname)):
+            path = os.path.join(data_dirname, filename)
+            with open(path, 'rb') as f:
+                yield filename, os.path.getmtime(path), f.read()
+
+
+def iter_archive_chunks(data_dirname, compress=True, chunk_size=UPLOAD_CHUNK_SIZE, throttle_io=None):
+    """
+    Tar (and optionally gzip) a print's frames in-process, yielding the archive in fixed-size chunks.
+    Only one frame plus one chunk is held in memory at a time, and nothing is written to disk.
+    The output is deterministic for the same data, so an interrupted upload can be resumed by regenerating it.
+    throttle_io, if given, is called with the size of every member before it is read into the archive.
+    """
+    basename = os.path.basename(data_dirname)
+    out = _ChunkBuffer(chunk_size)
+    gz = gzip.GzipFile(filename='', fileobj=out, mode='wb', mtime=0) if compress else None
+    tar = tarfile.open(fileobj=gz or out, mode='w|', format=tarfile.GNU_FORMAT)
+
+    for name, mtime, data in _iter_members(data_dirname):
+        if throttle_io:
+            throttle_io(len(data))
+        info = tarfile.TarInfo(f'{basename}/{name}')
+        info.size = len(data)
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(data))
+        yield from out.full_chunks()
+
+    tar.close()
+    if gz:
+        gz.close()
+    yield from out.full_chunks()
+    last = out.remainder()
+    if last:
+        yield last
+
+
+def stream_upload(sink, upload_id, chunks, start_offset=0, on_progress=None, throttle_upload=None):
+    """
+    Send archive chunks to an upload sink, skipping the first start_offset bytes that the sink already has.
+    throttle_upload, if given, is called with the size of every chunk before it is sent.
+    :return: total number of bytes in the archive
+    """
+    offset = 0
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            offset = _send(sink, upload_id, offset, pending, False, start_offset, on_progress, throttle_upload)
+        pending = chunk
+    return _send(sink, upload_id, offset, pending or b'', True, start_offset, on_progress, throttle_upload)
+
+
+def _send(sink, upload_id, offset, chunk, final, start_offset, on_progress, throttle_upload):
+    end = offset + len(chunk)
+    if end > start_offset or final:
+        skip = max(0, start_offset - offset)
+        if throttle_upload:
+            throttle_upload(max(0, len(chunk) - skip))
+        sink.send(upload_id, offset + skip, chunk[skip:], final)
+        if on_progress:
+            on_progress(end)
+    return end
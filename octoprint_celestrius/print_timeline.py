@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+import math
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from .sampling_policy import LAYER_EPSILON
+
+# Print state as a function of the byte position in the stored G-code file. Built once per file by the object
+# scan, then looked up with OctoPrint's current file position when a frame is captured.
+
+# The commanded extrusion is mm of filament per mm of XY travel. Slicers keep it constant within a feature, so
+# only a change by more than this fraction, e.g. from perimeters to infill, is a new timeline entry.
+EXTRUSION_CHANGE = 0.05
+
+TimelineState = namedtuple('TimelineState', ['layer', 'z', 'object', 'flow_rate', 'extrusion'])
+
+
+class PrintTimeline():
+    # One entry per change of layer, active object, M221 flow rate or commanded extrusion, in file order. Kept in parallel arrays,
+    # a few bytes per entry, so even a long multi-object print costs little memory.
+
+    def __init__(self, positions, layers, zs, objects, flow_rates, extrusions, object_names):
+        self._positions = positions
+        self._layers = layers
+        self._zs = zs
+        self._objects = objects
+        self._flow_rates = flow_rates
+        self._extrusions = extrusions
+        self._object_names = object_names
+
+    def __len__(self):
+        return len(self._positions)
+
+    def lookup(self, position):
+        """
+        :param position: byte offset in the stored G-code file
+        :return: TimelineState in effect at that position, or None before the first change
+        """
+        i = bisect_right(self._positions, position) - 1
+        if i < 0:
+            return None
+        obj = self._objects[i]
+        return TimelineState(self._layers[i], self._zs[i], self._object_names[obj] if obj >= 0 else None,
+                             self._flow_rates[i], self._extrusions[i])
+
+
+class TimelineBuilder():
+
+    def __init__(self):
+        self._positions = array('Q')
+        self._layers = array('i')
+        self._zs = array('d')
+        self._objects = array('i')
+        self._flow_rates = array('d')
+        self._extrusions = array('d')
+        self._object_names = []
+        self._object_ids = {}
+
+        self._layer = -1
+        self._z = math.nan
+        self._object = -1
+        self._flow_rate = 1.0
+        self._extrusion = math.nan
+
+    def on_extrusion(self, position, z, extrusion=math.nan):
+        """
+        :param z: height of the extruding move
+        :param extrusion: mm of filament per mm of XY travel of the move, NaN if unknown
+        """
+        changed = False
+        # A layer starts with the first extrusion above the previous layer. Z-hops don't extrude, so don't count.
+        if self._layer < 0 or z > self._z + LAYER_EPSILON:
+            self._layer += 1
+            self._z = z
+            changed = True
+        # NaN compares false: the first known extrusion is always a change
+        if extrusion == extrusion and not abs(extrusion - self._extrusion) <= self._extrusion * EXTRUSION_CHANGE:
+            self._extrusion = extrusion
+            changed = True
+        if changed:
+            self._mark(position)
+
+    def on_object(self, position, name):
+        obj = self._object_ids.get(name)
+        if obj is None:
+            obj = self._object_ids[name] = len(self._object_names)
+            self._object_names.append(name)
+        if obj != self._object:
+            self._object = obj
+            self._mark(position)
+
+    def on_flow_rate(self, position, flow_rate):
+        if flow_rate != self._flow_rate:
+            self._flow_rate = flow_rate
+            self._mark(position)
+
+    def _mark(self, position):
+        if self._positions and self._positions[-1] == position:
+            # Several changes on the same line, keep the last state
+            self._layers[-1], self._zs[-1], self._objects[-1], self._flow_rates[-1], self._extrusions[-1] = \
+                self._layer, self._z, self._object, self._flow_rate, self._extrusion
+            return
+        self._positions.append(position)
+        self._layers.append(self._layer)
+        self._zs.append(self._z)
+        self._objects.append(self._object)
+        self._flow_rates.append(self._flow_rate)
+        self._extrusions.append(self._extrusion)
+
+    def build(self):
+        return PrintTimeline(self._positions, self._layers, self._zs, self._objects, self._flow_rates,
+                             self._extrusions, self._object_names)
@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+import time
+
+DENSE_INTERVAL_SECS = 0.4      # First-layer extrusion and right after a layer change, never faster than before
+DEFAULT_INTERVAL_SECS = 0.8    # Extruding on any other layer
+SPARSE_INTERVAL_SECS = 1.2     # Travel, heating, waiting
+
+EXTRUDING_WINDOW_SECS = 1.0    # An extrusion move queued within this window counts as extruding
+LAYER_CHANGE_DENSE_SECS = 2.0
+LAYER_EPSILON = 0.01
+
+DUPLICATE_SIZE_DELTA = 0.005   # JPEG size change below 0.5% means the picture barely changed
+MAX_DUPLICATE_RUN_SECS = 3.0   # Keep at least one frame this often, even if they all look the same
+
+
+class SamplingPolicy():
+    # Decides how often to sample and which frames are worth keeping. The hooks only store a timestamp or
+    # a float here; all decisions are made on the capture thread.
+
+    def __init__(self):
+        self.reset()
+        self.kept = 0
+        self.skipped_duplicates = 0
+
+    def reset(self):
+        self.first_layer_z = None
+        self.max_z = None
+        self.current_z = None
+        self.last_extrusion_at = 0.0
+        self.layer_changed_at = 0.0
+        self._last_kept_size = None
+        self._last_kept_at = 0.0
+
+    def on_extrusion(self):
+        now = self.last_extrusion_at = time.monotonic()
+        # Layers start with the first extrusion at a new height, so start G-code like "G1 Z2.0" and
+        # z-hops, which don't extrude, are never taken for a layer
+        z = self.current_z
+        if z is None:
+            return
+        if self.first_layer_z is None:
+            self.first_layer_z = z
+        if self.max_z is None or z > self.max_z + LAYER_EPSILON:
+            self.max_z = z
+            self.layer_changed_at = now
+
+    def on_z(self, z):
+        self.current_z = z
+
+    def on_first_layer(self):
+        return self.first_layer_z is not None and self.current_z is not None \
+            and self.current_z <= self.first_layer_z + LAYER_EPSILON
+
+    def next_interval(self, now):
+        if now - self.layer_changed_at < LAYER_CHANGE_DENSE_SECS:
+            return DENSE_INTERVAL_SECS
+        if now - self.last_extrusion_at > EXTRUDING_WINDOW_SECS:
+            return SPARSE_INTERVAL_SECS
+        if self.on_first_layer():
+            return DENSE_INTERVAL_SECS
+        return DEFAULT_INTERVAL_SECS
+
+    def should_keep(self, jpg, now):
+        size = len(jpg)
+        last_size = self._last_kept_size
+        if last_size and abs(size - last_size) < last_size * DUPLICATE_SIZE_DELTA \
+                and now - self._last_kept_at < MAX_DUPLICATE_RUN_SECS:
+            self.skipped_duplicates += 1
+            return False
+
+        self._last_kept_size = size
+        self._last_kept_at = now
+        self.kept += 1
+        return True
+
+    def stats(self):
+        return dict(
+            kept=self.kept,
+            skipped_duplicates=self.skipped_duplicates,
+            on_first_layer=self.on_first_layer(),
+        )
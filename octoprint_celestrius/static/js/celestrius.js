@@ -13,6 +13,7 @@ $(function () {
         self.wizardViewModel = parameters[1];
 
         self.uploadHistory = ko.observableArray([]);
+        self.uploadHistoryEtag = null;
 
         self.onSettingsShown = function (plugin, data) {
             self.fetchUploadHistory();
@@ -28,7 +29,10 @@ $(function () {
             return (
                 !self.settingsViewModel.settings.plugins.celestrius.terms_accepted() ||
                 !self.settingsViewModel.settings.plugins.celestrius.pilot_email() ||
-                !self.settingsViewModel.settings.plugins.celestrius.snapshot_url()
+                !(
+                    self.settingsViewModel.settings.plugins.celestrius.snapshot_url() ||
+                    self.settingsViewModel.settings.plugins.celestrius.stream_url()
+                )
             );
         });
         self.navbarBtnClassName = ko.pureComputed(function () {
@@ -71,10 +75,22 @@ $(function () {
             return true;
         };
         self.fetchUploadHistory = function () {
-            apiCommand({
-                command: "upload_history",
-            }).done(function (data) {
-                self.uploadHistory(data);
+            var headers = {};
+            if (self.uploadHistoryEtag) {
+                headers["If-None-Match"] = self.uploadHistoryEtag;
+            }
+            apiCommand(
+                {
+                    command: "upload_history",
+                    limit: 100,
+                },
+                headers
+            ).done(function (data, textStatus, xhr) {
+                if (xhr.status === 304) {
+                    return; // Unchanged since the last refresh
+                }
+                self.uploadHistoryEtag = xhr.getResponseHeader("ETag");
+                self.uploadHistory(data.entries);
             });
         };
         self.testWebcamSnapshotUrlBusy = ko.observable(false);
@@ -177,11 +193,12 @@ $(function () {
         };
     }
 
-    function apiCommand(data) {
+    function apiCommand(data, headers) {
         return $.ajax("api/plugin/celestrius", {
             method: "POST",
             contentType: "application/json",
             data: JSON.stringify(data),
+            headers: headers || {},
         });
     }
     /* view model class, parameters for constructor, container to bind to
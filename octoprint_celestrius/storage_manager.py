@@ -0,0 +1,145 @@
+from __future__ import absolute_import
+import os
+import time
+import shutil
+import logging
+from threading import RLock
+
+_logger = logging.getLogger('octoprint.plugins.celestrius')
+
+OK = 'ok'
+DEGRADED = 'degraded'
+PAUSED = 'paused'
+
+DEGRADE_AT_BUDGET_FRACTION = 0.8
+FREE_SPACE_CHECK_SECS = 5.0
+
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class StorageManager():
+    # Keeps collected data within a byte budget and away from a full SD card. Usage is scanned once at startup
+    # and then tracked from the writes and deletions this plugin makes itself.
+    #
+    # check() degrades in steps: first DEGRADED (collect at a lower rate) when near the limits, then evict the
+    # oldest pending data, and PAUSED (no collection) only if eviction couldn't free enough.
+
+    def __init__(self, data_folder, budget_bytes, min_free_bytes, list_evictable=None, evict=None):
+        self.data_folder = data_folder
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.list_evictable = list_evictable or (lambda: [])
+        self.evict = evict
+        self._lock = RLock()
+        self._sizes = {}
+        self._usage = 0
+        self._free_bytes = None
+        self._free_checked_at = 0.0
+        self.level = OK
+        self.evicted = 0
+
+    def scan(self):
+        sizes = {}
+        for name in os.listdir(self.data_folder):
+            path = os.path.join(self.data_folder, name)
+            sizes[path] = _tree_size(path)
+        with self._lock:
+            self._sizes = sizes
+            self._usage = sum(sizes.values())
+
+    def set_limits(self, budget_bytes, min_free_bytes):
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self.min_free_bytes = min_free_bytes
+
+    def record_write(self, path, num_bytes):
+        with self._lock:
+            self._sizes[path] = self._sizes.get(path, 0) + num_bytes
+            self._usage += num_bytes
+            if self._free_bytes is not None:
+                self._free_bytes -= num_bytes
+
+    def record_removed(self, path):
+        with self._lock:
+            self._usage -= self._sizes.pop(path, 0)
+            self._free_checked_at = 0.0
+
+    def usage(self):
+        return self._usage
+
+    def free_bytes(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._free_bytes is None or now - self._free_checked_at > FREE_SPACE_CHECK_SECS:
+                self._free_bytes = shutil.disk_usage(self.data_folder).free
+                self._free_checked_at = now
+            return self._free_bytes
+
+    def _over_limit(self):
+        return (self.budget_bytes and self._usage >= self.budget_bytes) or self.free_bytes() < self.min_free_bytes
+
+    def _near_limit(self):
+        return (self.budget_bytes and self._usage >= self.budget_bytes * DEGRADE_AT_BUDGET_FRACTION) \
+            or self.free_bytes() < self.min_free_bytes * 2
+
+    def check(self, active_path=None):
+        """
+        Called before each write.
+        :param active_path: data of the print being collected, never evicted
+        :return: OK, DEGRADED or PAUSED
+        """
+        with self._lock:
+            if self._over_limit():
+                self._evict_until_within_limits(active_path)
+
+            if self._over_limit():
+                level = PAUSED
+            elif self._near_limit():
+                level = DEGRADED
+            else:
+                level = OK
+
+            if level != self.level:
+                _logger.warning('Storage level changed from %s to %s. Usage: %d bytes, free: %d bytes',
+                                self.level, level, self._usage, self.free_bytes())
+                self.level = level
+            return level
+
+    def _evict_until_within_limits(self, active_path):
+        if not self.evict:
+            return
+        for path in self.list_evictable():
+            if not self._over_limit():
+                return
+            if path == active_path:
+                continue
+            _logger.warning('Evicting %s to free up space', os.path.basename(path))
+            try:
+                self.evict(path)
+            except Exception as e:
+                _logger.exception('Exception occurred: %s', e)
+                continue
+            self.evicted += 1
+            self.record_removed(path)
+            self._free_bytes = None
+
+    def stats(self):
+        return dict(
+            level=self.level,
+            usage_bytes=self._usage,
+            budget_bytes=self.budget_bytes,
+            free_bytes=self._free_bytes,
+            min_free_bytes=self.min_free_bytes,
+            evicted=self.evicted,
+        )
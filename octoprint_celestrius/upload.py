@@ -0,0 +1,210 @@
+from __future__ import absolute_import
+import os
+import json
+import logging
+import requests
+from abc import ABC, abstractmethod
+from threading import Lock
+
+_logger = logging.getLogger('octoprint.plugins.celestrius')
+
+DATA_BUCKET = 'celestrius-data-collection'
+CREDENTIALS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'celestrius-data-collector.json')
+
+UPLOAD_TIMEOUT_SECS = 60
+
+GCS = 'gcs'
+LOCAL = 'local'
+S3 = 's3'
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024  # Every part of a multipart upload but the last must be at least this big
+
+
+class UploadSink(ABC):
+    # Receives an archive as a sequence of chunks. begin() returns an opaque upload id that stays valid
+    # across process restarts, committed_offset() tells how much of it the sink already has.
+
+    @abstractmethod
+    def begin(self, name, content_type):
+        pass
+
+    @abstractmethod
+    def send(self, upload_id, offset, chunk, final):
+        pass
+
+    @abstractmethod
+    def committed_offset(self, upload_id):
+        pass
+
+
+class GcsUploadSink(UploadSink):
+    # GCS resumable upload. The session URI is itself the credential for the upload, so chunks are sent
+    # over a plain keep-alive session.
+
+    # google-cloud-storage takes seconds to import on a Pi, so it is only imported for the first upload,
+    # and the client it builds is shared by every sink in the process.
+    _clients = {}
+    _clients_lock = Lock()
+
+    def __init__(self, bucket_name=DATA_BUCKET, credentials_file=CREDENTIALS_FILE):
+        self.bucket_name = bucket_name
+        self.credentials_file = credentials_file
+        self._http = requests.Session()
+
+    def _client(self):
+        with self._clients_lock:
+            client = self._clients.get(self.credentials_file)
+            if client is None:
+                from google.cloud import storage
+                client = self._clients[self.credentials_file] = \
+                    storage.Client.from_service_account_json(self.credentials_file)
+            return client
+
+    def begin(self, name, content_type):
+        blob = self._client().bucket(self.bucket_name).blob(name)
+        return blob.create_resumable_upload_session(content_type=content_type, timeout=UPLOAD_TIMEOUT_SECS)
+
+    def send(self, upload_id, offset, chunk, final):
+        total = str(offset + len(chunk)) if final else '*'
+        if chunk:
+            content_range = 'bytes {}-{}/{}'.format(offset, offset + len(chunk) - 1, total)
+        else:
+            content_range = 'bytes */{}'.format(total)
+        r = self._http.put(upload_id, data=chunk, headers={'Content-Range': content_range}, timeout=UPLOAD_TIMEOUT_SECS)
+        if r.status_code == 308:
+            if final:
+                raise IOError('Upload incomplete after final chunk, server has {}'.format(r.headers.get('Range')))
+            return
+        r.raise_for_status()
+
+    def committed_offset(self, upload_id):
+        r = self._http.put(upload_id, headers={'Content-Range': 'bytes */*'}, timeout=UPLOAD_TIMEOUT_SECS)
+        if r.status_code in (200, 201):
+            return None  # Already complete
+        if r.status_code != 308:
+            r.raise_for_status()
+        # e.g. "Range: bytes=0-1048575"
+        committed = r.headers.get('Range')
+        return int(committed.split('-')[1]) + 1 if committed else 0
+
+
+class LocalDirectoryUploadSink(UploadSink):
+    # Writes archives into a local directory, e.g. a mounted NAS share. The upload id is the path of the
+    # partial file, which is renamed into place once the last chunk is in.
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def begin(self, name, content_type):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part_path = path + '.part'
+        open(part_path, 'wb').close()
+        return part_path
+
+    def send(self, upload_id, offset, chunk, final):
+        with open(upload_id, 'r+b') as f:
+            f.seek(offset)
+            f.write(chunk)
+            f.truncate()
+        if final:
+            os.replace(upload_id, upload_id[:-len('.part')])
+
+    def committed_offset(self, upload_id):
+        if os.path.exists(upload_id):
+            return os.path.getsize(upload_id)
+        if os.path.exists(upload_id[:-len('.part')]):
+            return None  # Already complete
+        raise FileNotFoundError(upload_id)
+
+
+class S3UploadSink(UploadSink):
+    # Multipart upload to any S3-compatible object store. Chunks are buffered in memory until they make up a
+    # part. Only whole parts count as committed, so after a restart the upload resumes from the last part.
+    # Needs boto3, which is imported on first use and isn't a dependency of the plugin.
+
+    def __init__(self, bucket_name, endpoint_url=None, access_key=None, secret_key=None, region=None):
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url or None
+        self.access_key = access_key or None
+        self.secret_key = secret_key or None
+        self.region = region or None
+        self._s3 = None
+        self._lock = Lock()
+        # upload id -> (offset of the buffer, bytearray, [dict(PartNumber, ETag) of the parts sent so far])
+        self._buffers = {}
+
+    def _client(self):
+        with self._lock:
+            if self._s3 is None:
+                import boto3
+                self._s3 = boto3.client('s3', endpoint_url=self.endpoint_url, aws_access_key_id=self.access_key,
+                                        aws_secret_access_key=self.secret_key, region_name=self.region)
+            return self._s3
+
+    def begin(self, name, content_type):
+        r = self._client().create_multipart_upload(Bucket=self.bucket_name, Key=name, ContentType=content_type)
+        return json.dumps(dict(key=name, upload_id=r['UploadId']))
+
+    def _parts(self, key, upload_id):
+        parts = []
+        paginator = self._client().get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=self.bucket_name, Key=key, UploadId=upload_id):
+            parts.extend(page.get('Parts', []))
+        return sorted(parts, key=lambda part: part['PartNumber'])
+
+    def send(self, upload_id, offset, chunk, final):
+        ids = json.loads(upload_id)
+        buffer_offset, buf, parts = self._buffers.get(upload_id, (None, None, None))
+        if buf is None or buffer_offset + len(buf) != offset:
+            # First chunk since begin() or a restart: continue right after the parts the store already has
+            listed = self._parts(ids['key'], ids['upload_id'])
+            buffer_offset, buf = sum(part['Size'] for part in listed), bytearray()
+            parts = [dict(PartNumber=part['PartNumber'], ETag=part['ETag']) for part in listed]
+            if buffer_offset != offset:
+                raise IOError('Upload {} has {} bytes, cannot continue at {}'.format(ids['key'], buffer_offset, offset))
+        buf += chunk
+        self._buffers[upload_id] = (buffer_offset, buf, parts)
+        if len(buf) < S3_MIN_PART_SIZE and not final:
+            return
+
+        s3 = self._client()
+        if buf or not parts:
+            part_number = len(parts) + 1
+            r = s3.upload_part(Bucket=self.bucket_name, Key=ids['key'], UploadId=ids['upload_id'],
+                               PartNumber=part_number, Body=bytes(buf))
+            parts.append(dict(PartNumber=part_number, ETag=r['ETag']))
+        self._buffers[upload_id] = (buffer_offset + len(buf), bytearray(), parts)
+        if final:
+            del self._buffers[upload_id]
+            s3.complete_multipart_upload(Bucket=self.bucket_name, Key=ids['key'], UploadId=ids['upload_id'],
+                                         MultipartUpload=dict(Parts=parts))
+
+    def committed_offset(self, upload_id):
+        ids = json.loads(upload_id)
+        self._buffers.pop(upload_id, None)
+        s3 = self._client()
+        try:
+            return sum(part['Size'] for part in self._parts(ids['key'], ids['upload_id']))
+        except s3.exceptions.NoSuchUpload:
+            pass
+        # Completed, or aborted, e.g. by a lifecycle rule
+        try:
+            s3.head_object(Bucket=self.bucket_name, Key=ids['key'])
+        except s3.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                # Gone without being completed. Like an unknown local upload, so the queue starts a new one.
+                raise FileNotFoundError('Upload {} of {} was aborted'.format(ids['upload_id'], ids['key']))
+            raise
+        return None
+
+
+def new_upload_sink(backend, local_directory=None, s3_bucket=None, s3_endpoint_url=None, s3_access_key=None,
+                    s3_secret_key=None, s3_region=None):
+    if backend == LOCAL:
+        return LocalDirectoryUploadSink(local_directory)
+    if backend == S3:
+        return S3UploadSink(s3_bucket, s3_endpoint_url, s3_access_key, s3_secret_key, s3_region)
+    if backend != GCS:
+        _logger.warning('Unknown upload backend %s, using %s', backend, GCS)
+    return GcsUploadSink()
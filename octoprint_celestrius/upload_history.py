@@ -0,0 +1,101 @@
+from __future__ import absolute_import
+import os
+import csv
+import sqlite3
+import logging
+from datetime import datetime
+from threading import RLock
+
+from .upload_queue import DONE
+
+_logger = logging.getLogger('octoprint.plugins.celestrius')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+LEGACY_CSV_FILENAME = 'uploaded_print_list.csv'
+_LEGACY_DATE_FORMAT = '%A, %B %d, %Y'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS upload_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    uploaded_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    size_bytes INTEGER,
+    num_frames INTEGER,
+    duration_secs REAL
+);
+CREATE INDEX IF NOT EXISTS upload_history_uploaded_at ON upload_history (uploaded_at);
+'''
+_ENTRY_COLUMNS = ('id', 'name', 'uploaded_at', 'status', 'size_bytes', 'num_frames', 'duration_secs')
+
+
+class UploadHistory():
+    # What happened to every print's data, newest first, in a SQLite database next to the upload queue.
+    # Only ever appended to, so the newest id and the row count together identify a version for ETags.
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = RLock()
+        self._conn = None
+
+    def start(self):
+        with self._lock:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._conn.executescript(_SCHEMA)
+        self._import_legacy_csv()
+
+    def record(self, name, status, uploaded_at, size_bytes=None, num_frames=None, duration_secs=None):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO upload_history (name, uploaded_at, status, size_bytes, num_frames, duration_secs) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (name, uploaded_at, status, size_bytes, num_frames, duration_secs))
+
+    def version(self):
+        with self._lock:
+            max_id, count = self._conn.execute('SELECT MAX(id), COUNT(*) FROM upload_history').fetchone()
+        return '{}-{}'.format(max_id or 0, count)
+
+    def query(self, offset=0, limit=DEFAULT_PAGE_SIZE, since=None):
+        """
+        :param since: only entries uploaded at or after this unix timestamp
+        :return: total number of matching entries, and one page of them as dicts, newest first
+        """
+        limit = max(0, min(limit, MAX_PAGE_SIZE))
+        where, params = ('WHERE uploaded_at >= ?', (since,)) if since is not None else ('', ())
+        with self._lock:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM upload_history {where}', params).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT {", ".join(_ENTRY_COLUMNS)} FROM upload_history {where} '
+                'ORDER BY uploaded_at DESC, id DESC LIMIT ? OFFSET ?', params + (limit, max(0, offset))).fetchall()
+        return total, [dict(zip(_ENTRY_COLUMNS, row)) for row in rows]
+
+    def _import_legacy_csv(self):
+        # History written by older versions, one "name","date" row per upload
+        csv_path = os.path.join(os.path.dirname(self.db_path), LEGACY_CSV_FILENAME)
+        if not os.path.exists(csv_path):
+            return
+        try:
+            rows = []
+            with open(csv_path, 'r') as csvfile:
+                for row in csv.reader(csvfile):
+                    if len(row) < 2:
+                        continue
+                    try:
+                        uploaded_at = datetime.strptime(row[1], _LEGACY_DATE_FORMAT).timestamp()
+                    except ValueError:
+                        uploaded_at = 0
+                    rows.append((row[0], uploaded_at, DONE))
+            with self._lock:
+                # All or nothing, so a failed import can be retried without duplicates
+                self._conn.execute('BEGIN')
+                try:
+                    self._conn.executemany('INSERT INTO upload_history (name, uploaded_at, status) VALUES (?, ?, ?)', rows)
+                    os.rename(csv_path, csv_path + '.imported')
+                except Exception:
+                    self._conn.execute('ROLLBACK')
+                    raise
+                self._conn.execute('COMMIT')
+        except Exception as e:
+            _logger.exception('Exception occurred: %s', e)
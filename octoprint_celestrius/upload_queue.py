@@ -0,0 +1,224 @@
+from __future__ import absolute_import
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+from threading import Thread, Condition, RLock
+
+from .packager import iter_archive_chunks, stream_upload
+from .metrics import LatencyHistogram
+
+_logger = logging.getLogger('octoprint.plugins.celestrius')
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+EVICTED = 'evicted'
+
+RETRY_BASE_SECS = 30
+RETRY_MAX_SECS = 60 * 60
+IDLE_RECHECK_SECS = 60  # How often to re-check the governor while deferred
+PROGRESS_SAVE_BYTES = 4 * 1024 * 1024
+
+UploadJob = namedtuple('UploadJob', ['id', 'data_dirname', 'object_name', 'compress', 'upload_id',
+                                     'committed_offset', 'attempts', 'next_attempt_at', 'status', 'created_at'])
+# Passed to on_done once a job is finished for good. size_bytes is None if the sink already had the archive.
+UploadResult = namedtuple('UploadResult', ['status', 'size_bytes', 'duration_secs', 'error'])
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data_dirname TEXT NOT NULL UNIQUE,
+    object_name TEXT NOT NULL,
+    compress INTEGER NOT NULL,
+    upload_id TEXT,
+    committed_offset INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT
+)
+'''
+_JOB_COLUMNS = 'id, data_dirname, object_name, compress, upload_id, committed_offset, attempts, next_attempt_at, status, created_at'
+
+
+class UploadQueue():
+    # Durable upload jobs in a small SQLite database in the plugin data folder. A single worker drains them
+    # one at a time, retries with exponential backoff, and resumes interrupted uploads from the offset the
+    # sink has committed, including after an OctoPrint restart. The governor throttles both the disk reads
+    # and the upload, and holds the worker back entirely while a print is running.
+
+    def __init__(self, db_path, sink, governor, on_done=None):
+        self.db_path = db_path
+        self.sink = sink
+        self.governor = governor
+        self.on_done = on_done
+        self._lock = RLock()
+        self._cond = Condition()
+        self._conn = None
+        self._woken = False
+        self._active_dirname = None
+        self.archived_bytes = 0
+        self.upload_histogram = LatencyHistogram()
+
+    def start(self):
+        with self._lock:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute(_SCHEMA)
+        worker = Thread(target=self._run)
+        worker.daemon = True
+        worker.start()
+
+    def enqueue(self, data_dirname, object_name, compress):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO upload_jobs (data_dirname, object_name, compress, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                (data_dirname, object_name, int(compress), PENDING, time.time()))
+        self.wake()
+
+    def wake(self):
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def has_job(self, data_dirname):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM upload_jobs WHERE data_dirname = ?', (data_dirname,)).fetchone() is not None
+
+    def pending_jobs(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {_JOB_COLUMNS} FROM upload_jobs WHERE status = ? ORDER BY id', (PENDING,)).fetchall()
+        return [UploadJob._make(row) for row in rows]
+
+    def evictable_dirnames(self):
+        # Queued and failed uploads, oldest first, never the one being uploaded right now
+        with self._lock:
+            rows = self._conn.execute('SELECT data_dirname FROM upload_jobs WHERE status IN (?, ?) ORDER BY id',
+                                      (PENDING, FAILED)).fetchall()
+            return [row[0] for row in rows if row[0] != self._active_dirname]
+
+    def evict(self, data_dirname):
+        with self._lock:
+            if data_dirname == self._active_dirname:
+                raise RuntimeError('Upload of {} is in progress'.format(data_dirname))
+            self._conn.execute('UPDATE upload_jobs SET status = ? WHERE data_dirname = ? AND status IN (?, ?)',
+                               (EVICTED, data_dirname, PENDING, FAILED))
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM upload_jobs GROUP BY status').fetchall()
+        return dict(rows)
+
+    def _update(self, job_id, **fields):
+        assignments = ', '.join(f'{k} = ?' for k in fields)
+        with self._lock:
+            self._conn.execute(f'UPDATE upload_jobs SET {assignments} WHERE id = ?', tuple(fields.values()) + (job_id,))
+
+    def _next_job(self):
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {_JOB_COLUMNS} FROM upload_jobs WHERE status = ? ORDER BY next_attempt_at, id LIMIT 1',
+                (PENDING,)).fetchone()
+        return UploadJob._make(row) if row else None
+
+    def _run(self):
+        try:
+            # Only this thread, not the whole OctoPrint process
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+        while True:
+            with self._cond:
+                self._woken = False
+            job = self._next_job()
+            now = time.time()
+            if job is None:
+                wait = None
+            elif job.next_attempt_at > now:
+                wait = job.next_attempt_at - now
+            elif self.governor.should_pause():
+                wait = IDLE_RECHECK_SECS
+            else:
+                self._process(job)
+                continue
+
+            with self._cond:
+                if not self._woken:
+                    self._cond.wait(wait)
+
+    def _process(self, job):
+        with self._lock:
+            # Claim the job, unless it was evicted since it was picked
+            status = self._conn.execute('SELECT status FROM upload_jobs WHERE id = ?', (job.id,)).fetchone()
+            if not status or status[0] != PENDING:
+                return
+            self._active_dirname = job.data_dirname
+        started = time.monotonic()
+        try:
+            size_bytes = self._upload(job)
+        except Exception as e:
+            attempts = job.attempts + 1
+            if isinstance(e, FileNotFoundError):
+                _logger.error('Giving up uploading %s: %s', job.data_dirname, e)
+                self._update(job.id, status=FAILED, attempts=attempts, last_error=str(e))
+                self._finished(job, UploadResult(FAILED, None, time.monotonic() - started, str(e)))
+                return
+            delay = min(RETRY_MAX_SECS, RETRY_BASE_SECS * 2 ** job.attempts)
+            _logger.warning('Upload of %s failed (attempt %d), retrying in %ds: %s', job.data_dirname, attempts, delay, e)
+            self._update(job.id, attempts=attempts, next_attempt_at=time.time() + delay, last_error=str(e))
+            return
+        finally:
+            self._active_dirname = None
+
+        duration = time.monotonic() - started
+        self.upload_histogram.record(int(duration * 1e9))
+        if size_bytes:
+            self.archived_bytes += size_bytes
+        self._update(job.id, status=DONE, last_error=None)
+        self._finished(job, UploadResult(DONE, size_bytes, duration, None))
+
+    def _finished(self, job, result):
+        if self.on_done:
+            try:
+                self.on_done(job, result)
+            except Exception as e:
+                _logger.exception('Exception occurred: %s', e)
+
+    def _upload(self, job):
+        if not os.path.isdir(job.data_dirname):
+            raise FileNotFoundError(job.data_dirname)
+
+        compress = bool(job.compress)
+        upload_id = job.upload_id
+        start_offset = 0
+        if upload_id:
+            try:
+                start_offset = self.sink.committed_offset(upload_id)
+            except Exception as e:
+                # Most likely an expired upload session. Start over.
+                _logger.warning('Could not resume upload of %s, restarting: %s', job.data_dirname, e)
+                upload_id = None
+            else:
+                if start_offset is None:
+                    return None  # The sink already has all of it
+        if not upload_id:
+            upload_id = self.sink.begin(job.object_name, 'application/gzip' if compress else 'application/x-tar')
+            start_offset = 0
+            self._update(job.id, upload_id=upload_id, committed_offset=0)
+
+        _logger.info('Uploading %s from offset %d', job.object_name, start_offset)
+        saved = [start_offset]
+
+        def on_progress(offset):
+            if offset - saved[0] >= PROGRESS_SAVE_BYTES:
+                self._update(job.id, committed_offset=offset)
+                saved[0] = offset
+
+        chunks = iter_archive_chunks(job.data_dirname, compress, throttle_io=self.governor.throttle_io)
+        return stream_upload(self.sink, upload_id, chunks, start_offset=start_offset, on_progress=on_progress,
+                             throttle_upload=self.governor.throttle_upload)
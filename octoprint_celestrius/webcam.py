@@ -0,0 +1,178 @@
+from __future__ import absolute_import
+import re
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from threading import Thread, Condition
+
+_logger = logging.getLogger('octoprint.plugins.celestrius')
+
+_boundary_re = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+_content_length_re = re.compile(rb'content-length:\s*(\d+)', re.IGNORECASE)
+
+CAPTURE_TIMEOUT_SECS = 5
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.verify = False
+    return session
+
+
+class SnapshotCapture():
+    # One request per frame, but over a pooled keep-alive session instead of a fresh connection every time.
+
+    def __init__(self, snapshot_url):
+        self.url = snapshot_url
+        self._session = _new_session()
+
+    def capture(self):
+        r = self._session.get(self.url, timeout=CAPTURE_TIMEOUT_SECS)
+        r.raise_for_status()
+        return r.content
+
+    def close(self):
+        self._session.close()
+
+
+class MjpegStreamCapture():
+    # Opens the MJPEG stream once and keeps the most recent JPEG from the multipart body. capture() returns
+    # the next frame that arrived after the previous call, so the same frame is never recorded twice.
+
+    def __init__(self, stream_url):
+        self.url = stream_url
+        self._session = _new_session()
+        self._cond = Condition()
+        self._latest = None
+        self._seq = 0
+        self._last_returned_seq = 0
+        self._running = False
+        self._generation = 0
+        self._response = None
+
+    def capture(self):
+        self._ensure_running()
+        deadline = time.monotonic() + CAPTURE_TIMEOUT_SECS
+        with self._cond:
+            while self._seq <= self._last_returned_seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('No new frame from MJPEG stream {} in {}s'.format(self.url, CAPTURE_TIMEOUT_SECS))
+                self._cond.wait(remaining)
+            self._last_returned_seq = self._seq
+            return self._latest
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._generation += 1
+            response = self._response
+        if response is not None:
+            response.close()
+
+    def _ensure_running(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._generation += 1
+            thread = Thread(target=self._run, args=(self._generation,))
+            thread.daemon = True
+            thread.start()
+
+    def _publish(self, jpg):
+        with self._cond:
+            self._latest = jpg
+            self._seq += 1
+            self._cond.notify_all()
+
+    def _run(self, generation):
+        # A reader thread exits as soon as close() bumps the generation, even if a new reader was started since
+        while generation == self._generation:
+            try:
+                self._read_stream(generation)
+            except Exception as e:
+                if generation == self._generation:
+                    _logger.warning('MJPEG stream %s interrupted: %s', self.url, e)
+                    time.sleep(1)
+
+    def _read_stream(self, generation):
+        r = self._session.get(self.url, stream=True, timeout=CAPTURE_TIMEOUT_SECS)
+        with self._cond:
+            self._response = r
+        try:
+            r.raise_for_status()
+            matched = _boundary_re.search(r.headers.get('Content-Type', ''))
+            if not matched:
+                raise ValueError('Not a multipart stream: {}'.format(r.headers.get('Content-Type')))
+            boundary = matched.group(1).encode('ascii')
+            if not boundary.startswith(b'--'):
+                boundary = b'--' + boundary
+
+            parser = MultipartJpegParser(boundary)
+            # iter_content() blocks until a whole chunk has arrived, which holds a small frame back until the
+            # next ones fill it. read1() returns whatever is there (urllib3 2+; older versions fall back).
+            read = getattr(r.raw, 'read1', None) or r.raw.read
+            while generation == self._generation:
+                chunk = read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    return
+                for jpg in parser.feed(chunk):
+                    self._publish(jpg)
+        finally:
+            r.close()
+
+
+class MultipartJpegParser():
+    # Incremental multipart/x-mixed-replace parser. Uses the part's Content-Length when the server sends one,
+    # otherwise scans for the next boundary.
+
+    def __init__(self, boundary):
+        self.boundary = boundary
+        self._buf = bytearray()
+
+    def feed(self, chunk):
+        buf = self._buf
+        buf += chunk
+        frames = []
+        while True:
+            start = buf.find(self.boundary)
+            if start < 0:
+                # Keep a tail in case the boundary is split across chunks
+                del buf[:max(0, len(buf) - len(self.boundary))]
+                break
+            header_end = buf.find(b'\r\n\r\n', start)
+            if header_end < 0:
+                del buf[:start]
+                break
+            body_start = header_end + 4
+
+            length = _content_length_re.search(buf, start, header_end)
+            if length:
+                body_end = body_start + int(length.group(1))
+                if len(buf) < body_end:
+                    del buf[:start]
+                    break
+                frames.append(bytes(buf[body_start:body_end]))
+                del buf[:body_end]
+            else:
+                next_start = buf.find(self.boundary, body_start)
+                if next_start < 0:
+                    del buf[:start]
+                    break
+                frames.append(bytes(buf[body_start:next_start]).rstrip(b'\r\n'))
+                del buf[:next_start]
+        return frames
+
+
+def new_capture_backend(snapshot_url, stream_url):
+    if stream_url:
+        return MjpegStreamCapture(stream_url)
+    if snapshot_url:
+        return SnapshotCapture(snapshot_url)
+    return None
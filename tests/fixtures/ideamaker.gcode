@@ -0,0 +1,85 @@
+;Sliced by ideaMaker 4.2.3.5200, 2023-02-12 10:14:02
+;Dimension:235.000000 235.000000 250.000000 0.400000
+;Estimated Print Time:1805
+; Ünïcode comment ✓
+
+M140 S60
+M104 S210
+M190 S60
+M109 S210
+G28
+G90
+M82
+G92 E0
+G1 Z2.0 F3000
+G1 X0.1 Y20 Z0.3 F5000.0
+G1 X0.1 Y200.0 Z0.3 F1500.0 E15
+G1 X0.4 Y200.0 Z0.3 F5000.0
+G1 X0.4 Y20 Z0.3 F1500.0 E30
+G92 E0
+G1 Z2.0 F3000
+M82
+;LAYER:0
+;Z:0.300
+;HEIGHT:0.200000
+G92 E0
+G1 Z0.300 F600
+;PRINTING: cube_0
+;TYPE:WALL-OUTER
+G0 F9000 X50.000 Y40.000
+G1 X40.000 Y50.000 E0.04150
+G1 X30.000 Y40.000 E0.08300
+G1 X40.000 Y30.000 E0.12450
+G1 X50.000 Y40.000 E0.16600
+G1 E-0.63400 F2700
+G1 Z0.700 F600
+G1 Z0.300 F600
+G1 E0.16600 F2700
+;PRINTING: cubé_1
+;TYPE:WALL-OUTER
+G0 F9000 X95.000 Y40.000
+G1 X85.000 Y50.000 E0.20750
+G1 X75.000 Y40.000 E0.24900
+G1 X85.000 Y30.000 E0.29050
+G1 X95.000 Y40.000 E0.33200
+G1 E-0.46800 F2700
+G1 Z0.700 F600
+G1 Z0.300 F600
+G1 E0.33200 F2700
+;LAYER:1
+;Z:0.500
+;HEIGHT:0.200000
+G92 E0
+G1 Z0.500 F600
+;PRINTING: cube_0
+;TYPE:WALL-OUTER
+G0 F9000 X50.000 Y40.000
+G1 X40.000 Y50.000 E0.04150
+G1 X30.000 Y40.000 E0.08300
+G1 X40.000 Y30.000 E0.12450
+G1 X50.000 Y40.000 E0.16600
+G1 E-0.63400 F2700
+G1 Z0.900 F600
+G1 Z0.500 F600
+G1 E0.16600 F2700
+;PRINTING: cubé_1
+;TYPE:WALL-OUTER
+G0 F9000 X95.000 Y40.000
+G1 X85.000 Y50.000 E0.20750
+G1 X75.000 Y40.000 E0.24900
+G1 X85.000 Y30.000 E0.29050
+G1 X95.000 Y40.000 E0.33200
+G1 E-0.46800 F2700
+G1 Z0.900 F600
+G1 Z0.500 F600
+G1 E0.33200 F2700
+M221 S95
+G91
+G1 E-2 F2700
+G1 Z10 F600
+G90
+G1 X0 Y220 F3000
+M106 S0
+M104 S0
+M140 S0
+M84 X Y E
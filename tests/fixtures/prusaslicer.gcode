@@ -0,0 +1,91 @@
+; generated by PrusaSlicer 2.5.0+linux-x64-GTK3 on 2023-02-12 at 10:14:02 UTC
+;
+; external perimeters extrusion width = 0.45mm
+; object:{"name": "cube.stl", "id": "cube.stl id:0 copy 0", "object_center": [40.0, 40.0, 0], "boundingbox_center": [40.0, 40.0, 2.5]}
+; object:{"name": "cube.stl", "id": "cubé.stl id:1 copy 0", "object_center": [85.0, 40.0, 0], "boundingbox_center": [85.0, 40.0, 2.5]}
+; Ünïcode comment ✓
+
+M140 S60
+M104 S210
+M190 S60
+M109 S210
+G28
+G90
+M82
+G92 E0
+G1 Z2.0 F3000
+G1 X0.1 Y20 Z0.3 F5000.0
+G1 X0.1 Y200.0 Z0.3 F1500.0 E15
+G1 X0.4 Y200.0 Z0.3 F5000.0
+G1 X0.4 Y20 Z0.3 F1500.0 E30
+G92 E0
+G1 Z2.0 F3000
+M82
+;LAYER_CHANGE
+;Z:0.300
+;HEIGHT:0.2
+G92 E0
+G1 Z0.300 F600
+; printing object cube.stl id:0 copy 0
+;TYPE:External perimeter
+G0 F9000 X50.000 Y40.000
+G1 X40.000 Y50.000 E0.04150
+G1 X30.000 Y40.000 E0.08300
+G1 X40.000 Y30.000 E0.12450
+G1 X50.000 Y40.000 E0.16600
+G1 E-0.63400 F2700
+G1 Z0.700 F600
+G1 Z0.300 F600
+G1 E0.16600 F2700
+; stop printing object cube.stl id:0 copy 0
+; printing object cubé.stl id:1 copy 0
+;TYPE:External perimeter
+G0 F9000 X95.000 Y40.000
+G1 X85.000 Y50.000 E0.20750
+G1 X75.000 Y40.000 E0.24900
+G1 X85.000 Y30.000 E0.29050
+G1 X95.000 Y40.000 E0.33200
+G1 E-0.46800 F2700
+G1 Z0.700 F600
+G1 Z0.300 F600
+G1 E0.33200 F2700
+; stop printing object cubé.stl id:1 copy 0
+;LAYER_CHANGE
+;Z:0.500
+;HEIGHT:0.2
+G92 E0
+G1 Z0.500 F600
+; printing object cube.stl id:0 copy 0
+;TYPE:External perimeter
+G0 F9000 X50.000 Y40.000
+G1 X40.000 Y50.000 E0.04150
+G1 X30.000 Y40.000 E0.08300
+G1 X40.000 Y30.000 E0.12450
+G1 X50.000 Y40.000 E0.16600
+G1 E-0.63400 F2700
+G1 Z0.900 F600
+G1 Z0.500 F600
+G1 E0.16600 F2700
+; stop printing object cube.stl id:0 copy 0
+; printing object cubé.stl id:1 copy 0
+;TYPE:External perimeter
+G0 F9000 X95.000 Y40.000
+G1 X85.000 Y50.000 E0.20750
+G1 X75.000 Y40.000 E0.24900
+G1 X85.000 Y30.000 E0.29050
+G1 X95.000 Y40.000 E0.33200
+G1 E-0.46800 F2700
+G1 Z0.900 F600
+G1 Z0.500 F600
+G1 E0.33200 F2700
+; stop printing object cubé.stl id:1 copy 0
+M221 S95
+G91
+G1 E-2 F2700
+G1 Z10 F600
+G90
+G1 X0 Y220 F3000
+M106 S0
+M104 S0
+M140 S0
+M84 X Y E
@@ -0,0 +1,54 @@
+import threading
+import time
+
+from octoprint_celestrius.capture_scheduler import CaptureScheduler
+
+INTERVAL = 0.2
+
+
+def wait_in_thread(scheduler):
+    served = []
+    thread = threading.Thread(target=lambda: served.append((scheduler.wait(), time.monotonic())))
+    thread.daemon = True
+    thread.start()
+    return thread, served
+
+
+def test_first_arm_fires_immediately():
+    scheduler = CaptureScheduler(INTERVAL)
+    scheduler.arm()
+    start = time.monotonic()
+    assert scheduler.wait() is not None
+    assert time.monotonic() - start < INTERVAL / 2
+
+
+def test_rearm_waits_for_interval():
+    scheduler = CaptureScheduler(INTERVAL)
+    scheduler.arm()
+    fired_at = scheduler.wait()
+
+    # Out of range and back, e.g. a z-hop, right after a tick
+    scheduler.disarm()
+    scheduler.arm()
+    scheduler.wait()
+    assert time.monotonic() - fired_at >= INTERVAL * 0.95
+    assert scheduler.fired == 2
+
+
+def test_disarmed_scheduler_blocks_until_armed():
+    scheduler = CaptureScheduler(INTERVAL)
+    thread, served = wait_in_thread(scheduler)
+    thread.join(INTERVAL)
+    assert not served
+
+    scheduler.arm()
+    thread.join(1)
+    assert served
+
+
+def test_stop_releases_waiter():
+    scheduler = CaptureScheduler(INTERVAL)
+    thread, served = wait_in_thread(scheduler)
+    scheduler.stop()
+    thread.join(1)
+    assert served[0][0] is None
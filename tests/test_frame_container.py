@@ -0,0 +1,116 @@
+import math
+import os
+import struct
+
+import pytest
+
+from octoprint_celestrius.frame_container import (DATA_FILENAME, INDEX_FILENAME, INDEX_MAGIC, OBJECTS_FILENAME,
+                                                  FrameContainerReader, FrameContainerWriter, container_exists,
+                                                  convert_to_directory, frame_count, legacy_layout_exists)
+
+
+def write_frames(data_dirname):
+    with FrameContainerWriter(str(data_dirname)) as writer:
+        writer.append(1.5, b'first', 1.0, 0)
+        writer.append(2.5, b'second', 0.95, 0.1, layer=0, object_name='cube', z=0.2, file_flow_rate=1.05,
+                      extrusion=0.05)
+    # Reopened, as when a print resumes after a restart: appends, and keeps the object numbering
+    with FrameContainerWriter(str(data_dirname)) as writer:
+        writer.append(3.5, b'third', 0.95, 0.2, layer=1, object_name='cube', z=0.4)
+        writer.append(4.5, b'fourth', 0.95, 0.2, layer=1, object_name='cylinder', z=0.4)
+
+
+def test_append_and_read_back(tmp_path):
+    write_frames(tmp_path)
+    assert container_exists(str(tmp_path))
+
+    with FrameContainerReader(str(tmp_path)) as reader:
+        frames = list(reader)
+    assert [jpg for _, jpg in frames] == [b'first', b'second', b'third', b'fourth']
+    records = [record for record, _ in frames]
+    assert [record.ts for record in records] == [1.5, 2.5, 3.5, 4.5]
+    assert [record.object for record in records] == [None, 'cube', 'cube', 'cylinder']
+    assert [record.layer for record in records] == [-1, 0, 1, 1]
+    assert (records[1].flow_rate, records[1].z_offset, records[1].z, records[1].file_flow_rate,
+            records[1].extrusion) == (0.95, 0.1, 0.2, 1.05, 0.05)
+    assert math.isnan(records[0].z) and math.isnan(records[2].file_flow_rate) and math.isnan(records[2].extrusion)
+    assert (tmp_path / 'frames.obj').read_text() == 'cube\ncylinder\n'
+
+
+def test_frame_count(tmp_path):
+    write_frames(tmp_path / 'container')
+    assert frame_count(str(tmp_path / 'container')) == 4
+
+    # A record cut short by a crash isn't counted
+    with open(tmp_path / 'container' / INDEX_FILENAME, 'ab') as f:
+        f.write(b'\0' * 10)
+    assert frame_count(str(tmp_path / 'container')) == 4
+
+    legacy = tmp_path / 'legacy'
+    legacy.mkdir()
+    for ts in (1.0, 2.0):
+        (legacy / f'{ts}.jpg').write_bytes(b'jpg')
+        (legacy / f'{ts}.labels').write_text('flow_rate:1.0\nz_offset:0\n')
+    assert frame_count(str(legacy)) == 2
+
+
+def test_convert_to_directory(tmp_path):
+    write_frames(tmp_path)
+    assert convert_to_directory(str(tmp_path), remove_container=True) == 4
+
+    assert not container_exists(str(tmp_path))
+    assert legacy_layout_exists(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == sorted(f'{ts}.{ext}' for ts in (1.5, 2.5, 3.5, 4.5)
+                                                  for ext in ('jpg', 'labels'))
+    assert (tmp_path / '2.5.jpg').read_bytes() == b'second'
+    assert (tmp_path / '1.5.labels').read_text() == 'flow_rate:1.0\nz_offset:0.0\n'
+    assert (tmp_path / '2.5.labels').read_text() == \
+        'flow_rate:0.95\nz_offset:0.1\nlayer:0\nz:0.2\nobject:cube\nfile_flow_rate:1.05\nextrusion:0.05\n'
+    assert frame_count(str(tmp_path)) == 4
+
+
+def test_reads_version_1_index(tmp_path):
+    # As written before the timeline labels: no layer, object, z or file flow rate
+    jpgs = [b'first', b'second']
+    offset = 0
+    with open(tmp_path / DATA_FILENAME, 'wb') as data, open(tmp_path / INDEX_FILENAME, 'wb') as index:
+        index.write(struct.pack('<4sH', INDEX_MAGIC, 1))
+        for ts, jpg in zip((1.0, 2.0), jpgs):
+            data.write(struct.pack('<I', len(jpg)) + jpg)
+            index.write(struct.pack('<dQIdd', ts, offset + 4, len(jpg), 1.0, 0.1))
+            offset += 4 + len(jpg)
+
+    assert frame_count(str(tmp_path)) == 2
+    with FrameContainerReader(str(tmp_path)) as reader:
+        frames = list(reader)
+    assert [jpg for _, jpg in frames] == jpgs
+    record = frames[1][0]
+    assert (record.ts, record.flow_rate, record.z_offset, record.layer, record.object) == (2.0, 1.0, 0.1, -1, None)
+    assert math.isnan(record.z) and math.isnan(record.file_flow_rate) and math.isnan(record.extrusion)
+
+
+def test_appends_to_version_2_index_in_its_own_format(tmp_path):
+    # Collected before the commanded extrusion label, then resumed after an update
+    jpg = b'first'
+    (tmp_path / OBJECTS_FILENAME).write_text('cube\n')
+    with open(tmp_path / DATA_FILENAME, 'wb') as data, open(tmp_path / INDEX_FILENAME, 'wb') as index:
+        data.write(struct.pack('<I', len(jpg)) + jpg)
+        index.write(struct.pack('<4sH', INDEX_MAGIC, 2))
+        index.write(struct.pack('<dQIddiidd', 1.0, 4, len(jpg), 1.0, 0.1, 0, 0, 0.2, 1.05))
+    with FrameContainerWriter(str(tmp_path)) as writer:
+        writer.append(2.0, b'second', 1.0, 0.1, layer=1, object_name='cube', z=0.4, extrusion=0.05)
+
+    with FrameContainerReader(str(tmp_path)) as reader:
+        frames = list(reader)
+    assert [jpg for _, jpg in frames] == [b'first', b'second']
+    records = [record for record, _ in frames]
+    assert [(record.layer, record.object, record.z) for record in records] == [(0, 'cube', 0.2), (1, 'cube', 0.4)]
+    assert records[0].file_flow_rate == 1.05
+    assert math.isnan(records[0].extrusion) and math.isnan(records[1].extrusion)
+
+
+def test_rejects_unknown_index(tmp_path):
+    (tmp_path / DATA_FILENAME).write_bytes(b'')
+    (tmp_path / INDEX_FILENAME).write_bytes(struct.pack('<4sH', INDEX_MAGIC, 99))
+    with pytest.raises(ValueError):
+        FrameContainerReader(str(tmp_path))
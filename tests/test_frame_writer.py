@@ -0,0 +1,66 @@
+import threading
+
+from octoprint_celestrius.frame_container import FrameContainerReader
+from octoprint_celestrius.frame_writer import DROP_NEWEST, DROP_OLDEST, Frame, FrameWriter
+
+
+def frame(data_dirname, ts):
+    return Frame(str(data_dirname), float(ts), 'jpg {}'.format(ts).encode(), dict(flow_rate=1.0, z_offset=0))
+
+
+def fill(writer, data_dirname, num_frames):
+    # Before start(), as if the disk were stalled: nothing leaves the queue
+    return [writer.put(frame(data_dirname, ts)) for ts in range(num_frames)]
+
+
+def flush(writer, data_dirname):
+    closed = threading.Event()
+    writer.close_session(str(data_dirname), lambda _: closed.set())
+    if writer._thread is None:
+        writer.start()
+    assert closed.wait(10)
+    with FrameContainerReader(str(data_dirname)) as reader:
+        return [record.ts for record in reader.records()]
+
+
+def test_drop_oldest_keeps_the_latest_frames(tmp_path):
+    writer = FrameWriter(maxsize=4, policy=DROP_OLDEST)
+    assert fill(writer, tmp_path, 6) == [True] * 6
+    assert writer.depth() == 4
+    assert (writer.captured, writer.dropped) == (6, 2)
+
+    assert flush(writer, tmp_path) == [2.0, 3.0, 4.0, 5.0]
+
+
+def test_drop_newest_keeps_the_earliest_frames(tmp_path):
+    writer = FrameWriter(maxsize=4, policy=DROP_NEWEST)
+    assert fill(writer, tmp_path, 6) == [True] * 4 + [False] * 2
+    assert writer.depth() == 4
+    assert (writer.captured, writer.dropped) == (6, 2)
+
+    assert flush(writer, tmp_path) == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_close_markers_are_never_dropped(tmp_path):
+    writer = FrameWriter(maxsize=2, policy=DROP_OLDEST)
+    closed = []
+    first, second = tmp_path / 'print.1', tmp_path / 'print.2'
+    fill(writer, first, 2)
+    writer.close_session(str(first), closed.append)
+    # Frames of the next print push the previous print's frames out, but not its close marker
+    fill(writer, second, 2)
+
+    assert flush(writer, second) == [0.0, 1.0]
+    assert closed == [str(first)]
+    assert writer.stats()['dropped'] == 2
+
+
+def test_stop_flushes_every_queued_frame(tmp_path):
+    written = []
+    writer = FrameWriter(maxsize=16, on_write=lambda data_dirname, num_bytes: written.append(num_bytes))
+    fill(writer, tmp_path, 10)
+
+    assert flush(writer, tmp_path) == [float(ts) for ts in range(10)]
+    stats = writer.stats()
+    assert (stats['captured'], stats['written'], stats['dropped'], stats['queue_depth']) == (10, 10, 0, 0)
+    assert stats['bytes_written'] == sum(written)
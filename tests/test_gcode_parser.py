@@ -0,0 +1,65 @@
+import pytest
+
+from benchmarks.baseline import BaselineGcodeParser
+from octoprint_celestrius.gcode_object import Gcode_parser
+from testsupport import SLICERS, sample_lines
+
+
+EDGE_CASES = [
+    'G1 X10 Y20 Z0.3 E1.5 F1200',
+    'G0 X10',
+    'G1\tX10\tE0.5',
+    'G1  X10   Y20',
+    'G1 E-0.8 F2700',
+    'G1 X-10.5 Y-0.25',
+    'G1 X.5 Y5.',
+    'G1 X10Y20 E1',
+    'G1 X1.2.3',
+    'G1 X10 Y20 ; E5 in a comment',
+    'G1 X10 X20',
+    'G1 Z0.2 F600',
+    'G10',
+    'G11',
+    'G28 X Y',
+    'G92 E0',
+    'G01 X10',
+    'g1 x10',
+    'M82',
+    'M221 S95',
+    '; G1 X10',
+    '@Object cube',
+    'G1',
+]
+
+
+@pytest.mark.parametrize('line', EDGE_CASES)
+def test_parse_move_args_matches_baseline(line):
+    assert Gcode_parser().parse_move_args(line) == BaselineGcodeParser().parse_move_args(line)
+
+
+@pytest.mark.parametrize('relative_e', [False, True])
+@pytest.mark.parametrize('slicer', SLICERS)
+def test_parse_move_args_matches_baseline_on_slicer_output(slicer, relative_e):
+    parser, baseline = Gcode_parser(), BaselineGcodeParser()
+    lines = sample_lines(slicer, num_layers=3, relative_e=relative_e)
+    assert [parser.parse_move_args(line) for line in lines] == [baseline.parse_move_args(line) for line in lines]
+
+
+@pytest.mark.parametrize('line, expected', [
+    # The baseline raised ValueError on a parameter without a number, the parser skips that parameter
+    ('G1 X Y10', (None, 10.0, None, None, None)),
+    ('G1 X10 Ex', (10.0, None, None, None, None)),
+    ('G1 X- E1', (None, None, None, 1.0, None)),
+])
+def test_parse_move_args_skips_bad_numbers(line, expected):
+    with pytest.raises(ValueError):
+        BaselineGcodeParser().parse_move_args(line)
+    assert Gcode_parser().parse_move_args(line) == expected
+
+
+def test_repeated_line_is_parsed_again_after_another():
+    parser = Gcode_parser()
+    first = 'G1 X10 E1'
+    assert parser.parse_move_args(first) == (10.0, None, None, 1.0, None)
+    assert parser.parse_move_args('G1 X20 E2') == (20.0, None, None, 2.0, None)
+    assert parser.parse_move_args(''.join(['G1 X10', ' E1'])) == (10.0, None, None, 1.0, None)
@@ -0,0 +1,58 @@
+import io
+import os
+import shutil
+
+import pytest
+
+from benchmarks.baseline import BaselineModifyComments
+from octoprint_celestrius.gcode_object import GCodeObject, ModifyComments
+from testsupport import SLICERS, sample_bytes
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+@pytest.fixture(scope='module')
+def gcode_object():
+    gcode_object = GCodeObject(None)
+    gcode_object.initialize()
+    return gcode_object
+
+
+def preprocess(stream, length=0):
+    output = io.BytesIO()
+    shutil.copyfileobj(stream, output, length)
+    return output.getvalue()
+
+
+def modify_comments(gcode_object, data):
+    # As the preprocessor hook sets it up, with the object scan fed on the way
+    scan = gcode_object.new_object_scan()
+    return ModifyComments(io.BufferedReader(io.BytesIO(data)), gcode_object.object_regex, gcode_object.reptag, scan,
+                          scan.finish)
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('length', [0, 7])
+@pytest.mark.parametrize('slicer', SLICERS)
+def test_output_matches_golden(gcode_object, slicer, length):
+    data = read_fixture('{}.gcode'.format(slicer))
+    assert preprocess(modify_comments(gcode_object, data), length) == read_fixture('{}.expected.gcode'.format(slicer))
+
+
+@pytest.mark.parametrize('relative_e', [False, True])
+@pytest.mark.parametrize('slicer', SLICERS)
+def test_output_matches_baseline(gcode_object, slicer, relative_e):
+    data = sample_bytes(slicer, num_objects=4, num_layers=10, relative_e=relative_e)
+    baseline = BaselineModifyComments(io.BufferedReader(io.BytesIO(data)), gcode_object.object_regex, gcode_object.reptag)
+    assert preprocess(modify_comments(gcode_object, data)) == preprocess(baseline)
+
+
+@pytest.mark.parametrize('slicer', SLICERS)
+def test_detects_slicer_from_header(gcode_object, slicer):
+    stream = modify_comments(gcode_object, read_fixture('{}.gcode'.format(slicer)))
+    preprocess(stream)
+    assert stream.slicer == slicer
@@ -0,0 +1,60 @@
+import sys
+import threading
+
+import pytest
+
+from octoprint_celestrius import INITIAL_LABEL_STATE, _parse_z_move, _z_move_re
+from testsupport import new_plugin
+
+
+@pytest.fixture
+def fast_switching():
+    # Make a lost update between threads likely, if the writers could race
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_concurrent_writers_dont_lose_updates(tmp_path, fast_switching):
+    plugin = new_plugin(tmp_path)
+    n = 20000
+
+    def reset_z_offset():
+        # What the event threads do between prints
+        for _ in range(n):
+            plugin.update_label_state(z_offset=0)
+
+    other = threading.Thread(target=reset_z_offset)
+    other.start()
+    # The comm thread writes the state through the sent hook (Z moves, M221), and counts objects through
+    # check_atcommand
+    for _ in range(n):
+        plugin.next_object()
+    other.join()
+
+    assert plugin.label_state.num_gcode_objects_seen == n
+
+
+def test_update_label_state_publishes_new_tuple(tmp_path):
+    plugin = new_plugin(tmp_path)
+    before = plugin.label_state
+    plugin.update_label_state(flow_rate=0.95)
+    assert before is INITIAL_LABEL_STATE
+    assert before.flow_rate == 1.0
+    assert plugin.label_state.flow_rate == 0.95
+
+
+@pytest.mark.parametrize('cmd', ['G1 Z0.3', 'G1 Z0.300 F600', 'G0 Z10', 'G1 Z-0.05 F300', 'G1 Z.2', 'G1 Z0.3F600',
+                                 'G1Z0.3', 'G1  Z0.3', 'g1 z0.3', 'G1 X10 Z0.3', 'G1 Z', 'G1 Zfoo'])
+def test_parse_z_move_agrees_with_the_regex(cmd):
+    match = _z_move_re.match(cmd)
+    assert _parse_z_move(cmd) == (float(match.group(2)) if match else None)
+
+
+def test_z_hops_publish_every_height(tmp_path):
+    plugin = new_plugin(tmp_path)
+    for cmd in ['G1 Z0.3 F600', 'G1 Z0.7 F600', 'G1 Z0.3 F600', 'G1 Z0.7 F600']:
+        plugin.sent_gcode(None, 'sent', cmd, None, 'G1', None, {'source:file'})
+        assert plugin.label_state.official_z == float(cmd.split()[1][1:])
+        assert plugin.sampling_policy.current_z == plugin.label_state.official_z
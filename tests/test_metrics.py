@@ -0,0 +1,53 @@
+import flask
+
+from octoprint_celestrius.metrics import HOOK_TIMING_SAMPLE_MASK
+from testsupport import new_plugin
+
+
+def send_moves(plugin, num_calls):
+    for i in range(num_calls):
+        cmd = 'G1 X{} Y10 E0.1'.format(i)
+        plugin.gcode_object.check_queue(None, 'queuing', cmd, None, 'G1', None)
+        plugin.sent_gcode(None, 'sent', cmd, None, 'G1')
+
+
+def prometheus(plugin):
+    with flask.Flask(__name__).test_request_context(query_string=dict(format='prometheus')):
+        return plugin.on_api_get(flask.request).get_data(as_text=True)
+
+
+def test_hooks_time_one_call_in_64(tmp_path):
+    plugin = new_plugin(tmp_path)
+    send_moves(plugin, 2 * (HOOK_TIMING_SAMPLE_MASK + 1))
+
+    assert (plugin.sent_hook_calls, plugin.sent_hook_histogram.count) == (128, 2)
+    assert (plugin.gcode_object.queue_hook_calls, plugin.gcode_object.queue_hook_histogram.count) == (128, 2)
+    text = prometheus(plugin)
+    assert 'celestrius_metrics_enabled 1\n' in text
+    assert 'celestrius_sent_hook_calls_total 128\n' in text
+
+
+def test_disabled_metrics_are_not_recorded(tmp_path):
+    plugin = new_plugin(tmp_path, metrics_enabled=False)
+    send_moves(plugin, 2 * (HOOK_TIMING_SAMPLE_MASK + 1))
+    plugin.gcode_object.check_atcommand(None, 'queuing', 'Object', 'cube')
+
+    assert (plugin.sent_hook_calls, plugin.sent_hook_histogram.count) == (0, 0)
+    assert (plugin.gcode_object.queue_hook_calls, plugin.gcode_object.queue_hook_histogram.count) == (0, 0)
+    assert plugin.gcode_object.atcommand_hook_histogram.count == 0
+    # The hooks still do their job
+    assert plugin.label_state.num_gcode_objects_seen == 1
+    text = prometheus(plugin)
+    assert 'celestrius_metrics_enabled 0\n' in text
+    assert '_hook_' not in text and 'capture_seconds' not in text
+    assert 'celestrius_frames_captured_total 0\n' in text
+
+
+def test_setting_is_read_on_save(tmp_path):
+    plugin = new_plugin(tmp_path)
+    plugin._settings.set(['metrics_enabled'], False)
+    plugin.update_metrics_enabled()
+    send_moves(plugin, HOOK_TIMING_SAMPLE_MASK + 1)
+
+    assert not plugin.gcode_object.metrics_enabled
+    assert plugin.sent_hook_histogram.count == plugin.gcode_object.queue_hook_histogram.count == 0
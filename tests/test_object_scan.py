@@ -0,0 +1,77 @@
+import io
+import shutil
+
+import pytest
+
+from octoprint_celestrius.gcode_object import GCodeObject, ModifyComments
+from testsupport import SLICERS, sample_bytes
+
+
+@pytest.fixture
+def gcode_object():
+    gcode_object = GCodeObject(None)
+    gcode_object.initialize()
+    return gcode_object
+
+
+def preprocess(gcode_object, data):
+    scan = gcode_object.new_object_scan()
+    stream = ModifyComments(io.BufferedReader(io.BytesIO(data)), gcode_object.object_regex, gcode_object.reptag, scan,
+                            scan.finish)
+    output = io.BytesIO()
+    shutil.copyfileobj(stream, output)
+    return output.getvalue(), scan
+
+
+@pytest.mark.parametrize('line, e', [
+    ('G92 E0', 0.0),
+    ('G92 E12.5', 12.5),
+    ('G92 E', 0.0),
+    ('G92 E3x', 3.0),
+    ('G92 Ex1', 0.0),
+    ('G92 E-', 7.0),
+])
+def test_g92_sets_extruder_position(gcode_object, line, e):
+    scan = gcode_object.new_object_scan()
+    scan.feed_command('G92 E7')
+    scan.feed_command(line)
+    assert scan._e == e
+
+
+def test_bad_g92_does_not_break_upload(gcode_object):
+    data = b'; generated by PrusaSlicer 2.5.0\n; printing object cube\nG92 Ex1\nG1 X10 Y10 Z0.2 E1\nG1 X20 E2\n'
+    output, scan = preprocess(gcode_object, data)
+    assert b'@Object cube\n' in output
+    assert b'G92 Ex1\n' in output
+    assert scan.objects.get('cube').extruded == 2.0
+
+
+@pytest.mark.parametrize('slicer', SLICERS)
+def test_scan_measures_every_object(gcode_object, slicer):
+    _, scan = preprocess(gcode_object, sample_bytes(slicer, num_objects=3, num_layers=4))
+    assert scan.objects_known
+    assert len(scan.objects) == 3
+    for entry in scan.objects:
+        assert entry.layer_count == 4
+        assert entry.min_z == 0.3
+        assert entry.max_z == pytest.approx(0.9)
+
+
+def test_timeline_labels_commanded_extrusion(gcode_object):
+    data = (b'; printing object cube\nG1 Z0.2\nG1 X0 Y0\nG1 X10 E0.5\nG1 X20 E1.0\nG1 X30 E1.51\nM221 S95\n'
+            b'G1 X40 E2.51\nG1 Z0.4\nG1 X30 E2.76\n')
+    output, scan = preprocess(gcode_object, data)
+
+    def state_at(line):
+        return scan.timeline.lookup(output.index(line))
+
+    first = state_at(b'G1 X10 E0.5')
+    assert (first.layer, first.z, first.object, first.flow_rate) == (0, 0.2, 'cube', 1.0)
+    assert first.extrusion == pytest.approx(0.05)
+    # A change within a few percent is the same feature, not a new entry
+    assert state_at(b'G1 X30 E1.51').extrusion == pytest.approx(0.05)
+    infill = state_at(b'G1 X40 E2.51')
+    assert (infill.flow_rate, infill.extrusion) == (0.95, pytest.approx(0.1))
+    next_layer = state_at(b'G1 X30 E2.76')
+    assert (next_layer.layer, next_layer.z, next_layer.extrusion) == (1, 0.4, pytest.approx(0.025))
+    assert len(scan.timeline) == 5
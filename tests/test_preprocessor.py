@@ -0,0 +1,21 @@
+import io
+import shutil
+
+from octoprint_celestrius.gcode_object import GCodeObject, ModifyComments
+
+
+def test_scan_completes_when_upload_is_saved():
+    # OctoPrint saves a preprocessed upload with shutil.copyfileobj()
+    gcode_object = GCodeObject(None)
+    gcode_object.initialize()
+    scan = gcode_object.new_object_scan()
+    completed = []
+    data = b'; generated by PrusaSlicer 2.5.0\n; printing object cube\nG1 X10 Y10 Z0.2 E1\nG1 X20 E2\n'
+    stream = ModifyComments(io.BufferedReader(io.BytesIO(data)), gcode_object.object_regex, gcode_object.reptag, scan,
+                            lambda: completed.append(scan.finish()))
+    output = io.BytesIO()
+    shutil.copyfileobj(stream, output)
+
+    assert output.getvalue() == data.replace(b'; printing object cube', b'@Object cube')
+    assert len(completed) == 1
+    assert scan.objects.get('cube').extruded == 2.0
@@ -0,0 +1,81 @@
+from octoprint.events import Events
+
+from octoprint_celestrius import MAX_SNAPSHOT_NUM_IN_PRINT
+from octoprint_celestrius import sampling_policy
+from octoprint_celestrius.sampling_policy import (SamplingPolicy, DENSE_INTERVAL_SECS, DEFAULT_INTERVAL_SECS,
+                                                  SPARSE_INTERVAL_SECS)
+from testsupport import new_plugin
+
+# What the plugin sampled at before the policy existed
+BASELINE_INTERVAL_SECS = 0.4
+
+
+class Clock():
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def new_policy(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sampling_policy.time, 'monotonic', clock)
+    return SamplingPolicy(), clock
+
+
+def test_never_samples_faster_than_baseline():
+    assert min(DENSE_INTERVAL_SECS, DEFAULT_INTERVAL_SECS, SPARSE_INTERVAL_SECS) >= BASELINE_INTERVAL_SECS
+    # Still 30 minutes' worth of frames at the densest rate
+    assert MAX_SNAPSHOT_NUM_IN_PRINT * DENSE_INTERVAL_SECS == 30 * 60
+
+
+def test_first_layer_starts_with_first_extrusion(monkeypatch):
+    policy, clock = new_policy(monkeypatch)
+    # Start G-code lifts the nozzle before the first layer
+    policy.on_z(2.0)
+    clock.now += 5
+    policy.on_z(0.2)
+    policy.on_extrusion()
+    assert policy.first_layer_z == 0.2
+    assert policy.on_first_layer()
+
+    # A z-hop neither extrudes nor starts a layer
+    clock.now += 5
+    policy.on_z(0.6)
+    policy.on_z(0.2)
+    policy.on_extrusion()
+    assert policy.max_z == 0.2
+    assert policy.next_interval(clock.now) == DENSE_INTERVAL_SECS
+
+    clock.now += 5
+    policy.on_z(0.4)
+    policy.on_extrusion()
+    assert policy.max_z == 0.4
+    assert not policy.on_first_layer()
+    assert policy.next_interval(clock.now) == DENSE_INTERVAL_SECS
+    clock.now += sampling_policy.LAYER_CHANGE_DENSE_SECS
+    policy.on_extrusion()
+    assert policy.next_interval(clock.now) == DEFAULT_INTERVAL_SECS
+    clock.now += sampling_policy.EXTRUDING_WINDOW_SECS + 0.1
+    assert policy.next_interval(clock.now) == SPARSE_INTERVAL_SECS
+
+
+def test_no_first_layer_before_extrusion(monkeypatch):
+    policy, clock = new_policy(monkeypatch)
+    policy.on_z(2.0)
+    assert policy.first_layer_z is None
+    assert not policy.on_first_layer()
+
+
+def test_print_started_resets_policy(tmp_path):
+    plugin = new_plugin(tmp_path)
+    policy = plugin.sampling_policy
+    policy.on_z(0.3)
+    policy.on_extrusion()
+    assert policy.first_layer_z == 0.3
+
+    plugin.on_event(Events.PRINT_STARTED, {'name': 'next.gcode', 'path': 'next.gcode', 'origin': 'sdcard'})
+    assert policy.first_layer_z is None
+    assert policy.current_z is None
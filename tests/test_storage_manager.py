@@ -0,0 +1,87 @@
+import os
+from collections import namedtuple
+
+from octoprint_celestrius import storage_manager
+from octoprint_celestrius.storage_manager import DEGRADED, OK, PAUSED, StorageManager
+
+DiskUsage = namedtuple('DiskUsage', ['total', 'used', 'free'])
+
+
+def data_folder_with(tmp_path, sizes):
+    for name, size in sizes.items():
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'frames.dat').write_bytes(b'x' * size)
+    return {name: str(tmp_path / name) for name in sizes}
+
+
+def manager_of(tmp_path, budget_bytes, evictable=(), fail_evict=()):
+    evicted = []
+
+    def evict(path):
+        if path in fail_evict:
+            raise OSError('Permission denied')
+        evicted.append(path)
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+
+    storage = StorageManager(str(tmp_path), budget_bytes, 0, list_evictable=lambda: list(evictable), evict=evict)
+    storage.scan()
+    return storage, evicted
+
+
+def test_degrades_near_the_budget(tmp_path):
+    data_folder_with(tmp_path, {'print.1': 700})
+    storage, evicted = manager_of(tmp_path, 1000)
+    assert storage.check() == OK
+
+    storage.record_write(str(tmp_path / 'print.2'), 100)
+    assert storage.check() == DEGRADED
+    assert storage.level == DEGRADED
+    assert evicted == []
+
+
+def test_evicts_oldest_until_within_budget(tmp_path):
+    paths = data_folder_with(tmp_path, {'print.1': 400, 'print.2': 400, 'print.3': 400})
+    storage, evicted = manager_of(tmp_path, 1000, evictable=[paths['print.1'], paths['print.2'], paths['print.3']])
+
+    assert storage.check(active_path=paths['print.1']) == DEGRADED
+    # The print being collected is never evicted, and eviction stops once back under the budget
+    assert evicted == [paths['print.2']]
+    assert storage.usage() == 800
+    assert storage.stats()['evicted'] == 1
+
+
+def test_pauses_when_eviction_cant_free_enough(tmp_path):
+    paths = data_folder_with(tmp_path, {'print.1': 600, 'print.2': 600})
+    storage, evicted = manager_of(tmp_path, 1000, evictable=[paths['print.1']], fail_evict=[paths['print.1']])
+
+    assert storage.check(active_path=paths['print.2']) == PAUSED
+    assert evicted == []
+    assert storage.usage() == 1200
+
+
+def test_resumes_once_space_is_freed(tmp_path):
+    paths = data_folder_with(tmp_path, {'print.1': 600, 'print.2': 600})
+    storage, _ = manager_of(tmp_path, 1000)
+    assert storage.check() == PAUSED
+
+    # e.g. an upload finished and its data was deleted
+    storage.record_removed(paths['print.1'])
+    assert storage.check() == OK
+
+
+def test_pauses_on_low_disk_space(tmp_path, monkeypatch):
+    free = [10]
+    monkeypatch.setattr(storage_manager.shutil, 'disk_usage', lambda path: DiskUsage(100, 100 - free[0], free[0]))
+    storage = StorageManager(str(tmp_path), 0, 20)
+    storage.scan()
+    assert storage.check() == PAUSED
+
+    free[0] = 30
+    # Free space is only looked up again after a while, or after a deletion
+    assert storage.check() == PAUSED
+    storage.record_removed(str(tmp_path / 'print.1'))
+    assert storage.check() == DEGRADED
+    free[0] = 50
+    storage.record_removed(str(tmp_path / 'print.2'))
+    assert storage.check() == OK
@@ -0,0 +1,167 @@
+import json
+import sys
+import types
+
+import pytest
+
+from octoprint_celestrius import upload
+from octoprint_celestrius.packager import stream_upload
+from octoprint_celestrius.upload import GcsUploadSink, LocalDirectoryUploadSink, S3UploadSink, UploadSink
+from testsupport import new_plugin
+
+
+def test_upload_sink_is_abstract():
+    with pytest.raises(TypeError):
+        UploadSink()
+
+    class Incomplete(UploadSink):
+        def begin(self, name, content_type):
+            return name
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_gcs_sink_implements_upload_sink():
+    assert isinstance(GcsUploadSink(), UploadSink)
+
+
+def test_local_directory_sink_resumes_after_restart(tmp_path):
+    chunks = [b'a' * 100, b'b' * 100, b'c' * 50]
+    sink = LocalDirectoryUploadSink(str(tmp_path))
+    upload_id = sink.begin('pilot@example.com/print.tgz', 'application/gzip')
+    sink.send(upload_id, 0, chunks[0], False)
+
+    # A new sink, as after an OctoPrint restart, picks up from what made it to disk
+    sink = LocalDirectoryUploadSink(str(tmp_path))
+    offset = sink.committed_offset(upload_id)
+    assert offset == 100
+    assert stream_upload(sink, upload_id, iter(chunks), start_offset=offset) == 250
+
+    assert (tmp_path / 'pilot@example.com' / 'print.tgz').read_bytes() == b''.join(chunks)
+    assert not (tmp_path / 'pilot@example.com' / 'print.tgz.part').exists()
+    assert sink.committed_offset(upload_id) is None
+
+
+def test_local_directory_sink_unknown_upload(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        LocalDirectoryUploadSink(str(tmp_path)).committed_offset(str(tmp_path / 'missing.tgz.part'))
+
+
+def test_default_local_upload_dir_is_outside_data_folder(tmp_path):
+    data_folder = tmp_path / 'data' / 'celestrius'
+    data_folder.mkdir(parents=True)
+    sink = new_plugin(data_folder, upload_backend='local').new_upload_sink()
+    assert sink.directory == str(tmp_path / 'data' / 'celestrius_uploads')
+
+
+class FakeS3():
+    # The parts of a boto3 S3 client that S3UploadSink uses, keeping uploads in memory
+
+    class NoSuchUpload(Exception):
+        pass
+
+    class ClientError(Exception):
+        def __init__(self, code):
+            super().__init__(code)
+            self.response = dict(Error=dict(Code=code))
+
+    def __init__(self):
+        self.exceptions = self
+        self.uploads = {}  # upload id -> {part number: bytes}
+        self.objects = {}
+        self.list_parts_calls = 0
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        upload_id = 'upload-{}'.format(len(self.uploads) + 1)
+        self.uploads[upload_id] = {}
+        return dict(UploadId=upload_id)
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return dict(ETag='"etag-{}"'.format(PartNumber))
+
+    def get_paginator(self, name):
+        assert name == 'list_parts'
+        return self
+
+    def paginate(self, Bucket, Key, UploadId):
+        self.list_parts_calls += 1
+        if UploadId not in self.uploads:
+            raise self.NoSuchUpload(UploadId)
+        parts = [dict(PartNumber=n, ETag='"etag-{}"'.format(n), Size=len(body))
+                 for n, body in self.uploads[UploadId].items()]
+        # One part per page, like a long upload's listing
+        return [dict(Parts=[part]) for part in parts] or [dict()]
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        assert [part['PartNumber'] for part in MultipartUpload['Parts']] == sorted(parts)
+        assert all(part['ETag'] == '"etag-{}"'.format(part['PartNumber']) for part in MultipartUpload['Parts'])
+        self.objects[Key] = b''.join(parts[n] for n in sorted(parts))
+
+    def abort_multipart_upload(self, UploadId):
+        del self.uploads[UploadId]
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.ClientError('404')
+        return dict(ContentLength=len(self.objects[Key]))
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = FakeS3()
+    monkeypatch.setitem(sys.modules, 'boto3', types.SimpleNamespace(client=lambda *args, **kwargs: client))
+    monkeypatch.setattr(upload, 'S3_MIN_PART_SIZE', 100)
+    return client
+
+
+def s3_chunks():
+    return [bytes([i]) * 60 for i in range(10)]
+
+
+def test_s3_sink_multipart_upload(s3):
+    sink = S3UploadSink('bucket')
+    upload_id = sink.begin('pilot@example.com/print.tgz', 'application/gzip')
+    assert stream_upload(sink, upload_id, iter(s3_chunks())) == 600
+
+    assert s3.objects['pilot@example.com/print.tgz'] == b''.join(s3_chunks())
+    # Parts are only listed before the first chunk, not before every part
+    assert s3.list_parts_calls == 1
+    assert sink.committed_offset(upload_id) is None
+
+
+def test_s3_sink_resumes_after_restart(s3):
+    chunks = s3_chunks()
+    sink = S3UploadSink('bucket')
+    upload_id = sink.begin('pilot@example.com/print.tgz', 'application/gzip')
+    for i, chunk in enumerate(chunks[:5]):
+        sink.send(upload_id, i * 60, chunk, False)
+    assert len(s3.uploads[json.loads(upload_id)['upload_id']]) == 2
+
+    # The buffered 60 bytes after the two 120-byte parts are lost with the process
+    sink = S3UploadSink('bucket')
+    offset = sink.committed_offset(upload_id)
+    assert offset == 240
+    assert stream_upload(sink, upload_id, iter(chunks), start_offset=offset) == 600
+    assert s3.objects['pilot@example.com/print.tgz'] == b''.join(chunks)
+
+
+def test_s3_sink_completed_upload(s3):
+    sink = S3UploadSink('bucket')
+    upload_id = sink.begin('pilot@example.com/print.tgz', 'application/gzip')
+    stream_upload(sink, upload_id, iter(s3_chunks()))
+
+    # The store no longer knows the upload id once completed, but has the object
+    assert S3UploadSink('bucket').committed_offset(upload_id) is None
+
+
+def test_s3_sink_aborted_upload(s3):
+    sink = S3UploadSink('bucket')
+    upload_id = sink.begin('pilot@example.com/print.tgz', 'application/gzip')
+    sink.send(upload_id, 0, b'a' * 150, False)
+    s3.abort_multipart_upload(json.loads(upload_id)['upload_id'])
+
+    with pytest.raises(FileNotFoundError):
+        S3UploadSink('bucket').committed_offset(upload_id)
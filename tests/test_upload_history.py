@@ -0,0 +1,92 @@
+import json
+from datetime import datetime
+
+import flask
+
+from octoprint_celestrius.upload_history import LEGACY_CSV_FILENAME, MAX_PAGE_SIZE, UploadHistory
+from octoprint_celestrius.upload_queue import DONE, EVICTED, FAILED
+from testsupport import new_plugin
+
+
+def history_of(tmp_path, num_entries=0):
+    history = UploadHistory(str(tmp_path / 'upload_history.db'))
+    history.start()
+    for i in range(num_entries):
+        history.record('print.{}'.format(i), (DONE, FAILED, EVICTED)[i % 3], 1000.0 + i, size_bytes=i * 100,
+                       num_frames=i, duration_secs=i / 10)
+    return history
+
+
+def test_pages_newest_first(tmp_path):
+    history = history_of(tmp_path, 25)
+    total, first = history.query(offset=0, limit=10)
+    _, second = history.query(offset=10, limit=10)
+    _, last = history.query(offset=20, limit=10)
+
+    assert total == 25
+    assert [entry['name'] for entry in first + second + last] == ['print.{}'.format(i) for i in range(24, -1, -1)]
+    assert first[0] == dict(id=25, name='print.24', uploaded_at=1024.0, status=DONE, size_bytes=2400,
+                            num_frames=24, duration_secs=2.4)
+    assert history.query(offset=25)[1] == []
+    assert len(history.query(limit=MAX_PAGE_SIZE + 1)[1]) == 25
+
+
+def test_since(tmp_path):
+    history = history_of(tmp_path, 25)
+    total, entries = history.query(since=1020.0)
+    assert total == 5
+    assert [entry['uploaded_at'] for entry in entries] == [1024.0, 1023.0, 1022.0, 1021.0, 1020.0]
+    assert history.query(since=2000.0) == (0, [])
+
+
+def test_version_changes_with_every_entry(tmp_path):
+    history = history_of(tmp_path)
+    versions = {history.version()}
+    for i in range(3):
+        history.record('print.{}'.format(i), DONE, 1000.0 + i)
+        versions.add(history.version())
+    assert len(versions) == 4
+
+
+def test_api_etag(tmp_path):
+    plugin = new_plugin(tmp_path)
+    plugin.upload_history = history_of(tmp_path, 3)
+    app = flask.Flask(__name__)
+
+    def call(data, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        with app.test_request_context(headers=headers):
+            return plugin.on_api_command('upload_history', data)
+
+    response = call(dict(limit=2))
+    assert response.status_code == 200
+    assert json.loads(response.get_data())['total'] == 3
+    assert [entry['name'] for entry in json.loads(response.get_data())['entries']] == ['print.2', 'print.1']
+    etag = response.headers['ETag']
+
+    assert call(dict(limit=2), etag).status_code == 304
+    # Another page, or a new entry, is another version
+    assert call(dict(limit=2, offset=2), etag).status_code == 200
+    plugin.upload_history.record('print.3', DONE, 2000.0)
+    response = call(dict(limit=2), etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+    assert call(dict(limit='many')).status_code == 400
+
+
+def test_imports_legacy_csv_once(tmp_path):
+    csv_path = tmp_path / LEGACY_CSV_FILENAME
+    csv_path.write_text('"print.1","Tuesday, March 07, 2023"\n"print.2","not a date"\n\n')
+
+    history = history_of(tmp_path)
+    total, entries = history.query()
+    assert total == 2
+    assert [(entry['name'], entry['status']) for entry in entries] == [('print.1', DONE), ('print.2', DONE)]
+    assert entries[0]['uploaded_at'] == datetime(2023, 3, 7).timestamp()
+    assert entries[1]['uploaded_at'] == 0
+    assert not csv_path.exists()
+    assert (tmp_path / (LEGACY_CSV_FILENAME + '.imported')).exists()
+
+    # Started again, e.g. after a restart: nothing is imported twice
+    assert history_of(tmp_path).query()[0] == 2
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+
+import pytest
+
+from octoprint_celestrius.frame_container import FrameContainerWriter
+from octoprint_celestrius.governor import ResourceGovernor
+from octoprint_celestrius.packager import iter_archive_chunks
+from octoprint_celestrius.upload import LocalDirectoryUploadSink
+from octoprint_celestrius.upload_queue import DONE, EVICTED, FAILED, PENDING, RETRY_BASE_SECS, UploadQueue
+from testsupport import new_plugin
+
+
+class RecordingSink(LocalDirectoryUploadSink):
+    # Keeps the offset of every chunk sent, and fails the send after fail_after of them if set
+
+    def __init__(self, directory, fail_after=None):
+        super().__init__(directory)
+        self.fail_after = fail_after
+        self.begun = 0
+        self.offsets = []
+
+    def begin(self, name, content_type):
+        self.begun += 1
+        return super().begin(name, content_type)
+
+    def send(self, upload_id, offset, chunk, final):
+        if self.fail_after is not None and len(self.offsets) >= self.fail_after:
+            raise IOError('Connection reset')
+        self.offsets.append(offset)
+        super().send(upload_id, offset, chunk, final)
+
+
+class BrokenSink(RecordingSink):
+
+    def begin(self, name, content_type):
+        raise IOError('Service unavailable')
+
+
+def paused_queue(tmp_path, sink=None, on_done=None):
+    # The worker waits, as while a print is running, so jobs are only processed when the test calls _process()
+    test_thread = threading.current_thread()
+    governor = ResourceGovernor(should_pause=lambda: threading.current_thread() is not test_thread)
+    queue = UploadQueue(str(tmp_path / 'upload_queue.db'), sink or LocalDirectoryUploadSink(str(tmp_path / 'uploads')),
+                        governor, on_done=on_done)
+    queue.start()
+    return queue
+
+
+def print_data(data_dirname, num_frames=3, frame_size=600 * 1024):
+    # Big enough for an uncompressed archive of more than one chunk
+    with FrameContainerWriter(str(data_dirname)) as writer:
+        for i in range(num_frames):
+            writer.append(float(i), os.urandom(frame_size), 1.0, 0)
+    return str(data_dirname)
+
+
+def job_of(queue, data_dirname):
+    return next(job for job in queue.pending_jobs() if job.data_dirname == data_dirname)
+
+
+def test_retries_back_off_exponentially(tmp_path):
+    data_dirname = print_data(tmp_path / 'data' / 'print.1', num_frames=1, frame_size=10)
+    queue = paused_queue(tmp_path, sink=BrokenSink(str(tmp_path / 'uploads')))
+    queue.enqueue(data_dirname, 'print.1.tar', False)
+
+    for attempts in (1, 2, 3):
+        before = time.time()
+        queue._process(job_of(queue, data_dirname))
+        job = job_of(queue, data_dirname)
+        assert job.attempts == attempts
+        delay = RETRY_BASE_SECS * 2 ** (attempts - 1)
+        assert before + delay <= job.next_attempt_at <= time.time() + delay
+    # Not due yet, so not picked before another job that is
+    queue.enqueue(print_data(tmp_path / 'data' / 'print.2', num_frames=1, frame_size=10), 'print.2.tar', False)
+    assert queue._next_job().data_dirname.endswith('print.2')
+
+
+def test_resumes_after_restart_from_committed_offset(tmp_path):
+    data_dirname = print_data(tmp_path / 'data' / 'print.1')
+    archive = b''.join(iter_archive_chunks(data_dirname, False))
+    sink = RecordingSink(str(tmp_path / 'uploads'), fail_after=1)
+    queue = paused_queue(tmp_path, sink=sink)
+    queue.enqueue(data_dirname, 'print.1.tar', False)
+    queue._process(job_of(queue, data_dirname))
+    job = job_of(queue, data_dirname)
+    assert job.attempts == 1 and job.upload_id
+
+    # OctoPrint restarts: a new queue on the same database, a new sink on the same directory
+    sink = RecordingSink(str(tmp_path / 'uploads'))
+    done = []
+    queue = paused_queue(tmp_path, sink=sink, on_done=lambda job, result: done.append(result))
+    queue._process(job_of(queue, data_dirname))
+
+    assert sink.begun == 0
+    assert sink.offsets[0] > 0
+    assert (tmp_path / 'uploads' / 'print.1.tar').read_bytes() == archive
+    assert [result.status for result in done] == [DONE]
+    assert queue.stats() == {DONE: 1}
+
+
+def test_missing_data_fails_the_job(tmp_path):
+    done = []
+    queue = paused_queue(tmp_path, on_done=lambda job, result: done.append(result))
+    data_dirname = str(tmp_path / 'data' / 'gone.1')
+    queue.enqueue(data_dirname, 'gone.1.tgz', True)
+    queue._process(job_of(queue, data_dirname))
+
+    assert queue.stats() == {FAILED: 1}
+    assert [(result.status, result.size_bytes) for result in done] == [(FAILED, None)]
+    assert queue._next_job() is None
+
+
+def test_job_evicted_after_it_was_picked_is_not_uploaded(tmp_path):
+    data_dirname = print_data(tmp_path / 'data' / 'print.1', num_frames=1, frame_size=10)
+    sink = RecordingSink(str(tmp_path / 'uploads'))
+    queue = paused_queue(tmp_path, sink=sink)
+    queue.enqueue(data_dirname, 'print.1.tgz', True)
+    job = queue._next_job()
+
+    queue.evict(data_dirname)
+    queue._process(job)
+
+    assert sink.begun == 0
+    assert queue.stats() == {EVICTED: 1}
+
+
+def test_job_being_uploaded_is_not_evictable(tmp_path):
+    data_dirname = print_data(tmp_path / 'data' / 'print.1', num_frames=1, frame_size=10)
+    queue = paused_queue(tmp_path)
+    queue.enqueue(data_dirname, 'print.1.tgz', True)
+    queue._active_dirname = data_dirname
+
+    assert queue.evictable_dirnames() == []
+    with pytest.raises(RuntimeError):
+        queue.evict(data_dirname)
+
+
+def test_leftover_data_of_both_layouts_is_queued(tmp_path):
+    data_folder = tmp_path / 'data'
+    with FrameContainerWriter(str(data_folder / 'container.1')) as writer:
+        writer.append(1.0, b'jpg', 1.0, 0)
+    legacy = data_folder / 'legacy.2'
+    legacy.mkdir()
+    (legacy / '1.0.jpg').write_bytes(b'jpg')
+    (legacy / '1.0.labels').write_text('flow_rate:1.0\nz_offset:0\n')
+    (data_folder / 'empty.3').mkdir()
+    (data_folder / 'old.tgz').write_bytes(b'tgz')
+
+    plugin = new_plugin(data_folder)
+    plugin.upload_queue = paused_queue(tmp_path)
+    plugin.enqueue_leftover_data()
+    plugin.enqueue_leftover_data()
+
+    assert [os.path.basename(job.data_dirname) for job in plugin.upload_queue.pending_jobs()] == \
+        ['container.1', 'legacy.2']
+
+
+def test_evictable_data_oldest_first(tmp_path):
+    data_folder = tmp_path / 'data'
+    data_folder.mkdir()
+    plugin = new_plugin(data_folder)
+    plugin.upload_queue = queue = paused_queue(tmp_path)
+    for name in ('pending.1', 'failed.2', 'done.3', 'legacy.4'):
+        (data_folder / name).mkdir()
+        (data_folder / name / '1.0.jpg').write_bytes(b'jpg')
+    (data_folder / 'old.tgz').write_bytes(b'tgz')
+    for name in ('pending.1', 'failed.2', 'done.3'):
+        queue.enqueue(str(data_folder / name), name + '.tgz', True)
+    jobs = {os.path.basename(job.data_dirname): job for job in queue.pending_jobs()}
+    queue._update(jobs['failed.2'].id, status=FAILED)
+    queue._update(jobs['done.3'].id, status=DONE)
+    queue.enqueue(str(data_folder / 'gone.5'), 'gone.5.tgz', True)
+    for age, name in enumerate(('legacy.4', 'failed.2', 'old.tgz', 'pending.1')):
+        os.utime(data_folder / name, (1000 + age, 1000 + age))
+
+    assert [os.path.basename(path) for path in plugin.list_evictable_data()] == \
+        ['legacy.4', 'failed.2', 'old.tgz', 'pending.1']
+
+    queue.evict(str(data_folder / 'failed.2'))
+    assert queue.stats() == {PENDING: 2, DONE: 1, EVICTED: 1}
@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from octoprint_celestrius.webcam import MjpegStreamCapture, MultipartJpegParser, SnapshotCapture
+from testsupport import BOUNDARY, jpeg, jpeg_number, multipart, webcam_server, webcam_url
+
+
+@pytest.fixture
+def server():
+    httpd = webcam_server()
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.stopping = True
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_snapshot_capture_reuses_connection(server):
+    capture = SnapshotCapture(webcam_url(server, '/snapshot'))
+    try:
+        frames = [capture.capture() for _ in range(5)]
+    finally:
+        capture.close()
+    assert frames == [jpeg(i) for i in range(1, 6)]
+    assert server.connections == 1
+
+
+def test_snapshot_capture_raises_on_http_error(server):
+    capture = SnapshotCapture(webcam_url(server, '/missing'))
+    try:
+        with pytest.raises(Exception):
+            capture.capture()
+    finally:
+        capture.close()
+
+
+@pytest.mark.parametrize('path', ['/stream', '/stream-nolength'])
+def test_mjpeg_stream_capture_returns_each_frame_once(server, path):
+    capture = MjpegStreamCapture(webcam_url(server, path))
+    try:
+        frames = [capture.capture() for _ in range(5)]
+    finally:
+        capture.close()
+
+    numbers = [jpeg_number(jpg) for jpg in frames]
+    assert all(jpg == jpeg(n) for jpg, n in zip(frames, numbers))
+    assert numbers == sorted(set(numbers))
+    assert server.connections == 1
+
+
+@pytest.mark.parametrize('content_length', [True, False])
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_multipart_parser_handles_split_chunks(content_length, chunk_size):
+    frames = [jpeg(i) for i in range(1, 4)]
+    # Without Content-Length a part only ends at the next boundary, so the last one is held back
+    body = multipart(frames, content_length) + BOUNDARY + b'\r\n'
+
+    parser = MultipartJpegParser(BOUNDARY)
+    parsed = []
+    for i in range(0, len(body), chunk_size):
+        parsed.extend(parser.feed(body[i:i + chunk_size]))
+    assert parsed == frames
+
+
+def test_multipart_parser_waits_for_complete_body():
+    jpg = jpeg(1)
+    body = multipart([jpg])
+    parser = MultipartJpegParser(BOUNDARY)
+    assert parser.feed(body[:-len(jpg) // 2]) == []
+    assert parser.feed(body[-len(jpg) // 2:]) == [jpg]
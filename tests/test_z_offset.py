@@ -0,0 +1,111 @@
+import pytest
+
+from octoprint_celestrius.gcode_object import OFFICIAL_Z_TAG_PREFIX, Z_OFFSET_TAG_PREFIX
+from testsupport import AT_COMMAND, SLICERS, Plate, Replay, new_plugin
+
+NUM_OBJECTS = 4
+
+
+def replay(tmp_path, slicer, filename, **sample):
+    # A whole print of a multi-object plate through the hooks, keeping what the printer was sent
+    r = Replay(Plate(slicer, slicer, filename, None), str(tmp_path), num_objects=NUM_OBJECTS, num_layers=3,
+               segments=8, **sample)
+    r.upload()
+    r.start()
+    r.run(record=True)
+    r.finish()
+    return r
+
+
+def z_of(cmd):
+    for token in cmd.split()[1:]:
+        if token[:1] == 'Z':
+            return float(token[1:])
+    return None
+
+
+def z_first(cmd):
+    tokens = cmd.split()
+    return tokens[0] in ('G0', 'G1') and len(tokens) > 1 and tokens[1][:1] == 'Z'
+
+
+def without_z(cmd):
+    return [token for token in cmd.split() if token[:1] != 'Z']
+
+
+@pytest.fixture(params=SLICERS)
+def plates(request, tmp_path):
+    plain = replay(tmp_path / 'plain', request.param, 'plate.gcode')
+    stepped = replay(tmp_path / 'stepped', request.param, 'celestrius_offset_plate.gcode')
+    return plain, stepped
+
+
+def test_objects_step_up_in_the_first_layer(plates):
+    _, stepped = plates
+    offsets = []
+    for _, state in stepped.sent:
+        if state.z_offset not in offsets:
+            offsets.append(state.z_offset)
+    assert offsets == [0, 0.1, 0.2, 0.3, 0.4]
+
+
+def test_no_extra_moves(plates):
+    plain, stepped = plates
+    assert len(stepped.sent) == len(plain.sent)
+    for (cmd, _), (original, _) in zip(stepped.sent, plain.sent):
+        # Only the Z of a move changes, and never on a move that extrudes without moving Z
+        assert without_z(cmd) == without_z(original)
+        if z_of(original) is None and any(token[:1] == 'E' for token in original.split()):
+            assert cmd == original
+
+
+def test_labels_match_the_height_sent(plates):
+    plain, stepped = plates
+    relative = False
+    checked = 0
+    for (cmd, state), (original, _) in zip(stepped.sent, plain.sent):
+        relative = {'G91': True, 'G90': False}.get(cmd, relative)
+        # Every rewritten move, and every move the sent hook takes the height from: "G0/G1 Z..."
+        if relative or (cmd == original and not z_first(cmd)):
+            continue
+        assert z_of(cmd) == pytest.approx(state.official_z + state.z_offset)
+        checked += 1
+    assert checked
+
+
+def test_relative_moves_keep_their_z(plates):
+    plain, stepped = plates
+    # The end G-code lifts the nozzle with G91 "G1 Z10"
+    assert [cmd for cmd, _ in stepped.sent][-10:] == [cmd for cmd, _ in plain.sent][-10:]
+
+
+def test_offset_published_when_the_move_is_sent(tmp_path):
+    r = Replay(Plate('prusaslicer', 'prusaslicer', 'celestrius_offset_plate.gcode', None), str(tmp_path),
+               num_objects=NUM_OBJECTS, num_layers=2, segments=8)
+    r.upload()
+    r.start()
+    reptag = r.plugin.gcode_object.reptag
+    first_object = next(i for i, event in enumerate(r.events) if event[0] == AT_COMMAND and event[1] == reptag)
+
+    r.run(events=r.events[:first_object + 1], record=True)
+    # The object has started in the queue, but the printer hasn't been sent anything at the new height yet
+    assert r.plugin.label_state.num_gcode_objects_seen == 1
+    assert r.plugin.label_state.z_offset == 0
+
+    r.run(events=r.events[first_object + 1:first_object + 2], record=True)
+    cmd, state = r.sent[-1]
+    assert state.z_offset == 0.1
+    assert z_of(cmd) == pytest.approx(state.official_z + 0.1)
+    r.finish()
+
+
+def test_untagged_z_move_publishes_no_offset(tmp_path):
+    plugin = new_plugin(tmp_path)
+    # The sent hook only looks for the tags while the queuing hook may be adding them
+    plugin.gcode_object.request_z_offset(0.2)
+    tags = {OFFICIAL_Z_TAG_PREFIX + '0.3', Z_OFFSET_TAG_PREFIX + '0.2'}
+    plugin.sent_gcode(None, 'sent', 'G0 X10 Y10 Z0.5', None, 'G0', None, tags)
+    assert (plugin.label_state.official_z, plugin.label_state.z_offset) == (0.3, 0.2)
+
+    plugin.sent_gcode(None, 'sent', 'G1 Z0.5', None, 'G1', None, {'source:file'})
+    assert (plugin.label_state.official_z, plugin.label_state.z_offset) == (0.5, 0)
@@ -0,0 +1,451 @@
+# Stand-ins shared by the tests and the benchmarks: just enough of OctoPrint's printer, settings and file manager to
+# drive the plugin's hooks outside OctoPrint, synthetic G-code in the shape each supported slicer writes it, whole
+# prints replayed through the hooks the way OctoPrint drives them, and a webcam.
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import octoprint.plugin
+import octoprint.settings
+from octoprint.events import Events
+from octoprint.filemanager.util import StreamWrapper
+
+from octoprint_celestrius import CelestriusPlugin
+
+# OctoPrint's settings, printer and file manager
+
+_octoprint_basedir = None
+
+
+def init_octoprint():
+    """
+    Initialize OctoPrint's global settings, in a temporary base folder, and an empty plugin manager, once per
+    process. Needed by code that asks OctoPrint about file types, like the upload preprocessor.
+    """
+    global _octoprint_basedir
+    if _octoprint_basedir is not None:
+        return
+    _octoprint_basedir = tempfile.mkdtemp(prefix='celestrius-octoprint-')
+    octoprint.settings.settings(init=True, basedir=_octoprint_basedir)
+    octoprint.plugin.plugin_manager(init=True, plugin_folders=[], plugin_bases=[octoprint.plugin.OctoPrintPlugin],
+                                    plugin_entry_points=[], plugin_disabled_list=[])
+
+
+class StubSettings():
+
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, path):
+        return self.values.get(path[0])
+
+    def get_int(self, path):
+        value = self.get(path)
+        return int(value) if value is not None else None
+
+    def get_boolean(self, path):
+        return bool(self.get(path))
+
+    def set(self, path, value):
+        self.values[path[0]] = value
+
+
+class StubPrinter():
+
+    def __init__(self):
+        self.state_id = 'OPERATIONAL'
+        self.job_name = None
+        self.origin = 'local'
+        self.filepos = None
+        self.temperatures = {}
+
+    def get_state_id(self):
+        return self.state_id
+
+    def is_printing(self):
+        return self.state_id == 'PRINTING'
+
+    def get_current_job(self):
+        return {'file': {'name': self.job_name, 'origin': self.origin}}
+
+    def get_current_data(self):
+        return {'job': self.get_current_job(), 'progress': {'filepos': self.filepos}}
+
+    def set_temperature(self, heater, value):
+        self.temperatures[heater] = value
+
+
+class StubFileManager():
+    # Local files are stored under their own path
+
+    def path_on_disk(self, destination, path):
+        return path
+
+
+def new_plugin(data_folder, **settings):
+    """
+    :param data_folder: plugin data folder, e.g. a pytest tmp_path
+    :param settings: overrides of the plugin's settings defaults
+    :return: plugin with stubs in place of OctoPrint, hooks ready to be called; no threads started
+    """
+    plugin = CelestriusPlugin()
+    values = plugin.get_settings_defaults()
+    values.update(dict(enabled=True, terms_accepted=True, pilot_email='pilot@example.com'))
+    values.update(settings)
+    plugin._settings = StubSettings(values)
+    plugin._printer = StubPrinter()
+    plugin._file_manager = StubFileManager()
+    plugin._data_folder = str(data_folder)
+    plugin._plugin_version = 'test'
+    plugin.gcode_object.initialize()
+    plugin.update_collect_enabled()
+    plugin.update_metrics_enabled()
+    return plugin
+
+
+# G-code samples: header, start G-code, per-object markers, layer changes, travel and extrusion moves. Deterministic,
+# so runs can be compared.
+
+SLICERS = ('simplify3d', 'cura', 'prusaslicer', 'ideamaker')
+
+_HEADERS = {
+    'simplify3d': ['; G-Code generated by Simplify3D(R) Version 4.1.2', '; Feb 12, 2023 at 10:14:02 AM',
+                   ';   layerHeight,0.2', ';   extruderDiameter,0.4'],
+    'cura': [';FLAVOR:Marlin', ';TIME:1805', ';Filament used: 1.2345m', ';Layer height: 0.2',
+             ';Generated with Cura_SteamEngine 5.2.1'],
+    'prusaslicer': ['; generated by PrusaSlicer 2.5.0+linux-x64-GTK3 on 2023-02-12 at 10:14:02 UTC', ';',
+                    '; external perimeters extrusion width = 0.45mm'],
+    'ideamaker': [';Sliced by ideaMaker 4.2.3.5200, 2023-02-12 10:14:02', ';Dimension:235.000000 235.000000 250.000000 0.400000',
+                  ';Estimated Print Time:1805'],
+}
+
+START_GCODE = ['M140 S60', 'M104 S210', 'M190 S60', 'M109 S210', 'G28', 'G90', 'M82', 'G92 E0',
+               'G1 Z2.0 F3000', 'G1 X0.1 Y20 Z0.3 F5000.0', 'G1 X0.1 Y200.0 Z0.3 F1500.0 E15',
+               'G1 X0.4 Y200.0 Z0.3 F5000.0', 'G1 X0.4 Y20 Z0.3 F1500.0 E30', 'G92 E0', 'G1 Z2.0 F3000']
+END_GCODE = ['G91', 'G1 E-2 F2700', 'G1 Z10 F600', 'G90', 'G1 X0 Y220 F3000', 'M106 S0', 'M104 S0',
+             'M140 S0', 'M84 X Y E']
+
+
+def _object_name(slicer, i):
+    if slicer == 'cura':
+        return 'cube_{0}.stl'.format(i)
+    if slicer == 'prusaslicer':
+        return 'cube.stl id:{0} copy 0'.format(i)
+    return 'cube_{0}'.format(i)
+
+
+def _center(i):
+    return 40.0 + 45.0 * (i % 4), 40.0 + 45.0 * (i // 4)
+
+
+def _object_start(slicer, name, layer, z):
+    if slicer == 'simplify3d':
+        return ['; process {0}'.format(name), '; layer {0}, Z = {1:.3f}'.format(layer + 1, z), '; feature outer perimeter']
+    if slicer == 'cura':
+        return [';MESH:{0}'.format(name), ';TYPE:WALL-OUTER']
+    if slicer == 'prusaslicer':
+        return ['; printing object {0}'.format(name), ';TYPE:External perimeter']
+    return [';PRINTING: {0}'.format(name), ';TYPE:WALL-OUTER']
+
+
+def _object_end(slicer, name):
+    if slicer == 'prusaslicer':
+        return ['; stop printing object {0}'.format(name)]
+    return []
+
+
+def _layer_start(slicer, layer, z):
+    if slicer == 'cura':
+        return [';LAYER:{0}'.format(layer)]
+    if slicer == 'prusaslicer':
+        return [';LAYER_CHANGE', ';Z:{0:.3f}'.format(z), ';HEIGHT:0.2']
+    if slicer == 'ideamaker':
+        return [';LAYER:{0}'.format(layer), ';Z:{0:.3f}'.format(z), ';HEIGHT:0.200000']
+    return []
+
+
+def sample_lines(slicer, num_objects=3, num_layers=5, segments=32, first_layer_z=0.3, layer_height=0.2,
+                 relative_e=False):
+    """
+    :param slicer: one of SLICERS
+    :param segments: extrusion moves per object per layer
+    :return: the lines of a G-code file as the slicer would write it, without line endings
+    """
+    lines = list(_HEADERS[slicer])
+    names = [_object_name(slicer, i) for i in range(num_objects)]
+    if slicer == 'prusaslicer':
+        # Label objects, as SuperSlicer and recent PrusaSlicer write them
+        for i, name in enumerate(names):
+            cx, cy = _center(i)
+            lines.append('; object:' + json.dumps(dict(name=name.split(' id:')[0], id=name,
+                                                      object_center=[cx, cy, 0], boundingbox_center=[cx, cy, 2.5])))
+    lines += START_GCODE
+    lines.append('M83' if relative_e else 'M82')
+
+    e = 0.0
+    for layer in range(num_layers):
+        z = round(first_layer_z + layer * layer_height, 3)
+        lines += _layer_start(slicer, layer, z)
+        if not relative_e:
+            lines.append('G92 E0')
+            e = 0.0
+        lines.append('G1 Z{0:.3f} F600'.format(z))
+        for i, name in enumerate(names):
+            lines += _object_start(slicer, name, layer, z)
+            cx, cy = _center(i)
+            lines.append('G0 F9000 X{0:.3f} Y{1:.3f}'.format(cx + 10, cy))
+            for s in range(1, segments + 1):
+                angle = 2 * math.pi * s / segments
+                step = 0.0415
+                e = step if relative_e else round(e + step, 5)
+                lines.append('G1 X{0:.3f} Y{1:.3f} E{2:.5f}'.format(cx + 10 * math.cos(angle), cy + 10 * math.sin(angle), e))
+            # Retract, z-hop and travel out of the object
+            lines.append('G1 E{0:.5f} F2700'.format(-0.8 if relative_e else e - 0.8))
+            lines.append('G1 Z{0:.3f} F600'.format(z + 0.4))
+            lines.append('G1 Z{0:.3f} F600'.format(z))
+            lines.append('G1 E{0:.5f} F2700'.format(0.8 if relative_e else e))
+            lines += _object_end(slicer, name)
+        if layer == 1:
+            lines.append('M221 S95')
+    lines += END_GCODE
+    return lines
+
+
+def sample_bytes(slicer, **kwargs):
+    return ''.join(line + '\n' for line in sample_lines(slicer, **kwargs)).encode('ascii')
+
+
+def commands(lines):
+    """
+    :return: (cmd, gcode, tags) for every line OctoPrint would send to the printer while printing the file: comments
+             stripped, the gcode parsed out ("G1", "M221", ...) and the tags OctoPrint gives lines read from a file.
+             @ commands are left out.
+    """
+    result = []
+    position = 0
+    for number, line in enumerate(lines, 1):
+        position += len(line) + 1
+        cmd = line.split(';', 1)[0].strip()
+        if not cmd or cmd[0] == '@':
+            continue
+        gcode = cmd.split(None, 1)[0].upper()
+        tags = {'source:file', 'filepos:{}'.format(position), 'fileline:{}'.format(number)}
+        result.append((cmd, gcode if gcode[:1] in 'GMT' and gcode[1:].isdigit() else None, tags))
+    return result
+
+
+# Replayed prints: the upload preprocessor, PRINT_STARTED, then every line of the stored file through the @ command
+# and queuing hooks, and whatever the queuing hook lets through into the sent hook.
+
+Plate = namedtuple('Plate', ['name', 'slicer', 'filename', 'cancel_object'])
+
+PLATES = (
+    Plate('simplify3d', 'simplify3d', 'plate_s3d.gcode', None),
+    Plate('cura', 'cura', 'plate_cura.gcode', None),
+    Plate('prusaslicer', 'prusaslicer', 'plate_prusa.gcode', None),
+    Plate('ideamaker', 'ideamaker', 'plate_ideamaker.gcode', None),
+    # Object 1 is cancelled a third into the print, so its blocks go through the skipping path from then on
+    Plate('cancel', 'prusaslicer', 'cancel_plate.gcode', 1),
+    # "celestrius" and "offset" in the name start the Z offset test: each object is printed a step higher
+    Plate('z-offset', 'cura', 'celestrius_offset_plate.gcode', None),
+)
+
+# Kinds of Replay.events: (AT_COMMAND, command, parameters), (GCODE, cmd, gcode, tags, filepos), (CANCEL, object id)
+AT_COMMAND, GCODE, CANCEL = range(3)
+
+
+def _gcode(cmd):
+    gcode = cmd.split(None, 1)[0].upper()
+    return gcode if gcode[:1] in 'GMT' and gcode[1:].isdigit() else None
+
+
+def _queued(result, cmd, cmd_type, tags):
+    # What a queuing hook's return value puts in the send queue, as OctoPrint reads it
+    if result is None:
+        return [(cmd, tags)]
+    if isinstance(result, str):
+        return [(result, tags)]
+    if isinstance(result, tuple):
+        if not result or result[0] is None:
+            return []
+        return [(result[0], result[2] if len(result) > 2 and result[2] is not None else tags)]
+    queued = []
+    for item in result:
+        queued += _queued(item, cmd, cmd_type, tags)
+    return queued
+
+
+class Replay():
+    # One print of one plate, from the upload to PRINT_DONE, on a fresh plugin unless one is given
+
+    def __init__(self, plate, folder, num_objects=4, num_layers=20, segments=32, plugin=None):
+        init_octoprint()
+        self.plate = plate
+        self.path = os.path.join(folder, plate.filename)
+        self.data = sample_bytes(plate.slicer, num_objects=num_objects, num_layers=num_layers, segments=segments)
+        if plugin is None:
+            data_folder = os.path.join(folder, 'data')
+            os.makedirs(data_folder, exist_ok=True)
+            plugin = new_plugin(data_folder)
+        self.plugin = plugin
+        self.events = None
+        self.num_lines = 0
+        # Every command that reached the printer, with the label state right after the sent hook saw it
+        self.sent = []
+
+    def upload(self, wrap_process_line=None):
+        """
+        Run the preprocessor hook over the sample and store its output where the print reads it from.
+        :param wrap_process_line: optional decorator for the preprocessor's per-line function, to measure it
+        """
+        file_object = StreamWrapper(self.plate.filename, io.BytesIO(self.data))
+        stream = self.plugin.gcode_object.modify_file(self.path, file_object).stream()
+        if wrap_process_line:
+            stream.process_line = wrap_process_line(stream.process_line)
+        with open(self.path, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+
+    def start(self):
+        self.load_events()
+        printer = self.plugin._printer
+        printer.state_id = 'PRINTING'
+        printer.job_name = self.plate.filename
+        self.plugin.on_event(Events.PRINT_STARTED, dict(name=self.plate.filename, path=self.path, origin='local'))
+
+    def finish(self):
+        self.plugin._printer.state_id = 'OPERATIONAL'
+        self.plugin.on_event(Events.PRINT_DONE, dict(name=self.plate.filename, path=self.path, origin='local'))
+
+    def load_events(self):
+        events = []
+        position = 0
+        with open(self.path, 'rb') as f:
+            for number, raw in enumerate(f, 1):
+                position += len(raw)
+                line = raw.decode('utf-8').split(';', 1)[0].strip()
+                if not line:
+                    continue
+                if line[0] == '@':
+                    command, _, parameters = line[1:].partition(' ')
+                    events.append((AT_COMMAND, command, parameters.strip()))
+                else:
+                    tags = {'source:file', 'filepos:{}'.format(position), 'fileline:{}'.format(number)}
+                    events.append((GCODE, line, _gcode(line), tags, position))
+        if self.plate.cancel_object is not None:
+            events.insert(len(events) // 3, (CANCEL, self.plate.cancel_object))
+        self.events = events
+        self.num_lines = sum(1 for event in events if event[0] != CANCEL)
+
+    def run(self, check_atcommand=None, check_queue=None, sent_gcode=None, record=False, events=None):
+        """
+        Feed every line to the hooks, the plugin's own unless others are given.
+        :param record: keep what was sent, with the label state after each, in self.sent
+        :param events: only this slice of self.events, to pace a print
+        """
+        gcode_object = self.plugin.gcode_object
+        check_atcommand = check_atcommand or gcode_object.check_atcommand
+        check_queue = check_queue or gcode_object.check_queue
+        sent_gcode = sent_gcode or self.plugin.sent_gcode
+        printer = self.plugin._printer
+        for event in self.events if events is None else events:
+            kind = event[0]
+            if kind == AT_COMMAND:
+                check_atcommand(None, 'queuing', event[1], event[2])
+            elif kind == GCODE:
+                _, cmd, gcode, tags, position = event
+                for queued_cmd, queued_tags in _queued(check_queue(None, 'queuing', cmd, None, gcode, tags),
+                                                       cmd, None, tags):
+                    printer.filepos = position
+                    sent_gcode(None, 'sent', queued_cmd, None, _gcode(queued_cmd), None, queued_tags)
+                    if record:
+                        self.sent.append((queued_cmd, self.plugin.label_state))
+            else:
+                gcode_object._cancel_object(event[1])
+
+
+# A webcam, served on a local port
+
+BOUNDARY = b'--celestriusframe'
+
+
+def jpeg(i):
+    # Numbered, and sizes differ by more than the sampling policy's duplicate threshold, so every frame is kept
+    return b'\xff\xd8' + b'%08d' % i + bytes(range(256)) * (4 + i % 8) + b'\xff\xd9'
+
+
+def jpeg_number(jpg):
+    return int(jpg[2:10])
+
+
+def multipart(frames, content_length=True):
+    body = b''
+    for jpg in frames:
+        body += BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+        if content_length:
+            body += 'Content-Length: {}\r\n'.format(len(jpg)).encode('ascii')
+        body += b'\r\n' + jpg + b'\r\n'
+    return body
+
+
+class WebcamHandler(BaseHTTPRequestHandler):
+    # Stand-in for mjpg-streamer: /snapshot returns one JPEG, /stream and /stream-nolength an endless
+    # multipart/x-mixed-replace body, with and without per-part Content-Length. Frames are numbered across
+    # connections, counted on the server.
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def next_jpeg(self):
+        self.server.frames += 1
+        return jpeg(self.server.frames)
+
+    def do_GET(self):
+        if self.path == '/snapshot':
+            jpg = self.next_jpeg()
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(jpg)))
+            self.end_headers()
+            self.wfile.write(jpg)
+        elif self.path in ('/stream', '/stream-nolength'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary="{}"'.format(BOUNDARY[2:].decode()))
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            try:
+                while not self.server.stopping:
+                    self.wfile.write(multipart([self.next_jpeg()], content_length=self.path == '/stream'))
+                    self.wfile.flush()
+                    time.sleep(0.01)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            self.close_connection = True
+        else:
+            self.send_error(404)
+
+
+def webcam_server():
+    """
+    :return: a webcam server on a free local port, not serving yet; run its serve_forever() in a thread or process
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WebcamHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.frames = 0
+    server.stopping = False
+    return server
+
+
+def webcam_url(server, path):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)